@@ -1,92 +1,628 @@
-import requests
+#!/usr/bin/env python3
+"""
+Open-loop load generator for the customer sites behind the proxy engines.
+
+Each target gets requests at a fixed arrival rate (REQUESTS_PER_SECOND),
+scheduled on a timeline that does not wait for earlier responses, so a slow
+target does not lower the offered load. Requests go over pooled keep-alive
+connections (at most CONNECTIONS per target). Latency is measured from the
+request's intended send time, so waiting for a connection or falling behind
+the schedule shows up in the percentiles instead of being hidden
+(coordinated omission).
+
+A request is successful when it answers 200 without "bot" in the body within
+TIMEOUT; otherwise it is blocked (late answers are counted as blocked too, as
+before, but their real latency is still recorded, up to HARD_TIMEOUT).
+Every STATS_INTERVAL seconds each target's window is printed: offered and
+completed rate, success rate, blocked / late / error counts, latency
+percentiles and the scheduler lag of the generator itself.
+
+One process tops out at a few thousand requests per second. With
+--processes N the coordinator starts N generator processes, each driving
+every target at rate / N over its share of the connections, with arrivals
+interleaved so the combined stream stays evenly spaced. Each process sends
+its windows (counters plus exported metrics.Histogram payloads) back over a
+queue; the coordinator sums them per window, so the printed percentiles are
+those of the whole fleet, not an average of per-process percentiles.
+
+Generators report every second. Each complete second of every target is
+appended to a run file in RUN_DIR (see runstore.py) together with the run's
+tags (--tag engine=fl2 --tag config=v42, or RUN_TAGS) and settings, so runs
+can be compared later with `python runstore.py compare`.
+
+    python benchmark.py --rate 2000 --duration 60 --connections 128
+    python benchmark.py --rate 10000 --processes 4 --duration 60 --tag engine=fl2
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import multiprocessing
+import os
+import queue
 import time
-import threading
+import urllib.parse
+
+import metrics
+import runstore
 
 URLS = [
-    "http://proxy-server-fl-bot-manager-off:50001/", 
-    "http://proxy-server-fl-bot-manager-on:50001/", 
+    "http://proxy-server-fl-bot-manager-off:50001/",
+    "http://proxy-server-fl-bot-manager-on:50001/",
     "http://proxy-server-fl2:50001/",   # FL2
 ]
 
-REQUESTS_PER_SECOND = 10
-TIMEOUT = 0.1  # 100 ms
-STATS_INTERVAL = 100  # every 100 requests
+REQUESTS_PER_SECOND = float(os.getenv("REQUESTS_PER_SECOND", "10"))   # 每个目标
+TIMEOUT = float(os.getenv("TIMEOUT", "0.1"))  # 100 ms：超过即判为失败
+HARD_TIMEOUT = float(os.getenv("HARD_TIMEOUT", "10"))  # 等待响应的上限，之前的真实延迟照常记录
+CONNECTIONS = int(os.getenv("CONNECTIONS", "64"))       # 每个目标的 keep-alive 连接上限
+STATS_INTERVAL = int(os.getenv("STATS_INTERVAL", "10"))  # 秒：报告最近这么多秒的滑动窗口
+PROCESSES = int(os.getenv("PROCESSES", "1"))            # 生成负载的进程数
+START_DELAY = 0.5      # 多进程：留给子进程启动的时间，之后同时开始
+SERIES_STEP = 1.0      # 秒：生成进程上报、运行文件记录的粒度
+RUN_DIR = os.getenv("RUN_DIR", "runs")       # 运行文件目录；为空则不保存
+RUN_TAGS = os.getenv("RUN_TAGS", "")         # 例如 "engine=fl2,config=v42"
+STATS_PATH = os.getenv("STATS_PATH", "/stats")   # 代理的 /stats，用于追踪配置版本；为空则不轮询
+WORKER_STATS = os.getenv("WORKER_STATS", "")     # 额外追踪的 worker，例如 "http://kv-worker:8081"
+CONFIG_POLL = 1.0      # 秒：配置版本轮询间隔
 
-stats = {
-    url: {"success": 0, "blocked": 0, "total": 0}
-    for url in URLS
+# 与原先 requests.get 发出的请求头一致，bot 评分结果不变
+HEADERS = {
+    "User-Agent": "python-requests/2.31.0",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "*/*",
+    "Connection": "keep-alive",
 }
 
-lock = threading.Lock()
 
+# ================================
+# keep-alive HTTP/1.1 客户端
+# ================================
+class Pool:
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
 
-def check_request(url):
-    try:
-        r = requests.get(url, timeout=TIMEOUT)
-        # 判断是否成功访问
-        success = r.status_code == 200 and ("bot" not in r.text)
-
-        with lock:
-            stats[url]["total"] += 1
-            if success:
-                stats[url]["success"] += 1
-            else:
-                stats[url]["blocked"] += 1
-
-    except Exception:
-        # 超时也视为失败（被拦截）
-        with lock:
-            stats[url]["total"] += 1
-            stats[url]["blocked"] += 1
-
-
-def worker(url):
-    """每个 URL 的请求线程"""
+    async def acquire(self):
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.opened += 1
+        return reader, writer
+
+    def release(self, conn, reusable):
+        if reusable:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+        self._slots.release()
+
+
+async def _read_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        parts = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return b"".join(parts), True
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    length = headers.get("content-length")
+    if length is not None:
+        return await reader.readexactly(int(length)), True
+    return await reader.read(), False
+
+
+async def fetch(conn, request):
+    """(status, body, reusable) for one request on an open connection."""
+    reader, writer = conn
+    writer.write(request)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed before response")
+    status = int(status_line.split(None, 2)[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body, framed = await _read_body(reader, headers)
+    reusable = framed and headers.get("connection", "").lower() != "close"
+    return status, body, reusable
+
+
+# ================================
+# 统计
+# ================================
+# 合并时取最大值的字段（其余数值求和）
+GAUGES = frozenset({"seconds", "max_us", "config_version"})
+
+
+class Window:
+    def __init__(self, started):
+        self.started = started              # loop.time()
+        self.sent = 0
+        self.done = 0
+        self.success = 0
+        self.blocked = 0
+        self.late = 0           # 响应了但超过 TIMEOUT
+        self.errors = 0         # 连接失败 / HARD_TIMEOUT / 协议错误
+        self.latency = metrics.Histogram("latency", "", {})
+        self.lag = metrics.Histogram("lag", "", {})
+
+    def export(self, now):
+        return {
+            "seconds": max(0.0, now - self.started),
+            "sent": self.sent,
+            "done": self.done,
+            "success": self.success,
+            "blocked": self.blocked,
+            "late": self.late,
+            "errors": self.errors,
+            "latency": self.latency.export(),
+            "lag": self.lag.export(),
+        }
+
+
+def merge(into, payload):
+    """Add an exported window into `into`: counts and histogram buckets are summed, GAUGES keep the max."""
+    for key, value in payload.items():
+        if isinstance(value, dict):
+            merge(into.setdefault(key, {}), value)
+        elif not isinstance(value, (int, float)):
+            into.setdefault(key, value)
+        elif key in GAUGES:
+            into[key] = max(into.get(key, value), value)
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+class Target:
+    def __init__(self, url, connections, started):
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url
+        self.pool = Pool(parsed.hostname, parsed.port or 80, connections)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        lines = [f"GET {path} HTTP/1.1", f"Host: {parsed.netloc}"]
+        lines += [f"{k}: {v}" for k, v in HEADERS.items()]
+        self.request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        self.inflight = 0
+        self.window = Window(started)
+        self.config_version = None      # 代理 /stats 报告的配置版本（只有 0 号进程轮询）
+
+    async def visit(self, intended):
+        loop = asyncio.get_running_loop()
+        w = self.window
+        w.sent += 1
+        w.lag.record(max(0.0, loop.time() - intended))
+        self.inflight += 1
+        status = body = None
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), HARD_TIMEOUT)
+            reusable = False
+            try:
+                status, body, reusable = await asyncio.wait_for(
+                    fetch(conn, self.request), max(0.001, intended + HARD_TIMEOUT - loop.time()))
+            finally:
+                self.pool.release(conn, reusable)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            pass
+        finally:
+            self.inflight -= 1
+        latency = loop.time() - intended
+
+        # 完成时的窗口（期间可能已被 report 换掉）
+        w = self.window
+        w.done += 1
+        if status is None:
+            w.errors += 1
+            w.blocked += 1
+            return
+        w.latency.record(latency)
+        if latency > TIMEOUT:
+            w.late += 1
+            w.blocked += 1
+        elif status == 200 and b"bot" not in body:
+            w.success += 1
+        else:
+            w.blocked += 1
+
+    def rotate(self, now):
+        """Export the current window and start a new one."""
+        # 单线程事件循环：整体替换窗口，不会丢计数
+        window, self.window = self.window, Window(now)
+        payload = window.export(now)
+        payload["inflight"] = self.inflight
+        payload["connections"] = self.pool.opened
+        if self.config_version is not None:
+            payload["config_version"] = self.config_version
+        return payload
+
+
+def summarize(w, seconds=None):
+    seconds = max(1e-9, seconds if seconds is not None else w["seconds"])
+    done = w["done"]
+    latency = metrics.summarize({"l": w["latency"]})["l"]
+    lag = metrics.summarize({"l": w["lag"]})["l"]
+    return {
+        "seconds": round(seconds, 3),
+        "offered_rps": round(w["sent"] / seconds, 1),
+        "completed_rps": round(done / seconds, 1),
+        "success_rate": round(w["success"] / done, 4) if done else None,
+        "success": w["success"],
+        "blocked": w["blocked"],
+        "late": w["late"],
+        "errors": w["errors"],
+        "total": done,
+        "latency_ms": {k: latency[k] for k in ("p50_ms", "p99_ms", "p999_ms", "max_ms")},
+        "sched_lag_p99_ms": lag["p99_ms"],
+    }
+
+
+def print_summary(url, s, inflight=None, connections=None, config_version=None):
+    rate = "n/a" if s["success_rate"] is None else f"{s['success_rate']:.2%}"
+    lat = s["latency_ms"]
+    print(f"\n---- {url} ----")
+    print(f"Success rate: {rate}")
+    print(f"Success: {s['success']}")
+    print(f"Blocked: {s['blocked']} (late > {TIMEOUT * 1000:g} ms: {s['late']}, errors: {s['errors']})")
+    print(f"Total: {s['total']}")
+    print(f"Rate: offered {s['offered_rps']}/s, completed {s['completed_rps']}/s over {s['seconds']:.0f}s")
+    print(f"Latency ms: p50 {lat['p50_ms']}  p99 {lat['p99_ms']}  p999 {lat['p999_ms']}  max {lat['max_ms']}")
+    extra = f", in flight {inflight}, connections opened {connections}" if inflight is not None else ""
+    print(f"Scheduler lag p99: {s['sched_lag_p99_ms']} ms{extra}")
+    if config_version is not None:
+        print(f"Config version: {config_version}")
+    print("--------------------------\n")
+
+
+class Aggregator:
+    """
+    Merges the per-second reports of all generator processes. Second `tick` k
+    covers [start + k - 1, start + k) in every process and is complete once each
+    process still running has sent it. Complete seconds go to the run file and
+    to a sliding window of the last `report_every` seconds, which is printed
+    every `report_every` seconds. A process's last window (cut short by the end
+    of the run, or longer while it waits for answers still in flight) is sent as
+    the tick after its last full second, so processes that stop together still
+    report the same seconds.
+    """
+
+    def __init__(self, urls, processes, report_every, writer=None, step=SERIES_STEP):
+        self.urls = urls
+        self.step = step            # 每个 tick 的秒数
+        self.live = set(range(processes))
+        self.report_every = report_every
+        self.writer = writer
+        self.totals = {url: {} for url in urls}
+        self.last_tick = 0
+        self._ticks = {}            # tick -> ({url: merged}, {proc})
+        self._recent = collections.deque(maxlen=report_every)
+
+    def add(self, proc, tick, windows):
+        if tick == "config":
+            self._config(windows)
+            return
+        merged, reported = self._ticks.setdefault(tick, ({}, set()))
+        for url, payload in windows.items():
+            merge(merged.setdefault(url, {}), payload)
+        reported.add(proc)
+        self._flush()
+
+    def _config(self, event):
+        trace = ""
+        if event["propagation_ms"] is not None:
+            trace = f", applied {event['propagation_ms']:.1f} ms after its ClickHouse query"
+        print(f"[CONFIG] t={event['t'] * self.step:g}s {event['role']} {event['source']} serves version {event['version']}{trace}")
+        if self.writer is not None:
+            self.writer.event(event)
+
+    def finish(self, proc):
+        self.live.discard(proc)
+        self._flush()
+
+    def close(self, seconds):
+        """Flush what is left (seconds that a generator which died never sent)."""
+        self.live = set()
+        self._flush()
+        if self.writer is not None:
+            self.writer.close(time.time(), seconds)
+
+    def _flush(self):
+        for tick in sorted(self._ticks):
+            merged, reported = self._ticks[tick]
+            if not self.live <= reported:
+                break
+            del self._ticks[tick]
+            self._complete(tick, merged)
+            self._recent.append(merged)
+            if tick % self.report_every == 0:
+                self._report()
+
+    def _complete(self, tick, merged):
+        self.last_tick = tick
+        for url, w in merged.items():
+            merge(self.totals[url], {k: v for k, v in w.items() if k not in ("seconds", "inflight", "connections")})
+            if self.writer is not None:
+                self.writer.second(tick, url, w)
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _report(self):
+        for url in self.urls:
+            seconds = [second[url] for second in self._recent if url in second]
+            if not seconds:
+                continue
+            window = {}
+            for second in seconds:
+                merge(window, second)
+            # 跨进程取最大值的字段，跨秒要相加 / 取最新
+            window["seconds"] = sum(second["seconds"] for second in seconds)
+            print_summary(url, summarize(window), seconds[-1]["inflight"], seconds[-1]["connections"],
+                          seconds[-1].get("config_version"))
+
+    def print_totals(self, seconds):
+        print("==== totals ====")
+        for url in self.urls:
+            if self.totals[url]:
+                print_summary(url, summarize(self.totals[url], seconds))
+
+
+# ================================
+# 开环调度
+# ================================
+def plan(urls, rate, connections, processes):
+    """
+    Per generator process, [(url, rate, connections, phase)]: every process drives
+    every URL at rate / processes with its share of the connections, and its
+    arrivals are offset by `phase` of its own interval so the combined stream
+    stays evenly spaced at `rate`.
+    """
+    share = rate / processes
+    conns = max(1, -(-connections // processes))
+    return [[(url, share, conns, proc / processes) for url in urls] for proc in range(processes)]
+
+
+async def generate(target, rate, start, phase, deadline):
+    """Start request i at start + (i + phase) / rate on a fixed timeline, without waiting for responses."""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    sent = 0
     while True:
-        start_time = time.time()
+        intended = start + (sent + phase) / rate
+        if deadline is not None and intended >= deadline:
+            break
+        await asyncio.sleep(max(0.0, intended - loop.time()))
+        due = int((loop.time() - start) * rate - phase) + 1
+        if deadline is not None:
+            due = min(due, math.ceil((deadline - start) * rate - phase))
+        while sent < due:
+            task = asyncio.ensure_future(target.visit(start + (sent + phase) / rate))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+    if tasks:
+        await asyncio.wait(tasks)
+
 
-        for _ in range(REQUESTS_PER_SECOND):
-            check_request(url)
+async def report(targets, start, interval, sink, state):
+    loop = asyncio.get_running_loop()
+    while True:
+        tick = state["tick"] + 1
+        await asyncio.sleep(max(0.0, start + tick * interval - loop.time()))
+        now = loop.time()
+        state["tick"] = tick
+        sink(tick, {t.url: t.rotate(now) for t in targets})
 
-        # 保证每秒总请求数大致稳定
-        sleep_time = 1 - (time.time() - start_time)
-        if sleep_time > 0:
-            time.sleep(sleep_time)
 
+async def _get_json(pool, path):
+    conn = await pool.acquire()
+    reusable = False
+    try:
+        request = f"GET {path} HTTP/1.1\r\nHost: {pool.host}\r\nAccept: application/json\r\n\r\n".encode("latin-1")
+        status, body, reusable = await asyncio.wait_for(fetch(conn, request), CONFIG_POLL)
+    finally:
+        pool.release(conn, reusable)
+    if status != 200:
+        raise ValueError(f"HTTP {status}")
+    return json.loads(body)
 
-def print_stats():
-    """定期打印成功率"""
+
+async def watch_config(targets, workers, start, start_wall, sink, step=SERIES_STEP):
+    """
+    Poll the config trace in /stats of every target (proxy) and of `workers` once per
+    CONFIG_POLL seconds and report each version change. Its tick `t` (of `step`
+    seconds) comes from the trace's applied_at (when the proxy or worker swapped it
+    in), not from when the poll noticed it, so a shift in success rate can be
+    matched to the config that caused it. The version found at the first poll is
+    reported as "initial".
+    """
+    loop = asyncio.get_running_loop()
+    sources = [("worker", urllib.parse.urljoin(url, "/stats"), url, None) for url in workers]
+    if STATS_PATH:
+        sources += [("proxy", urllib.parse.urljoin(t.url, STATS_PATH), t.url, t) for t in targets]
+    pools = {}
+    seen = {}
     while True:
-        time.sleep(1)
+        for role, stats_url, source, target in sources:
+            parsed = urllib.parse.urlsplit(stats_url)
+            pool = pools.get(stats_url)
+            if pool is None:
+                pool = pools[stats_url] = Pool(parsed.hostname, parsed.port or 80, 1)
+            try:
+                stats = await _get_json(pool, parsed.path)
+                # 代理：features.trace；worker：trace
+                trace = stats["features"]["trace"] if role == "proxy" else stats["trace"]
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError):
+                continue
+            version = trace.get("config_version" if role == "proxy" else "version")
+            if target is not None:
+                target.config_version = version
+            if version is None or seen.get(source) == version:
+                continue
+            initial = source not in seen
+            seen[source] = version
+            origin, applied = trace.get("origin_at"), trace.get("applied_at")
+            elapsed = applied - start_wall if applied and not initial else loop.time() - start
+            sink("config", {
+                "t": max(0, int(elapsed / step)) + 1,
+                "initial": initial,
+                "role": role,
+                "source": source,
+                "version": version,
+                "origin_at": origin,
+                "applied_at": applied,
+                "propagation_ms": round((applied - origin) * 1000, 3) if origin and applied else None,
+            })
+        await asyncio.sleep(CONFIG_POLL)
+
+
+async def run(targets_plan, start_wall, duration, interval, sink, workers=None):
+    """
+    Run one generator process; sink(tick, {url: window}) receives its reports. With
+    `workers` (a list, possibly empty) it also watches the config version of the
+    targets and those workers and reports changes as sink("config", event).
+    """
+    loop = asyncio.get_running_loop()
+    # 各进程按同一个墙钟时刻对齐起点和上报窗口
+    start = loop.time() + (start_wall - time.time())
+    targets = [Target(url, conns, start) for url, _, conns, _ in targets_plan]
+    deadline = start + duration if duration else None
+    state = {"tick": 0}
+    reporter = asyncio.ensure_future(report(targets, start, interval, sink, state))
+    watcher = (asyncio.ensure_future(watch_config(targets, workers, start, start_wall, sink, interval))
+               if workers is not None else None)
+    try:
+        await asyncio.gather(*(generate(t, rate, start, phase, deadline)
+                               for t, (_, rate, _, phase) in zip(targets, targets_plan)))
+    finally:
+        reporter.cancel()
+        if watcher is not None:
+            watcher.cancel()
+        now = loop.time()
+        sink(state["tick"] + 1, {t.url: t.rotate(now) for t in targets})
+
+
+def _generator_main(proc, targets_plan, start_wall, duration, interval, workers, reports):
+    try:
+        asyncio.run(run(targets_plan, start_wall, duration, interval,
+                        lambda tick, windows: reports.put((proc, tick, windows)), workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reports.put((proc, "done", None))
 
-        for url in URLS:
-            if stats[url]["total"] >= STATS_INTERVAL:
-                success_rate = stats[url]["success"] / stats[url]["total"]
-                blocked = stats[url]["blocked"]
-                total = stats[url]["total"]
 
-                print(f"\n---- {url} ----")
-                print(f"Success rate: {success_rate:.2%}")
-                print(f"Success: {stats[url]['success']}")
-                print(f"Blocked: {blocked}")
-                print(f"Total: {total}")
-                print("--------------------------\n")
+def _collect(procs, reports, aggregator, wait):
+    while aggregator.live:
+        try:
+            proc, tick, windows = reports.get(timeout=wait)
+        except queue.Empty:
+            # 异常退出的进程不再等它的上报
+            for proc in list(aggregator.live):
+                if not procs[proc].is_alive():
+                    print(f"generator {proc} exited with {procs[proc].exitcode}")
+                    aggregator.finish(proc)
+            continue
+        if tick == "done":
+            aggregator.finish(proc)
+        else:
+            aggregator.add(proc, tick, windows)
 
-                # 清零，开始下一个统计周期
-                stats[url] = {"success": 0, "blocked": 0, "total": 0}
+
+def parse_tags(items):
+    tags = {}
+    for item in items:
+        for pair in filter(None, item.split(",")):
+            key, sep, value = pair.partition("=")
+            if not sep:
+                raise SystemExit(f"bad tag {pair!r}: expected KEY=VALUE")
+            tags[key.strip()] = value.strip()
+    return tags
 
 
 def main():
-    print("Starting benchmark workers...")
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("urls", nargs="*", default=URLS)
+    ap.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="requests per second per target")
+    ap.add_argument("--duration", type=float, default=0, help="seconds; 0 runs until interrupted")
+    ap.add_argument("--connections", type=int, default=CONNECTIONS, help="keep-alive connections per target")
+    ap.add_argument("--interval", type=int, default=STATS_INTERVAL, help="seconds between reports")
+    ap.add_argument("--processes", type=int, default=PROCESSES, help="generator processes")
+    ap.add_argument("--tag", action="append", default=[RUN_TAGS], metavar="KEY=VALUE",
+                    help="run metadata, e.g. engine=fl2 or config=v42 (repeatable)")
+    ap.add_argument("--worker", action="append", default=[WORKER_STATS], metavar="URL",
+                    help="also trace the config version served by this worker (repeatable)")
+    ap.add_argument("--run-file", help=f"where to store the run (default: a new file in RUN_DIR={RUN_DIR!r})")
+    args = ap.parse_args()
+
+    processes = max(1, args.processes)
+    plans = plan(args.urls, args.rate, args.connections, processes)
+    tags = parse_tags(args.tag)
+    workers = [url.strip() for item in args.worker for url in item.split(",") if url.strip()]
+    started = time.time() + (START_DELAY if processes > 1 else 0)
+
+    writer = None
+    path = args.run_file
+    if path is None and RUN_DIR:
+        os.makedirs(RUN_DIR, exist_ok=True)
+        suffix = "".join(f"-{tags[k]}" for k in ("engine", "config") if tags.get(k))
+        path = os.path.join(RUN_DIR, time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + suffix + ".run.gz")
+    if path:
+        config = {"urls": args.urls, "rate": args.rate, "connections": args.connections,
+                  "processes": processes, "timeout": TIMEOUT, "hard_timeout": HARD_TIMEOUT,
+                  "duration": args.duration, "workers": workers}
+        writer = runstore.RunWriter(path, tags, config, started)
 
-    # 启动 URL 请求线程
-    for url in URLS:
-        t = threading.Thread(target=worker, args=(url,), daemon=True)
-        t.start()
+    aggregator = Aggregator(args.urls, processes, max(1, args.interval), writer)
+    print(f"Starting open-loop benchmark: {args.rate:g} req/s per target, {len(args.urls)} target(s), "
+          f"{processes} process(es)" + (f", run file {path}" if path else ""))
 
-    # 启动统计线程
-    print_stats()
+    if processes == 1:
+        try:
+            asyncio.run(run(plans[0], started, args.duration, SERIES_STEP,
+                            lambda tick, windows: aggregator.add(0, tick, windows), workers))
+        except KeyboardInterrupt:
+            pass
+    else:
+        reports = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_generator_main, name=f"generator-{i}", daemon=True,
+                                         args=(i, plans[i], started, args.duration, SERIES_STEP,
+                                               workers if i == 0 else None, reports))
+                 for i in range(processes)]
+        for p in procs:
+            p.start()
+        try:
+            _collect(procs, reports, aggregator, 2 * SERIES_STEP)
+        except KeyboardInterrupt:
+            # 子进程收到同一个 SIGINT，等它们交回最后的窗口
+            _collect(procs, reports, aggregator, 1.0)
+        for p in procs:
+            p.join(1.0)
 
+    elapsed = time.time() - started
+    elapsed = min(elapsed, args.duration) if args.duration else elapsed
+    aggregator.close(elapsed)
+    aggregator.print_totals(elapsed)
+    if path:
+        print(f"Run saved to {path} (python runstore.py show {path})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Benchmark run files and regression comparison.
+
+benchmark.py writes one run file per run: the per-second series of every
+target, tagged with the engine and config version under test. A run file is
+gzip-compressed JSON lines:
+
+    {"type": "run", "format": 1, "started": <unix>, "tags": {...}, "config": {...}}
+    {"type": "second", "t": 1, "url": ..., "seconds": 1.0, "sent": ..., "done": ...,
+     "success": ..., "blocked": ..., "late": ..., "errors": ..., "config_version": ...,
+     "latency": {"buckets": {...}, "sum_us": ..., "max_us": ...}, "lag": {...}}
+    {"type": "config", "t": 12, "initial": false, "role": "proxy", "source": ..., "version": ...,
+     "origin_at": ..., "applied_at": ..., "propagation_ms": ...}
+    {"type": "action", "t": 301, "at": 30.0, "action": "grant r0", "error": null}
+    ...
+    {"type": "end", "ended": <unix>, "seconds": ...}
+
+A record covers config["step"] seconds (1 unless set, 0.1 for scenario.py
+runs) and `t` counts records; analyze() keeps its windows in seconds and
+reports times in seconds whatever the step. Action records are the cluster
+changes a scenario made (see scenario.py).
+
+Each second is flushed as soon as every generator has reported it, so an
+interrupted run keeps everything up to its last complete second (load()
+stops at a truncated tail). Latency histograms are metrics.Histogram export
+payloads without their name / help / labels, so seconds can be summed and
+percentiles taken over any range.
+
+analyze() summarizes a target: throughput, success rate, latency
+percentiles, and incidents found on a SMOOTH-second sliding window of the
+success rate. An incident starts when the window drops more than DROP below
+the baseline (the median over the first BASELINE seconds). It ends once the
+window has been back above that threshold for HOLD seconds. Time-to-recover
+is counted from the first bad second of the first incident to the second
+after its last bad one (the sliding window only decides whether there is an
+incident).
+
+Config events record when each proxy (and any traced worker) started serving
+a new config version, with its propagation time from the worker's ClickHouse
+query. Each incident names the last config change of its target at or before
+its start, so a drop in success rate points at the version that caused it.
+
+    python runstore.py show runs/20251118-112000-fl2.run.gz
+    python runstore.py compare runs/base.run.gz runs/new.run.gz
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import sys
+import zlib
+
+import metrics
+
+FORMAT_VERSION = 1
+
+BASELINE = 10       # 秒：取基线成功率的区间
+SMOOTH = 5          # 秒：成功率滑动窗口
+DROP = 0.10         # 低于基线多少算故障
+HOLD = 5            # 秒：连续恢复多久才算恢复
+
+# compare 的回归阈值
+THRESHOLDS = {
+    "throughput": 0.05,     # 吞吐下降超过 5%
+    "p99": 0.10,            # p99 上升超过 10%（且超过 P99_FLOOR_MS）
+    "success_rate": 0.01,   # 成功率下降超过 1 个百分点
+    "ttr": 0.20,            # 恢复时间增加超过 20%（且超过 TTR_FLOOR_S）
+}
+P99_FLOOR_MS = 1.0
+TTR_FLOOR_S = 2.0
+
+COUNTERS = ("sent", "done", "success", "blocked", "late", "errors")
+HISTOGRAMS = ("latency", "lag")
+
+
+# ================================
+# 写入 / 读取
+# ================================
+class RunWriter:
+    def __init__(self, path, tags, config, started):
+        self.path = path
+        self._file = gzip.open(path, "wb")
+        self._write({"type": "run", "format": FORMAT_VERSION, "started": started, "tags": tags, "config": config})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+
+    def second(self, t, url, window):
+        record = {"type": "second", "t": t, "url": url, "seconds": round(window["seconds"], 3)}
+        for key in COUNTERS:
+            record[key] = window[key]
+        if window.get("config_version") is not None:
+            record["config_version"] = window["config_version"]
+        for key in HISTOGRAMS:
+            h = window[key]
+            record[key] = {"buckets": h["buckets"], "sum_us": h["sum_us"], "max_us": h["max_us"]}
+        self._write(record)
+
+    def event(self, event):
+        """A config version change seen in second event["t"]."""
+        self._write(dict(event, type="config"))
+
+    def action(self, event):
+        """A scenario action (cluster change) applied in record event["t"]."""
+        self._write(dict(event, type="action"))
+
+    def flush(self):
+        # Z_SYNC_FLUSH：已写的秒数据即使进程被杀也能读出
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self, ended, seconds):
+        self._write({"type": "end", "ended": ended, "seconds": round(seconds, 3)})
+        self._file.close()
+
+
+def load(path):
+    """
+    {"meta", "end", "series": {url: [second, ...] ordered by t}, "configs": [config event, ...],
+    "actions": [action, ...]}; a truncated tail is ignored.
+    """
+    meta, end, series, configs, actions = None, None, {}, [], []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                kind = record.get("type")
+                if kind == "run":
+                    if record.get("format") != FORMAT_VERSION:
+                        raise ValueError(f"{path}: unsupported run file format {record.get('format')}")
+                    meta = record
+                elif kind == "second":
+                    for key in HISTOGRAMS:
+                        h = record[key]
+                        h["count"] = sum(h["buckets"].values())
+                    series.setdefault(record["url"], []).append(record)
+                elif kind == "config":
+                    configs.append(record)
+                elif kind == "action":
+                    actions.append(record)
+                elif kind == "end":
+                    end = record
+        except (EOFError, zlib.error, OSError):
+            # 运行被中断：gzip 尾部不完整
+            pass
+    if meta is None:
+        raise ValueError(f"{path}: not a benchmark run file")
+    for seconds in series.values():
+        seconds.sort(key=lambda s: s["t"])
+    return {"meta": meta, "end": end, "series": series, "configs": configs, "actions": actions}
+
+
+def record_step(run):
+    """Seconds per record of a loaded run."""
+    return run["meta"].get("config", {}).get("step", 1.0)
+
+
+# ================================
+# 分析
+# ================================
+def combine(seconds):
+    """Sum a list of per-second records into one window."""
+    total = {key: 0 for key in COUNTERS}
+    total["seconds"] = 0.0
+    hists = {key: {"buckets": {}, "count": 0, "sum_us": 0, "max_us": 0} for key in HISTOGRAMS}
+    for s in seconds:
+        total["seconds"] += s["seconds"]
+        for key in COUNTERS:
+            total[key] += s[key]
+        for key in HISTOGRAMS:
+            h, src = hists[key], s[key]
+            for idx, n in src["buckets"].items():
+                h["buckets"][idx] = h["buckets"].get(idx, 0) + n
+            h["count"] += src["count"]
+            h["sum_us"] += src["sum_us"]
+            h["max_us"] = max(h["max_us"], src["max_us"])
+    total.update(hists)
+    return total
+
+
+def send_window(seconds):
+    """Seconds up to the last record that sent requests; the drain of in-flight answers after it is left out."""
+    last = max((i for i, s in enumerate(seconds) if s["sent"]), default=len(seconds) - 1)
+    return sum(s["seconds"] for s in seconds[:last + 1])
+
+
+def rate_series(seconds, smooth=SMOOTH):
+    """[(t, success rate over the last `smooth` seconds)], skipping windows without answers."""
+    rates = []
+    for i, s in enumerate(seconds):
+        window = seconds[max(0, i - smooth + 1):i + 1]
+        done = sum(w["done"] for w in window)
+        if done:
+            rates.append((s["t"], sum(w["success"] for w in window) / done))
+    return rates
+
+
+def incidents(rates, baseline, drop=DROP, hold=HOLD, raw=None, smooth=SMOOTH):
+    """
+    Periods where the smoothed success rate is more than `drop` below `baseline`.
+    With `raw` ({t: rate of that second}) the start and the recovery are moved
+    to the first and just past the last bad second, undoing the window's lag.
+    """
+    threshold = baseline - drop
+    found = []
+    current = None
+    healthy_since = None
+    for t, rate in rates:
+        if rate < threshold:
+            healthy_since = None
+            if current is None:
+                current = {"start": t, "depth": rate, "recovered": None}
+                found.append(current)
+            current["depth"] = min(current["depth"], rate)
+        elif current is not None:
+            if healthy_since is None:
+                healthy_since = t
+            if t - healthy_since + 1 >= hold:
+                current["recovered"] = healthy_since
+                current = None
+                healthy_since = None
+    last = rates[-1][0] if rates else 0
+    for inc in found:
+        if raw:
+            end = inc["recovered"] if inc["recovered"] is not None else last
+            bad = [t for t, rate in raw.items() if rate < threshold and inc["start"] - smooth < t <= end]
+            if bad:
+                inc["start"] = bad[0]
+                if inc["recovered"] is not None:
+                    inc["recovered"] = bad[-1] + 1
+        inc["depth"] = round(inc["depth"], 4)
+        inc["ttr_s"] = None if inc["recovered"] is None else inc["recovered"] - inc["start"]
+    return found
+
+
+def attribute(found, configs):
+    """
+    Add to each incident the last config change of its target seen at or before its
+    start (`cause`), linking the drop in success rate to a config version.
+    """
+    for inc in found:
+        before = [c for c in configs if c["t"] <= inc["start"] and not c.get("initial")]
+        inc["cause"] = None
+        if before:
+            last = before[-1]
+            inc["cause"] = {"version": last["version"], "t": last["t"], "lead_s": inc["start"] - last["t"],
+                            "propagation_ms": last.get("propagation_ms")}
+    return found
+
+
+def _in_seconds(found, step):
+    # 记录序号 → 秒（记录 t 覆盖到 t * step 秒为止）
+    for inc in found:
+        for key in ("start", "recovered", "ttr_s"):
+            if inc[key] is not None:
+                inc[key] = round(inc[key] * step, 3)
+        if inc["cause"] is not None:
+            inc["cause"]["t"] = round(inc["cause"]["t"] * step, 3)
+            inc["cause"]["lead_s"] = round(inc["cause"]["lead_s"] * step, 3)
+    return found
+
+
+def analyze(seconds, baseline_s=BASELINE, smooth=SMOOTH, drop=DROP, hold=HOLD, configs=(), step=1.0):
+    """
+    Summary of one target; `configs` are that target's config events (see attribute()).
+    baseline_s, smooth and hold are seconds; `step` is the run's seconds per record.
+    """
+    records = lambda s: max(1, round(s / step))
+    total = combine(seconds)
+    latency = metrics.summarize({"l": total["latency"]})["l"]
+    # 吞吐按发送窗口计算：结束后等待在途应答的时间不算
+    elapsed = max(1e-9, send_window(seconds))
+    rates = rate_series(seconds, records(smooth))
+    early = [rate for t, rate in rates if t * step <= baseline_s] or [rate for _, rate in rates]
+    baseline = statistics.median(early) if early else None
+    raw = dict(rate_series(seconds, 1))
+    found = incidents(rates, baseline, drop, records(hold), raw, records(smooth)) if baseline is not None else []
+    attribute(found, sorted(configs, key=lambda c: c["t"]))
+    if step != 1:
+        _in_seconds(found, step)
+    first = found[0] if found else None
+    return {
+        "seconds": round(elapsed, 1),
+        "requests": total["done"],
+        "throughput_rps": round(total["done"] / elapsed, 1),
+        "success_rate": round(total["success"] / total["done"], 4) if total["done"] else None,
+        "blocked": total["blocked"],
+        "errors": total["errors"],
+        "p50_ms": latency["p50_ms"],
+        "p99_ms": latency["p99_ms"],
+        "p999_ms": latency["p999_ms"],
+        "baseline_rate": None if baseline is None else round(baseline, 4),
+        "min_rate": round(min(rate for _, rate in rates), 4) if rates else None,
+        "incidents": found,
+        # 首次故障的恢复时间；未恢复为 None
+        "ttr_s": first["ttr_s"] if first else None,
+        # 没有故障时无所谓恢复：None
+        "recovered": None if first is None else first["recovered"] is not None,
+    }
+
+
+# ================================
+# 比较
+# ================================
+def _relative(base, new):
+    return (new - base) / base if base else None
+
+
+def compare(base, new, thresholds=THRESHOLDS):
+    """[(url, metric, base value, new value, change text, regression?)] per target in both runs."""
+    rows = []
+    base_series, new_series = base["series"], new["series"]
+    pairs = [(url, url) for url in base_series if url in new_series]
+    if not pairs and len(base_series) == len(new_series):
+        # 主机名不同（比如本地与容器里）时按顺序配对
+        pairs = list(zip(base_series, new_series))
+    for base_url, new_url in pairs:
+        a = analyze(base_series[base_url], step=record_step(base))
+        b = analyze(new_series[new_url], step=record_step(new))
+        label = base_url if base_url == new_url else f"{base_url} -> {new_url}"
+
+        change = _relative(a["throughput_rps"], b["throughput_rps"])
+        rows.append((label, "throughput_rps", a["throughput_rps"], b["throughput_rps"],
+                     _pct(change), change is not None and change < -thresholds["throughput"]))
+
+        change = _relative(a["p99_ms"], b["p99_ms"])
+        rows.append((label, "p99_ms", a["p99_ms"], b["p99_ms"], _pct(change),
+                     change is not None and change > thresholds["p99"] and b["p99_ms"] - a["p99_ms"] > P99_FLOOR_MS))
+
+        if a["success_rate"] is not None and b["success_rate"] is not None:
+            diff = b["success_rate"] - a["success_rate"]
+            rows.append((label, "success_rate", a["success_rate"], b["success_rate"],
+                         f"{diff * 100:+.2f} pp", diff < -thresholds["success_rate"]))
+
+        rows.append((label, "ttr_s", _ttr(a), _ttr(b), *_ttr_change(a, b, thresholds["ttr"])))
+    return rows
+
+
+def _ttr(result):
+    if not result["incidents"]:
+        return "-"
+    return result["ttr_s"] if result["recovered"] else "not recovered"
+
+
+def _ttr_change(a, b, threshold):
+    if not b["incidents"]:
+        return "", False
+    if not b["recovered"]:
+        return "never recovered", a["recovered"]
+    if not a["incidents"] or not a["recovered"]:
+        return "new incident" if not a["incidents"] else "recovers now", not a["incidents"]
+    diff = b["ttr_s"] - a["ttr_s"]
+    return f"{diff:+g} s", diff > max(TTR_FLOOR_S, threshold * a["ttr_s"])
+
+
+def _ms(value):
+    return "?" if value is None else f"{value:.1f} ms"
+
+
+def _pct(change):
+    return "" if change is None else f"{change * 100:+.1f}%"
+
+
+# ================================
+# CLI
+# ================================
+def _describe(run):
+    meta = run["meta"]
+    tags = " ".join(f"{k}={v}" for k, v in sorted(meta.get("tags", {}).items())) or "(no tags)"
+    status = "complete" if run["end"] else "interrupted"
+    return f"{tags}, {status}"
+
+
+def cmd_show(args):
+    run = load(args.run)
+    print(f"{args.run}: {_describe(run)}")
+    print(json.dumps(run["meta"].get("config", {}), sort_keys=True))
+    step = record_step(run)
+    at = lambda t: f"{t * step:g}s"
+    for a in run["actions"]:
+        print(f"action: t={at(a['t'])} {a['action']}" + (f" (failed: {a['error']})" if a.get("error") else ""))
+    for c in run["configs"]:
+        if c["role"] == "worker":
+            print(f"config: t={at(c['t'])} worker {c['source']} version {c['version']} "
+                  f"({_ms(c.get('propagation_ms'))} after origin)")
+    for url, seconds in run["series"].items():
+        configs = [c for c in run["configs"] if c["source"] == url]
+        result = analyze(seconds, configs=configs, step=step)
+        print(f"\n---- {url} ----")
+        for key, value in result.items():
+            if key != "incidents":
+                print(f"{key:>15}: {value}")
+        for c in configs:
+            print(f"{'config':>15}: t={at(c['t'])} version {c['version']} ({_ms(c.get('propagation_ms'))} after origin)")
+        for inc in result["incidents"]:
+            cause = inc["cause"]
+            cause = (f" after config version {cause['version']} (t={cause['t']}s)" if cause else "")
+            print(f"{'incident':>15}: t={inc['start']}s depth={inc['depth']:.2%} "
+                  f"recovered={'t=%ss' % inc['recovered'] if inc['recovered'] is not None else 'no'}{cause}")
+    return 0
+
+
+def cmd_compare(args):
+    thresholds = dict(THRESHOLDS, throughput=args.throughput, p99=args.p99,
+                      success_rate=args.success_rate, ttr=args.ttr)
+    base, new = load(args.base), load(args.new)
+    print(f"base: {args.base}: {_describe(base)}")
+    print(f"new:  {args.new}: {_describe(new)}")
+    rows = compare(base, new, thresholds)
+    if not rows:
+        print("no target in common")
+        return 2
+    url = None
+    for label, metric, a, b, change, regression in rows:
+        if label != url:
+            url = label
+            print(f"\n---- {label} ----")
+        flag = "  REGRESSION" if regression else ""
+        print(f"{metric:>15} {str(a):>14} {str(b):>14}  {change}{flag}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"\n{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="summarize one run")
+    show.add_argument("run")
+    show.set_defaults(func=cmd_show)
+    cmp_ = sub.add_parser("compare", help="diff two runs and flag regressions (exit status 1)")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--throughput", type=float, default=THRESHOLDS["throughput"],
+                      help="allowed relative throughput drop")
+    cmp_.add_argument("--p99", type=float, default=THRESHOLDS["p99"], help="allowed relative p99 increase")
+    cmp_.add_argument("--success-rate", type=float, default=THRESHOLDS["success_rate"],
+                      help="allowed absolute success rate drop")
+    cmp_.add_argument("--ttr", type=float, default=THRESHOLDS["ttr"],
+                      help="allowed relative time-to-recover increase")
+    cmp_.set_defaults(func=cmd_compare)
+    args = ap.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Scripted failure scenarios: a timeline of ClickHouse changes played while
+FL with the bot manager off, FL with it on and FL2 are under load together.
+
+A timeline file has one action per line, `<time> <action> [args]`:
+
+    # the 2025-11-18 change and its revert
+    30s   grant r0        # test_user also sees r0: every column twice
+    90s   revoke r0
+    150s  end
+
+    grant DB / revoke DB      the permission change (duplicate / revert: r0)
+    host NAME KEY=VALUE ...   stand-in only: latency, jitter, error_rate, down
+    sql "STATEMENT"           real cluster only: any statement, run as default
+    end                       stop the load (default: TAIL seconds after the last action)
+
+--target local (default) starts the stack of local-stack/launch.py, every
+service in its own process, on the ClickHouse stand-in. --target docker loads
+the docker setup (benchmark.URLS) and runs the statements on the real cluster
+with `docker exec CLICKHOUSE_CONTAINER clickhouse client`, as in
+clickhouse-cluster/README.md.
+
+The load is benchmark.run at --rate per engine, recorded every --step seconds
+(0.1 s instead of 1 s, or the 100-request reports of the original script) in a
+run file that `runstore.py show` reads too. Per engine the report gives, from
+runstore.analyze on a --smooth-second window against the success rate before
+the first action:
+  detect_s   from the action to the first sample whose success rate dropped
+  depth      the lowest (smoothed) success rate of the drop
+  outage_s   from the drop to recovery
+  recover_s  from the last action before recovery (the revert) to recovery
+and the config version the drop followed.
+
+    python scenario.py scenarios/outage.timeline --rate 200
+    python scenario.py scenarios/outage.timeline --target docker
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import benchmark
+import runstore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEP = 0.1              # 秒：采样（运行文件记录）粒度
+SMOOTH = 1.0            # 秒：判断成功率下降的滑动窗口
+HOLD = 2.0              # 秒：连续恢复多久才算恢复
+TAIL = 30.0             # 秒：时间线没有 end 时，最后一个动作之后继续压测的时长
+REPORT_EVERY = 5.0      # 秒：压测过程中打印窗口统计的间隔
+CLICKHOUSE_CONTAINER = os.getenv("CLICKHOUSE_CONTAINER", "clickhouse-node1")
+
+# benchmark.URLS 的顺序：50001 FL 关闭 bot manager，50002 FL 开启，50003 FL2
+ENGINES = ("fl-off", "fl-on", "fl2")
+
+VERBS = ("grant", "revoke", "host", "sql", "end")
+ALIASES = {"duplicate": ("grant", ["r0"]), "revert": ("revoke", ["r0"])}
+
+Action = collections.namedtuple("Action", "at verb args line")
+
+
+# ================================
+# 时间线
+# ================================
+def _seconds(text):
+    """30, 30s, 1.5m, 2m30s → seconds."""
+    total, number = 0.0, ""
+    for ch in text:
+        if ch.isdigit() or ch == ".":
+            number += ch
+        elif ch in "sm" and number:
+            total += float(number) * (60 if ch == "m" else 1)
+            number = ""
+        else:
+            raise ValueError(f"bad time {text!r}")
+    return total + (float(number) if number else 0.0)
+
+
+def parse_timeline(text):
+    """[Action] ordered by time; the last one is always `end`."""
+    actions = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        try:
+            if len(words) < 2:
+                raise ValueError("expected `<time> <action> [args]`")
+            at = _seconds(words[0])
+            verb, args = ALIASES.get(words[1], (words[1], words[2:]))
+            if verb not in VERBS:
+                raise ValueError(f"unknown action {verb!r}")
+            if verb in ("grant", "revoke", "sql") and len(args) != 1:
+                raise ValueError(f"{verb} takes one argument")
+            if verb == "host":
+                _host_faults(args)
+        except ValueError as e:
+            raise SystemExit(f"timeline line {lineno}: {e}")
+        actions.append(Action(at, verb, args, " ".join(words[1:])))
+    actions.sort(key=lambda a: a.at)
+    ends = [a for a in actions if a.verb == "end"]
+    if ends:
+        actions = [a for a in actions if a.at < ends[0].at] + [ends[0]]
+    else:
+        last = actions[-1].at if actions else 0.0
+        actions.append(Action(last + TAIL, "end", [], "end"))
+    return actions
+
+
+def _host_faults(args):
+    if not args:
+        raise ValueError("host takes a name and KEY=VALUE faults")
+    faults = {}
+    for item in args[1:]:
+        key, sep, value = item.partition("=")
+        if not sep or key not in ("latency", "jitter", "error_rate", "down"):
+            raise ValueError(f"bad host fault {item!r}")
+        faults[key] = value.lower() in ("1", "true", "yes") if key == "down" else float(value)
+    return args[0], faults
+
+
+# ================================
+# 驱动：本地替身 / 真实集群
+# ================================
+class StandIn:
+    name = "stand-in"
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def check(self, action):
+        if action.verb == "sql":
+            raise SystemExit(f"`{action.line}` needs the real cluster (--target docker)")
+
+    def apply(self, action):
+        if action.verb == "grant":
+            self.cluster.grant(action.args[0])
+        elif action.verb == "revoke":
+            self.cluster.revoke(action.args[0])
+        elif action.verb == "host":
+            host, faults = _host_faults(action.args)
+            self.cluster.set_host(host, **faults)
+
+
+class Docker:
+    name = "docker"
+
+    def __init__(self, container=CLICKHOUSE_CONTAINER):
+        self.container = container
+
+    def check(self, action):
+        if action.verb == "host":
+            raise SystemExit(f"`{action.line}` needs the ClickHouse stand-in (--target local)")
+
+    def apply(self, action):
+        if action.verb == "grant":
+            sql = f"GRANT SELECT ON {action.args[0]}.* TO test_user"
+        elif action.verb == "revoke":
+            sql = f"REVOKE SELECT ON {action.args[0]}.* FROM test_user"
+        else:
+            sql = action.args[0]
+        cmd = ["docker", "exec", self.container, "clickhouse", "client", "-h", "127.0.0.1", "--port", "9000",
+               "-q", sql]
+        done = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if done.returncode != 0:
+            raise RuntimeError(done.stderr.strip() or f"exit status {done.returncode}")
+
+
+async def play(actions, driver, start_wall, step, writer):
+    """Apply each action at its time; every action is printed and stored in the run file."""
+    loop = asyncio.get_running_loop()
+    for action in actions:
+        await asyncio.sleep(max(0.0, start_wall + action.at - time.time()))
+        if action.verb == "end":
+            return
+        error = None
+        try:
+            await loop.run_in_executor(None, driver.apply, action)
+        except Exception as e:
+            error = str(e)
+        elapsed = time.time() - start_wall
+        print(f"[ACTION] t={elapsed:.1f}s {action.line}" + (f" failed: {error}" if error else ""))
+        writer.action({"t": int(elapsed / step) + 1, "at": action.at, "applied_s": round(elapsed, 3),
+                       "action": action.line, "error": error})
+
+
+async def _scenario(urls, actions, driver, args, started, aggregator, writer, workers):
+    targets_plan = benchmark.plan(urls, args.rate, args.connections, 1)[0]
+    player = asyncio.ensure_future(play(actions, driver, started, args.step, writer))
+    try:
+        await benchmark.run(targets_plan, started, actions[-1].at, args.step,
+                            lambda tick, windows: aggregator.add(0, tick, windows), workers)
+    finally:
+        player.cancel()
+
+
+# ================================
+# 结果
+# ================================
+def timings(result, actions):
+    """detect_s / outage_s / recover_s of the first incident, from the actions that caused and ended it."""
+    done = [a for a in actions if a.verb != "end"]
+    inc = result["incidents"][0] if result["incidents"] else None
+    out = {"baseline": result["baseline_rate"], "depth": None, "detect_s": None, "outage_s": None,
+           "recover_s": None, "cause": None, "recovered": result["recovered"]}
+    if inc is None:
+        return out
+    out["depth"] = inc["depth"]
+    out["outage_s"] = inc["ttr_s"]
+    trigger = [a for a in done if a.at <= inc["start"]]
+    if trigger:
+        out["detect_s"] = round(inc["start"] - trigger[-1].at, 3)
+    if inc["recovered"] is not None:
+        fix = [a for a in done if inc["start"] < a.at <= inc["recovered"]]
+        if fix:
+            out["recover_s"] = round(inc["recovered"] - fix[-1].at, 3)
+    if inc["cause"] is not None:
+        out["cause"] = inc["cause"]["version"]
+    return out
+
+
+def print_report(run_path, names, actions, args):
+    run = runstore.load(run_path)
+    print("==== scenario ====")
+    for a in run["actions"]:
+        print(f"t={a['applied_s']:.1f}s {a['action']}" + (f" (failed: {a['error']})" if a["error"] else ""))
+    first = next((a.at for a in actions if a.verb != "end"), actions[-1].at)
+    print(f"\n{'engine':<10}{'baseline':>9}{'depth':>8}{'detect_s':>10}{'outage_s':>10}{'recover_s':>11}  cause")
+    fmt = lambda v, spec: "-" if v is None else format(v, spec)
+    for url, seconds in run["series"].items():
+        configs = [c for c in run["configs"] if c["source"] == url]
+        result = runstore.analyze(seconds, baseline_s=first, smooth=args.smooth, drop=args.drop, hold=args.hold,
+                                  configs=configs, step=runstore.record_step(run))
+        t = timings(result, actions)
+        outage = "open" if t["recovered"] is False else fmt(t["outage_s"], ".1f")
+        cause = "-" if t["cause"] is None else f"config {t['cause']}"
+        print(f"{names.get(url, url):<10}{fmt(t['baseline'], '.2%'):>9}{fmt(t['depth'], '.2%'):>8}"
+              f"{fmt(t['detect_s'], '.2f'):>10}{outage:>10}{fmt(t['recover_s'], '.2f'):>11}  {cause}")
+    print(f"\nRun saved to {run_path} (python runstore.py show {run_path})")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("timeline", help="timeline file")
+    ap.add_argument("--target", choices=("local", "docker"), default="local")
+    ap.add_argument("--rate", type=float, default=200, help="requests per second per engine")
+    ap.add_argument("--connections", type=int, default=benchmark.CONNECTIONS, help="keep-alive connections per engine")
+    ap.add_argument("--step", type=float, default=STEP, help="seconds per sample")
+    ap.add_argument("--smooth", type=float, default=SMOOTH, help="seconds of the success-rate window")
+    ap.add_argument("--hold", type=float, default=HOLD, help="seconds back to normal that count as recovered")
+    ap.add_argument("--drop", type=float, default=runstore.DROP, help="success-rate drop that counts as an incident")
+    ap.add_argument("--worker", action="append", default=[], metavar="URL",
+                    help="docker: also trace the config version of this worker (repeatable)")
+    ap.add_argument("--run-file", help="where to store the run (default: a new file in RUN_DIR)")
+    args = ap.parse_args()
+
+    with open(args.timeline, encoding="utf-8") as f:
+        actions = parse_timeline(f.read())
+
+    stack = None
+    if args.target == "local":
+        sys.path.insert(0, os.path.join(ROOT, "local-stack"))
+        import launch
+        stack = launch.start_stack(isolate=True)
+        names = {proxy.url + "/": name for name, proxy in stack.proxies.items()}
+        workers = [stack.worker.url]
+        driver = StandIn(stack.cluster)
+        if not stack.wait_ready():
+            print("warning: not every proxy has loaded a config yet")
+    else:
+        names = dict(zip(benchmark.URLS, ENGINES))
+        workers = args.worker
+        driver = Docker()
+    for action in actions:
+        driver.check(action)
+    urls = list(names)
+
+    started = time.time()
+    name = os.path.splitext(os.path.basename(args.timeline))[0]
+    path = args.run_file
+    if path is None:
+        os.makedirs(benchmark.RUN_DIR or ".", exist_ok=True)
+        path = os.path.join(benchmark.RUN_DIR or ".",
+                            time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + f"-scenario-{name}.run.gz")
+    config = {"urls": urls, "engines": names, "rate": args.rate, "connections": args.connections,
+              "step": args.step, "timeout": benchmark.TIMEOUT, "hard_timeout": benchmark.HARD_TIMEOUT,
+              "duration": actions[-1].at, "workers": workers, "driver": driver.name,
+              "timeline": [[a.at, a.line] for a in actions]}
+    writer = runstore.RunWriter(path, {"scenario": name, "target": args.target}, config, started)
+    aggregator = benchmark.Aggregator(urls, 1, max(1, round(REPORT_EVERY / args.step)), writer, args.step)
+    print(f"Scenario {name}: {len(actions) - 1} action(s) over {actions[-1].at:g}s, {args.rate:g} req/s per engine, "
+          f"{args.step:g}s samples, cluster: {driver.name}")
+    try:
+        asyncio.run(_scenario(urls, actions, driver, args, started, aggregator, writer, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close(time.time() - started)
+        if stack is not None:
+            stack.stop()
+    print_report(path, names, actions, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /bot_features requests per second, legacy handler vs worker.py.
+
+Both servers run in this process on ephemeral ports and serve the same
+synthetic feature set (no ClickHouse needed):
+  - legacy : json.dumps of the cached dict under the cache lock on every
+             request, socketserver.ThreadingTCPServer, HTTP/1.0, so every
+             request opens a new connection. This is the handler before
+             the pre-serialized bodies, so the gap to json shows what
+             serializing once per refresh buys
+  - json   : worker.BotHandler, pre-serialized JSON over keep-alive
+  - gzip   : same, Accept-Encoding: gzip
+  - bin    : same, ?format=bin
+Each client thread sends requests back to back for --seconds; the report
+gives requests/s, p50/p99 latency and response size.
+
+    python bench_worker.py --clients 8 --seconds 3 --features 4,1000
+"""
+
+import argparse
+import http.client
+import http.server
+import json
+import socketserver
+import threading
+import time
+
+import worker
+
+
+class _LegacyHandler(http.server.BaseHTTPRequestHandler):
+    data = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            body = json.dumps(self.data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class _QuietBotHandler(worker.BotHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+
+def rows_for(n):
+    return [(f"feature_{i:06d}", ("String", "Float64", "UInt64", "Date")[i % 4]) for i in range(n)]
+
+
+def _start(server):
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def _client(port, path, headers, keep_alive, deadline, out):
+    latencies = []
+    size = 0
+    conn = None
+    while time.perf_counter() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        start = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        resp = conn.getresponse()
+        size = len(resp.read())
+        latencies.append(time.perf_counter() - start)
+        if not keep_alive or resp.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    out.append((latencies, size))
+
+
+def run(port, path, headers, keep_alive, clients, seconds):
+    out = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_client, args=(port, path, headers, keep_alive, deadline, out))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(x for lat, _ in out for x in lat)
+    if not latencies:
+        return 0.0, 0.0, 0.0, 0
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return len(latencies) / elapsed, pick(0.5), pick(0.99), out[0][1]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--features", default="4,1000", help="feature row counts, comma separated")
+    args = ap.parse_args()
+
+    legacy = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _LegacyHandler)
+    legacy_port = _start(legacy)
+    current = worker.ThreadingHTTPServer(("127.0.0.1", 0), _QuietBotHandler)
+    current_port = _start(current)
+
+    cases = (
+        ("legacy", legacy_port, "/bot_features", {}, False),
+        ("json", current_port, "/bot_features", {}, True),
+        ("gzip", current_port, "/bot_features", {"Accept-Encoding": "gzip"}, True),
+        ("bin", current_port, "/bot_features?format=bin", {}, True),
+    )
+    print(f"{'features':>9}  {'handler':<8}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'bytes':>10}")
+    for count in (int(c) for c in args.features.split(",")):
+        rows = rows_for(count)
+        bodies = worker.publish(rows)
+        _LegacyHandler.data = {"data": [list(r) for r in rows], "refreshed_at": bodies.refreshed_at,
+                               "version": bodies.version}
+        for name, port, path, headers, keep_alive in cases:
+            rate, p50, p99, size = run(port, path, headers, keep_alive, args.clients, args.seconds)
+            print(f"{count:>9}  {name:<8}{rate:>10,.0f}{p50:>9.2f}{p99:>9.2f}{size:>10,}")
+
+    legacy.shutdown()
+    current.shutdown()
+
+
+if __name__ == "__main__":
+    main()
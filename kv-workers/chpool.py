@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Health-scored ClickHouse host pool with failover and hedged queries.
+
+Every host gets its own client, created on first use. query() ranks hosts by
+health score, EWMA latency * (1 + consecutive failures), and sends the query
+to the best one. Two things can happen before it answers:
+  - it fails: the next host in the ranking gets the query (failover);
+  - it has not answered after the hedge delay, the HEDGE_QUANTILE of the
+    recent query latencies of all hosts (never below HEDGE_MIN): one duplicate
+    query goes to the next host (hedge), and the first answer wins.
+A host that fails EJECT_AFTER times in a row is skipped for EJECT_SECONDS,
+unless no other host is left. A host whose query is still running (e.g. the
+loser of a hedge) is not reused until that query returns, because a client
+runs one query at a time. Late answers still update latency and health.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+EWMA_ALPHA = 0.3
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN = 0.05
+EJECT_AFTER = 3
+EJECT_SECONDS = 30.0
+_WINDOW = 128                       # 计算对冲阈值所用的最近样本数
+
+
+class Host:
+    __slots__ = ("name", "client", "ewma", "failures", "ejected_until", "busy",
+                 "queries", "errors", "failovers", "hedges", "hedge_wins", "last_error", "latency")
+
+    def __init__(self, name, latency):
+        self.name = name
+        self.client = None
+        self.ewma = 0.0                 # 秒；0 表示尚无样本
+        self.failures = 0               # 连续失败次数
+        self.ejected_until = 0.0
+        self.busy = False
+        self.queries = 0
+        self.errors = 0
+        self.failovers = 0              # 因其它节点失败而接手的查询
+        self.hedges = 0                 # 作为对冲目标收到的查询
+        self.hedge_wins = 0             # 对冲查询先于主查询返回
+        self.last_error = None
+        self.latency = latency          # metrics.Histogram
+
+    def score(self):
+        return (self.ewma or 0.001) * (1 + self.failures)
+
+
+class HostPool:
+    def __init__(self, names, connect, registry, timeout=30.0,
+                 hedge_quantile=HEDGE_QUANTILE, hedge_min=HEDGE_MIN):
+        self.hosts = [
+            Host(name, registry.histogram("worker_clickhouse_host_query_seconds",
+                                          "ClickHouse query time by host", host=name))
+            for name in names
+        ]
+        self._connect = connect
+        self.timeout = timeout
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=_WINDOW)
+
+    # ---------------------------
+    # 选择
+    # ---------------------------
+    def ranked(self):
+        """Idle hosts, healthy ones by score first, then ejected ones by ejection end."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [h for h in self.hosts if not h.busy]
+        healthy = sorted((h for h in idle if h.ejected_until <= now), key=Host.score)
+        ejected = sorted((h for h in idle if h.ejected_until > now), key=lambda h: h.ejected_until)
+        return healthy + ejected
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return self.timeout
+        return max(self.hedge_min, samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))])
+
+    # ---------------------------
+    # 查询
+    # ---------------------------
+    def query(self, sql):
+        """Result of the first host to answer; raises the last error if every host fails."""
+        candidates = self.ranked()
+        if not candidates:
+            raise RuntimeError("no idle ClickHouse host")
+        results = queue.Queue()
+        deadline = time.monotonic() + self.timeout
+        hedge_at = time.monotonic() + self.hedge_delay()
+        hedge = None
+        pending = 0
+        last_error = None
+
+        self._launch(candidates.pop(0), sql, results)
+        pending += 1
+        while pending:
+            now = time.monotonic()
+            wait_until = hedge_at if candidates and hedge is None else deadline
+            try:
+                host, result, error = results.get(timeout=max(0.0, min(wait_until, deadline) - now))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    break
+                # 主查询超过对冲阈值仍未返回：向下一个节点发送一次重复查询
+                hedge = candidates.pop(0)
+                with self._lock:
+                    hedge.hedges += 1
+                self._launch(hedge, sql, results)
+                pending += 1
+                continue
+
+            pending -= 1
+            if error is None:
+                if host is hedge and pending:
+                    with self._lock:
+                        host.hedge_wins += 1
+                return result
+            last_error = error
+            if candidates and not pending:
+                host = candidates.pop(0)
+                with self._lock:
+                    host.failovers += 1
+                self._launch(host, sql, results)
+                pending += 1
+
+        raise last_error or TimeoutError(f"ClickHouse query timed out after {self.timeout:g}s")
+
+    def _launch(self, host, sql, results):
+        with self._lock:
+            host.busy = True
+            host.queries += 1
+        threading.Thread(target=self._run, args=(host, sql, results), daemon=True,
+                         name=f"ch_{host.name}").start()
+
+    def _run(self, host, sql, results):
+        start = time.perf_counter()
+        result = error = None
+        try:
+            if host.client is None:
+                host.client = self._connect(host.name)
+            result = host.client.query(sql)
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - start
+        host.latency.record(elapsed)
+        self._done(host, elapsed, error)
+        results.put((host, result, error))
+
+    def _done(self, host, seconds, error):
+        now = time.monotonic()
+        with self._lock:
+            host.busy = False
+            if error is None:
+                host.ewma = seconds if not host.ewma else host.ewma + EWMA_ALPHA * (seconds - host.ewma)
+                host.failures = 0
+                self._recent.append(seconds)
+                return
+            host.errors += 1
+            host.failures += 1
+            host.last_error = str(error)
+            # 失败后丢弃客户端，下次使用时重新连接
+            host.client = None
+            if host.failures >= EJECT_AFTER and host.ejected_until <= now:
+                host.ejected_until = now + EJECT_SECONDS
+                print(f"[CK] ejected {host.name} for {EJECT_SECONDS:g}s: {error}")
+
+    def stats(self):
+        now = time.monotonic()
+        hosts = {
+            h.name: {
+                "queries": h.queries,
+                "errors": h.errors,
+                "failovers": h.failovers,
+                "hedges": h.hedges,
+                "hedge_wins": h.hedge_wins,
+                "ewma_ms": round(h.ewma * 1000, 3),
+                "score": round(h.score(), 6),
+                "ejected": h.ejected_until > now,
+                "busy": h.busy,
+                "last_error": h.last_error,
+            }
+            for h in self.hosts
+        }
+        return {"hedge_delay_ms": round(self.hedge_delay() * 1000, 3), "hosts": hosts}
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Versioned binary feature file: /bot_features?format=bin and the on-disk
+last-known-good snapshots of the worker and the proxy engines.
+
+Layout (format 3), little-endian:
+
+    header   magic "BFF1" | format u16 | flags u16 | rows u32 | version u32
+             | refreshed_at u64 | published_at_ms u64 | origin_at_ms u64 | crc32 u32
+    strings  UTF-8 names and types, each followed by NUL, packed back to back
+
+Formats 1 and 2 also stored a u32 offset table (8 bytes per row) between
+the header and the strings. It duplicated what the terminators say, so the
+file was no smaller than the JSON payload; without it a typical feature set
+is about 25% smaller than JSON, and the same size as JSON once gzipped
+(the worker serves a gzip variant, see bench_featurefile.py). Both older
+formats are still read; format 1 has no origin_at.
+
+origin_at is when the fetching worker queried ClickHouse for this version
+and published_at when it first served it; both travel unchanged through
+replicas, proxies and snapshots, so every hop can measure propagation.
+crc32 covers everything after the header. FeatureFile parses a buffer
+(bytes, mmap, memoryview) without copying it: the header is unpacked in
+place, and rows() decodes the string area once and splits it on the
+terminators. name(i) / type(i) decode only the string asked for, through an
+offset table built from the terminators on first use (read from the file
+for formats 1 and 2). decode() rejects an unknown magic or format, a short
+buffer or a bad checksum, and reading rejects terminators (or offsets) that
+do not match the row count, so a truncated or corrupt file never becomes a
+feature set.
+
+The same file is used by proxy-engines/ and kv-workers/.
+"""
+
+import collections
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"BFF1"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<4sHHIIQQQI")       # 格式 2、3 共用
+HEADER_V1 = struct.Struct("<4sHHIIQQI")
+_PREFIX = struct.Struct("<4sH")
+CONTENT_TYPE = "application/x-bot-features"
+
+Header = collections.namedtuple("Header", "format flags rows version refreshed_at published_at origin_at")
+
+
+class FormatError(ValueError):
+    pass
+
+
+def encode(rows, version, refreshed_at, published_at=None, origin_at=None):
+    values = [value for row in rows for value in row[:2]]
+    text = "\0".join(values) + "\0" if values else ""
+    body = text.encode("utf-8")
+    if body.count(b"\0") != len(values):
+        raise ValueError("feature names and types must not contain NUL")
+    published_ms = int(published_at * 1000) if published_at else 0
+    origin_ms = int(origin_at * 1000) if origin_at else 0
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(rows), version, int(refreshed_at or 0),
+                         published_ms, origin_ms, zlib.crc32(body))
+    return header + body
+
+
+class FeatureFile:
+    """Read-only view of an encoded feature file; keeps a reference to the buffer."""
+
+    __slots__ = ("header", "_buf", "_offsets", "_strings")
+
+    def __init__(self, buf):
+        view = memoryview(buf)
+        offsets = strings = None
+        try:
+            if view.nbytes < HEADER_V1.size:
+                raise FormatError(f"short feature file: {view.nbytes} bytes")
+            magic, fmt = _PREFIX.unpack_from(view)
+            if magic != MAGIC:
+                raise FormatError(f"bad magic {magic!r}")
+            if fmt in (2, FORMAT_VERSION):
+                layout = HEADER
+                if view.nbytes < layout.size:
+                    raise FormatError(f"short feature file: {view.nbytes} bytes")
+                _, _, flags, rows, version, refreshed_at, published_ms, origin_ms, crc = layout.unpack_from(view)
+            elif fmt == 1:
+                layout = HEADER_V1
+                _, _, flags, rows, version, refreshed_at, published_ms, crc = layout.unpack_from(view)
+                origin_ms = 0
+            else:
+                raise FormatError(f"unsupported feature file format {fmt}")
+            # 格式 3 没有偏移表，name(i) / type(i) 首次调用时由终止符建表
+            table_end = layout.size + ((2 * rows + 1) * 4 if fmt < 3 else 0)
+            if view.nbytes < table_end:
+                raise FormatError(f"truncated offset table: {view.nbytes} < {table_end} bytes")
+            if zlib.crc32(view[layout.size:]) != crc:
+                raise FormatError("checksum mismatch")
+
+            strings = view[table_end:]
+            if fmt < 3:
+                offsets = _read_offsets(view[layout.size:table_end])
+                if offsets[0] != 0 or offsets[-1] != strings.nbytes:
+                    raise FormatError("offset table does not cover the string area")
+            elif (strings.nbytes > 0) != (rows > 0) or (rows and strings[-1] != 0):
+                raise FormatError("string area does not end with a terminator")
+        except BaseException:
+            # traceback 仍引用这些视图：不释放的话底层 mmap 关闭时抛 BufferError
+            for v in (strings, offsets, view):
+                if v is not None:
+                    v.release()
+            raise
+
+        self.header = Header(fmt, flags, rows, version, refreshed_at or None,
+                             published_ms / 1000 if published_ms else None,
+                             origin_ms / 1000 if origin_ms else None)
+        self._buf = view
+        self._offsets = offsets
+        self._strings = strings
+
+    def __len__(self):
+        return self.header.rows
+
+    def _table(self):
+        if self._offsets is None:
+            data = self._strings.tobytes()
+            offsets = array("I", [0])
+            end = data.find(b"\0")
+            while end != -1:
+                offsets.append(end + 1)
+                end = data.find(b"\0", end + 1)
+            if len(offsets) != 2 * self.header.rows + 1 or offsets[-1] != len(data):
+                raise FormatError(f"{len(offsets) - 1} strings for {self.header.rows} rows")
+            self._offsets = memoryview(offsets)
+        return self._offsets
+
+    def _string(self, idx):
+        offsets = self._table()
+        start, end = offsets[idx], offsets[idx + 1] - 1
+        # 偏移逐个检查：打开文件时不扫描整张偏移表
+        if not 0 <= start <= end < self._strings.nbytes or self._strings[end] != 0:
+            raise FormatError(f"string {idx}: bad offsets {start}..{end + 1}")
+        try:
+            return str(self._strings[start:end], "utf-8")
+        except UnicodeDecodeError as e:
+            raise FormatError(f"string {idx}: {e}") from None
+
+    def name(self, i):
+        return self._string(2 * i)
+
+    def type(self, i):
+        return self._string(2 * i + 1)
+
+    def __iter__(self):
+        for i in range(self.header.rows):
+            yield self._string(2 * i), self._string(2 * i + 1)
+
+    def rows(self):
+        """[(name, type)] for every row."""
+        try:
+            parts = str(self._strings, "utf-8").split("\0")
+        except UnicodeDecodeError as e:
+            raise FormatError(f"string area: {e}") from None
+        # 末尾的 NUL 之后还有一个空串
+        if len(parts) != 2 * self.header.rows + 1 or parts[-1]:
+            raise FormatError(f"{len(parts) - 1} strings for {self.header.rows} rows")
+        return list(zip(parts[0:-1:2], parts[1::2]))
+
+    def release(self):
+        """Drop the views so an underlying mmap can be closed."""
+        if self._offsets is not None:
+            self._offsets.release()
+        self._strings.release()
+        self._buf.release()
+
+
+def _read_offsets(table):
+    """u32 offset table of a format 1 / 2 file, as a memoryview."""
+    offsets = table.cast("I")
+    if sys.byteorder != "little":
+        swapped = array("I", offsets)
+        swapped.byteswap()
+        offsets.release()
+        offsets = memoryview(swapped)
+    return offsets
+
+
+def decode(buf):
+    return FeatureFile(buf)
+
+
+def load(buf):
+    """([(name, type)], Header) copied out of buf; the buffer is not referenced afterwards (safe for mmap)."""
+    ff = FeatureFile(buf)
+    try:
+        return ff.rows(), ff.header
+    finally:
+        ff.release()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Crash-safe snapshot files for the last-known-good feature config.
+
+write_atomic() writes to a temporary file in the same directory, fsyncs it and
+renames it over the target, so a reader (or a process restarted after a
+crash) sees either the previous file or the new one, never a torn write.
+read_mapped() maps the file read-only, so loading at startup costs no read()
+copies beyond what the parser takes. The same file is used by proxy-engines/
+and kv-workers/.
+"""
+
+import mmap
+import os
+import threading
+import time
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # 进程 + 线程唯一的临时文件名，pre-fork 的多个 worker 同时写也不冲突
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # rename 本身落盘
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_mapped(path, parse):
+    """
+    parse(mapped) on a read-only mapping of path; returns (result, age_seconds),
+    or (None, None) if the file does not exist or is empty. parse must not keep
+    references into the mapping.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None, None
+    with f:
+        st = os.fstat(f.fileno())
+        if not st.st_size:
+            return None, None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            result = parse(mapped)
+    return result, max(0.0, time.time() - st.st_mtime)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+On-demand sampling profiler and thread snapshot for /debug/profile and /debug/threads.
+
+profile(seconds, hz) samples the stack of every thread of the process through
+sys._current_frames() hz times per second, from the requesting thread, and
+returns collapsed stacks: one "thread;outer;...;inner count" line per
+distinct stack, the input of flamegraph.pl, inferno or speedscope. Threads
+are grouped by name, with the per-connection server threads
+("Thread-12 (process_request_thread)") folded into one root. The sampler
+skips its own thread. Nothing runs between requests, so an idle profiler
+costs nothing; only one profile runs at a time.
+
+threads() is a one-off snapshot of every live thread: name, ids, daemon flag
+and its current stack, innermost frame last.
+
+In pre-fork mode both cover the worker process that answered the request.
+The same file is used by proxy-engines/ and kv-workers/.
+"""
+
+import collections
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+MAX_SECONDS = 60
+MAX_HZ = 1000
+DEFAULT_SECONDS = 5
+DEFAULT_HZ = 100
+
+_busy = threading.Lock()
+_SERVER_THREAD = re.compile(r"^Thread-\d+ \((.+)\)$")
+
+
+def _label(code):
+    # 按函数（首行号）聚合，同一函数内不同行不拆开
+    name = getattr(code, "co_qualname", code.co_name)
+    where = f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+    # 折叠栈格式以 ';' 分隔帧、以空格分隔计数
+    return f"{name} ({where})".replace(";", ":").replace(" ", "_")
+
+
+def _stack(frame):
+    """Frame labels, outermost first."""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _thread_root(name):
+    match = _SERVER_THREAD.match(name)
+    return (match.group(1) if match else name).replace(";", ":").replace(" ", "_")
+
+
+def profile(seconds=DEFAULT_SECONDS, hz=DEFAULT_HZ):
+    """
+    Sample for `seconds` at `hz`; returns (collapsed stacks text, samples taken),
+    or None when another profile is running.
+    """
+    seconds = min(max(0.01, seconds), MAX_SECONDS)
+    hz = min(max(1.0, hz), MAX_HZ)
+    if not _busy.acquire(blocking=False):
+        return None
+    try:
+        me = threading.get_ident()
+        counts = collections.Counter()
+        interval = 1.0 / hz
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_at = start
+        while True:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                root = _thread_root(names.get(ident, f"thread-{ident}"))
+                counts[";".join([root] + _stack(frame))] += 1
+            samples += 1
+            # 按固定时间表采样；落后时跳过错过的采样点而不是连续补采
+            next_at += interval
+            now = time.perf_counter()
+            if next_at < now:
+                next_at = now + interval - (now - next_at) % interval
+            if next_at >= deadline:
+                break
+            time.sleep(next_at - now)
+    finally:
+        _busy.release()
+    lines = [f"{stack} {n}" for stack, n in sorted(counts.items())]
+    return "\n".join(lines) + ("\n" if lines else ""), samples
+
+
+def threads():
+    """{"count", "threads": [{name, ident, native_id, daemon, stack}]} for every live thread."""
+    frames = sys._current_frames()
+    out = []
+    for t in sorted(threading.enumerate(), key=lambda t: t.name):
+        frame = frames.get(t.ident)
+        stack = []
+        while frame is not None:
+            stack.append(f"{getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)} "
+                         f"({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        stack.reverse()
+        out.append({"name": t.name, "ident": t.ident, "native_id": t.native_id, "daemon": t.daemon,
+                    "stack": stack})
+    return {"pid": os.getpid(), "count": len(out), "threads": out}
+
+
+def parse_query(query):
+    """(seconds, hz) from a /debug/profile query string; ValueError on bad numbers."""
+    params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+    seconds, hz = float(params.get("seconds", DEFAULT_SECONDS)), float(params.get("hz", DEFAULT_HZ))
+    if not (math.isfinite(seconds) and math.isfinite(hz)):
+        raise ValueError("seconds and hz must be finite")
+    return seconds, hz
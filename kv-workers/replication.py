@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Single-fetcher replication across the regional workers (WORKER_PEERS).
+
+Every worker sends GET /health to each peer every HEARTBEAT seconds. A peer is
+alive while its last answer is younger than LEASE. The leader is the first
+alive peer in WORKER_PEERS order among those serving the highest version, so
+every worker computes the same leader from the same liveness view, and the
+next peer in order takes over automatically once the leader stops answering
+for LEASE seconds. A restarted worker (empty, or with an older persisted
+snapshot) first replicates from the current leader and only then takes
+leadership back, so versions never go backwards. The leader
+queries ClickHouse. The others long-poll the leader's /bot_features (the same
+conditional request the proxies send) and republish its payload with the
+leader's version and origin timestamp. Propagation delay is measured from
+that timestamp.
+"""
+
+import http.client
+import json
+import threading
+import time
+
+HEARTBEAT = 1.0
+LEASE = 3.0
+
+
+class Peer:
+    __slots__ = ("name", "host", "port", "seen_mono", "health", "conn")
+
+    def __init__(self, name):
+        self.name = name
+        host, _, port = name.rpartition(":")
+        self.host = host
+        self.port = int(port)
+        self.seen_mono = None           # 上次 /health 成功的时间（monotonic）
+        self.health = {}
+        self.conn = None
+
+
+class Peers:
+    def __init__(self, names, self_name, health):
+        self.peers = [Peer(name) for name in names]
+        self.self_name = self_name
+        self._health = health           # 本节点的 /health 内容
+        self._lock = threading.Lock()
+
+    def alive(self, peer, now=None):
+        if peer.name == self.self_name:
+            return True
+        return peer.seen_mono is not None and (now or time.monotonic()) - peer.seen_mono < LEASE
+
+    def version(self, peer):
+        health = self._health() if peer.name == self.self_name else peer.health
+        return health.get("version") or 0
+
+    def leader(self):
+        now = time.monotonic()
+        live = [peer for peer in self.peers if self.alive(peer, now)]
+        if not live:
+            return None
+        newest = max(self.version(peer) for peer in live)
+        return next(peer for peer in live if self.version(peer) == newest)
+
+    def is_leader(self):
+        leader = self.leader()
+        return leader is not None and leader.name == self.self_name
+
+    # ---------------------------
+    # 心跳
+    # ---------------------------
+    def ping_all(self):
+        for peer in self.peers:
+            if peer.name != self.self_name:
+                self._ping(peer)
+
+    def heartbeat_loop(self):
+        while True:
+            self.ping_all()
+            time.sleep(HEARTBEAT)
+
+    def _ping(self, peer):
+        try:
+            if peer.conn is None:
+                peer.conn = http.client.HTTPConnection(peer.host, peer.port, timeout=HEARTBEAT)
+            peer.conn.request("GET", "/health")
+            resp = peer.conn.getresponse()
+            body = resp.read()
+            if resp.status != 200:
+                raise http.client.HTTPException(f"HTTP {resp.status}")
+        except Exception:
+            if peer.conn is not None:
+                peer.conn.close()
+                peer.conn = None
+            return
+        with self._lock:
+            peer.health = json.loads(body)
+            peer.seen_mono = time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        leader = self.leader()
+        with self._lock:
+            peers = {
+                p.name: dict(self._health() if p.name == self.self_name else p.health,
+                             alive=self.alive(p, now),
+                             seen_age_s=None if p.seen_mono is None else round(now - p.seen_mono, 3))
+                for p in self.peers
+            }
+        return {"self": self.self_name, "leader": leader.name if leader else None, "peers": peers}
+
+
+class LeaderSource:
+    """Long-polls the leader's /bot_features; fetch() returns the payload, or None when unchanged."""
+
+    def __init__(self, path="/bot_features", long_poll=10, timeout=5):
+        self.path = path
+        self.long_poll = long_poll
+        self.timeout = timeout
+        self.etag = None
+        self._peer = None
+        self._conn = None
+
+    def fetch(self, peer):
+        if peer is not self._peer:
+            # 领导者变化：换连接，并丢弃旧 ETag（版本可能不同）
+            self.close()
+            self._peer = peer
+            self.etag = None
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(peer.host, peer.port, timeout=self.timeout + self.long_poll)
+        path, headers = self.path, {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+            path += f"?wait={self.long_poll:g}"
+        try:
+            self._conn.request("GET", path, headers=headers)
+            resp = self._conn.getresponse()
+            body = resp.read()
+        except Exception:
+            self.close()
+            raise
+        if resp.status == 304:
+            return None
+        if resp.status != 200:
+            raise http.client.HTTPException(f"leader {peer.name}: HTTP {resp.status} {resp.reason}")
+        self.etag = resp.getheader("ETag")
+        return json.loads(body)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
+import collections
+import gzip
+import hashlib
 import http.server
 import socketserver
 import threading
 import json
+import os
 import time
+import urllib.parse
 import clickhouse_connect
 
+import chpool
+import featurefile
+import metrics
+import persist
+import profiler
+import replication
+
 # ========================= 配置区 =========================
 HOST = "0.0.0.0"
 PORT = 8081
 
-# 只用一个 host（集群任意节点，e.g. node1），移除 hosts= 参数
+# cluster_3shards_1replicas 的全部节点，按健康度选择，失败时切换，慢时对冲
 CLICKHOUSE_HOSTS = [
-    "clickhouse-node1",   # 选一个主节点
-    # 其他节点注释掉
+    "clickhouse-node1",
+    "clickhouse-node2",
+    "clickhouse-node3",
 ]
 
 CLICKHOUSE_PORT = 8123  # HTTP 端口
@@ -27,66 +40,553 @@ WHERE table = 'http_requests_features'
 ORDER BY name
 """
 
-INTERVAL = 10
+# 变更探测：与 QUERY 相同的可见列（权限变化也会反映出来），只返回一行。
+# 用 sum 而非 groupBitXor：重复列的哈希异或会相互抵消。
+PROBE_QUERY = """
+SELECT count(), sum(cityHash64(name, type))
+FROM system.columns
+WHERE table = 'http_requests_features'
+"""
+
+INTERVAL = 10           # 探测间隔（秒）；探测结果变化时才执行 QUERY 并重新发布
+MAX_STALENESS = 300     # 探测一直未变时，最多隔这么久也做一次完整拉取（秒）
+QUERY_TIMEOUT = 30      # 单次刷新（含失败切换与对冲）的总时限（秒）
+HEDGE_QUANTILE = 0.95   # 主查询超过近期延迟的该分位数仍未返回时，向下一个节点发送重复查询
+HEDGE_MIN = 0.05        # 对冲阈值下限（秒）
+LONG_POLL_MAX = 60      # /bot_features?wait=N 最长挂起时间（秒）
+
+# 单拉取者复制："worker-asia:8081,worker-europe:8081,..."，按顺序第一个存活的 worker 查询 ClickHouse，
+# 其余从它复制。为空时各 worker 独立查询（原行为）。WORKER_SELF 为本 worker 在列表中的名字。
+WORKER_PEERS = [p.strip() for p in os.getenv("WORKER_PEERS", "").split(",") if p.strip()]
+WORKER_SELF = os.getenv("WORKER_SELF", f"localhost:{PORT}")
+REPLICATION_LONG_POLL = 5   # 跟随者长轮询领导者的时长（秒），也是发现领导者变化的最长间隔
+
+# 每个新版本原子写入本地文件，重启时 mmap 读回，首次查询 ClickHouse 前即可提供上次的特征
+WORKER_SNAPSHOT = os.getenv("WORKER_SNAPSHOT", "/tmp/worker-features.snapshot")
 # ==========================================================
 
-# 移除 hosts= 参数（兼容旧版）
-client = clickhouse_connect.get_client(
-    host=CLICKHOUSE_HOSTS[0],  # 只用第一个
-    port=CLICKHOUSE_PORT,
-    username=CLICKHOUSE_USER,
-    password=CLICKHOUSE_PASSWORD,
-    # hosts=CLICKHOUSE_HOSTS,  # <-- 注释掉或删除这行！
-    # 如果需要负载均衡，手动轮询（见下面高级版）
-)
-
-_cached_data = {}
+def _connect(host):
+    # 每个节点一个客户端，首次查询该节点时才连接；导入本模块（基准测试等）不需要集群
+    return clickhouse_connect.get_client(
+        host=host,
+        port=CLICKHOUSE_PORT,
+        username=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+    )
+
+
+# 每次刷新把特征序列化一次：JSON、二进制特征文件，以及两者的 gzip 版本，均为不可变 bytes。
+# 特征内容版本只在内容变化时递增；refreshed_at 每次刷新都会变，ETag 只标识内容，故为弱 ETag。
+Representation = collections.namedtuple("Representation", "body etag content_type encoding")
+Bodies = collections.namedtuple("Bodies", "version rows refreshed_at published_at origin_at digest json gzip binary binary_gzip etags")
+
+
+def _build_bodies(data, version, digest, refreshed_at, published_at, origin_at):
+    # published_at：该版本最初由拉取者发布的时间；origin_at：拉取者为该版本查询 ClickHouse 的时间。
+    # 两者在复制、代理、快照中原样传递，用于计算各环节的传播延迟
+    identity = json.dumps({"data": data, "refreshed_at": refreshed_at, "version": version,
+                           "published_at": published_at, "origin_at": origin_at},
+                          ensure_ascii=False).encode("utf-8")
+    json_type = "application/json; charset=utf-8"
+    tag = f"{version}-{digest}"
+    binary = featurefile.encode(data, version, refreshed_at, published_at, origin_at)
+    reps = (
+        Representation(identity, f'W/"{tag}"', json_type, None),
+        Representation(gzip.compress(identity, 6, mtime=0), f'W/"{tag}-gz"', json_type, "gzip"),
+        Representation(binary, f'W/"{tag}-bin"', featurefile.CONTENT_TYPE, None),
+        # 二进制文件去掉了偏移表，但字符串本身不压缩：大特征集 gzip 后约小一个数量级
+        Representation(gzip.compress(binary, 6, mtime=0), f'W/"{tag}-bin-gz"', featurefile.CONTENT_TYPE, "gzip"),
+    )
+    return Bodies(version, len(data), refreshed_at, published_at, origin_at, digest, *reps,
+                  frozenset(r.etag for r in reps))
+
+
+# 请求线程只读 _bodies 一次（单次引用赋值替换），服务路径不加锁
+_bodies = _build_bodies([], 0, "0", None, None, None)
+# 仅用于长轮询等待与计数
 _cache_lock = threading.Lock()
+# 特征内容变化时唤醒挂起的长轮询请求
+_cache_changed = threading.Condition(_cache_lock)
+_not_modified = 0
+_long_polls_waiting = 0
+
+# 刷新结果计数（只有 refresh_cache 线程写入）
+_refresh_ok = 0
+_refresh_failed = 0
+_full_fetches = 0
+_last_probe = None          # 上次完整拉取前的探测结果
+_fetched_mono = None        # 上次完整拉取的时间（monotonic）
+_checked_at = None          # 上次探测成功的时间
+# POST /refresh（推送模式）：立即探测并完整拉取，不等 INTERVAL
+_refresh_now = threading.Event()
+_pushes = 0
+
+# 复制（只有 refresh_cache 线程写入）
+_peers = replication.Peers(WORKER_PEERS, WORKER_SELF, lambda: _health()) if WORKER_PEERS else None
+_leader_source = replication.LeaderSource(long_poll=REPLICATION_LONG_POLL)
+_role = "standalone" if _peers is None else None
+_replicated = 0
+_replication_failed = 0
+_last_delay = None
+
+# 本地快照（只有 refresh_cache 线程写入）
+_snapshot_saved = 0
+_snapshot_save_errors = 0
+_snapshot_saved_at = None
+_restored_version = None
+_restored_age = None
+
+# 传播追踪：本 worker 开始提供当前版本的时间及各环节耗时（只有 refresh_cache 线程写入，整体替换）
+_trace = {}
+
+# 延迟直方图（/stats 给出 p50/p99/p999，/metrics 为 Prometheus 文本格式）
+_metrics = metrics.Registry()
+_query_latency = _metrics.histogram("worker_clickhouse_query_seconds", "ClickHouse system.columns query time")
+_probe_latency = _metrics.histogram("worker_clickhouse_probe_seconds", "ClickHouse change-detection probe time")
+_request_latency = {
+    route: _metrics.histogram("worker_request_seconds", "Request latency by route", route=route)
+    for route in ("/bot_features", "/bot_features?wait", "/stats", "/metrics", "/refresh", "/health",
+                  "/debug/profile", "other")
+}
+_replication_delay = _metrics.histogram("worker_replication_delay_seconds",
+                                       "Delay from the fetcher's publish to this worker serving the version")
+_propagation = {
+    stage: _metrics.histogram("worker_config_propagation_seconds",
+                              "Seconds from the ClickHouse query that produced a config version to each trace point",
+                              stage=stage)
+    for stage in ("query", "publish", "replicate")
+}
+_pool = chpool.HostPool(CLICKHOUSE_HOSTS, _connect, _metrics, timeout=QUERY_TIMEOUT,
+                        hedge_quantile=HEDGE_QUANTILE, hedge_min=HEDGE_MIN)
+
+def publish(data, refreshed_at=None, version=None, published_at=None, origin_at=None, save=True):
+    """
+    Serialize a feature set once and swap it in; wakes long-polls when the content changed.
+    A fetcher passes data and the time it queried ClickHouse (origin_at) and gets the next
+    version; a replica passes the leader's version, published_at and origin_at.
+    """
+    global _bodies
+    data = [list(row) for row in data]
+    digest = hashlib.blake2b(json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                             digest_size=8).hexdigest()
+    current = _bodies
+    if version is None:
+        changed = digest != current.digest
+        version = current.version + 1 if changed else current.version
+    else:
+        changed = digest != current.digest or version != current.version
+    if published_at is None:
+        published_at = time.time() if changed else current.published_at
+    if not changed:
+        origin_at = current.origin_at
+    _bodies = _build_bodies(data, version, digest, int(time.time()) if refreshed_at is None else refreshed_at,
+                            published_at, origin_at)
+    if changed:
+        with _cache_changed:
+            _cache_changed.notify_all()
+        if save:
+            _save_snapshot(_bodies)
+    return _bodies
+
+
+def _save_snapshot(bodies):
+    # 二进制特征文件已在发布时编码好，直接写出这份 bytes
+    global _snapshot_saved, _snapshot_save_errors, _snapshot_saved_at
+    if not WORKER_SNAPSHOT or not bodies.rows:
+        return
+    try:
+        persist.write_atomic(WORKER_SNAPSHOT, bodies.binary.body)
+    except OSError as e:
+        _snapshot_save_errors += 1
+        print(f"[SNAPSHOT] write {WORKER_SNAPSHOT} failed: {e}")
+        return
+    _snapshot_saved += 1
+    _snapshot_saved_at = time.time()
+
+
+def restore_snapshot():
+    """Serve the last persisted version at startup, before ClickHouse (or the leader) answers."""
+    global _restored_version, _restored_age, _snapshot_saved_at
+    if not WORKER_SNAPSHOT:
+        return
+    # 损坏、截断或旧格式（JSON）的文件都按没有快照处理，不能让启动失败
+    try:
+        loaded, age = persist.read_mapped(WORKER_SNAPSHOT, featurefile.load)
+    except (OSError, ValueError, BufferError) as e:
+        print(f"[SNAPSHOT] ignoring {WORKER_SNAPSHOT}: {e}")
+        return
+    if loaded is None:
+        return
+    rows, header = loaded
+    bodies = publish(rows, header.refreshed_at, header.version, header.published_at, header.origin_at, save=False)
+    _trace_applied(bodies, None)
+    _restored_version, _restored_age = bodies.version, age
+    _snapshot_saved_at = time.time() - age
+    print(f"[SNAPSHOT] restored version {bodies.version}, {bodies.rows} columns, {age:.0f}s old")
+
+
+def _trace_applied(bodies, stage, queried_at=None):
+    """Trace point: this worker now serves `bodies`; record its age per stage (stage None: not recorded)."""
+    global _trace
+    applied_at = time.time()
+    origin = bodies.origin_at
+    trace = {"version": bodies.version, "origin_at": origin, "published_at": bodies.published_at,
+             "applied_at": applied_at, "stage": stage or "restored", "query_ms": None, "apply_ms": None}
+    if origin:
+        if queried_at is not None:
+            trace["query_ms"] = round((queried_at - origin) * 1000, 3)
+            _propagation["query"].record(max(0.0, queried_at - origin))
+        trace["apply_ms"] = round((applied_at - origin) * 1000, 3)
+        if stage is not None:
+            _propagation[stage].record(max(0.0, applied_at - origin))
+    _trace = trace
+
+
+def _query(sql, hist):
+    start = time.perf_counter()
+    try:
+        return _pool.query(sql).result_rows
+    finally:
+        hist.record(time.perf_counter() - start)
+
+
+def _replicate_once():
+    """Follower: one long-poll on the leader's /bot_features; republish a new version as is."""
+    global _replicated, _replication_failed, _last_delay
+    leader = _peers.leader()
+    try:
+        payload = _leader_source.fetch(leader)
+    except Exception as e:
+        _replication_failed += 1
+        print(f"[REPL] fetch from {leader.name} failed: {e}")
+        time.sleep(replication.HEARTBEAT)
+        return
+    if payload is None:
+        return
+    published_at = payload.get("published_at")
+    previous = _bodies.version
+    bodies = publish(payload["data"], payload.get("refreshed_at"), payload.get("version"), published_at,
+                     payload.get("origin_at"))
+    if bodies.version == previous:
+        return
+    _replicated += 1
+    delay = ""
+    # 刚启动（版本 0）时追上的是旧版本，其“延迟”只是快照年龄，不计入
+    _trace_applied(bodies, "replicate" if previous else None)
+    if published_at and previous:
+        _last_delay = max(0.0, time.time() - published_at)
+        _replication_delay.record(_last_delay)
+        delay = f", delay {_last_delay * 1000:.1f}ms"
+    print(f"[REPL] version {bodies.version} from {leader.name}, {bodies.rows} columns{delay}")
+
 
 def refresh_cache():
-    global _cached_data
+    """
+    Probe every INTERVAL seconds; run the full QUERY and republish only when the probe
+    changed, a push asked for it, or the last full fetch is older than MAX_STALENESS.
+    With WORKER_PEERS only the elected leader does this; the others replicate from it.
+    """
+    global _refresh_ok, _refresh_failed, _full_fetches, _last_probe, _fetched_mono, _checked_at, _role
+    if _peers is not None:
+        # 选举前等各节点的 /health（最多一个租期），避免同时启动时每个 worker 都以为自己是领导者
+        deadline = time.monotonic() + replication.LEASE
+        while True:
+            _peers.ping_all()
+            if all(_peers.alive(p) for p in _peers.peers) or time.monotonic() >= deadline:
+                break
+            time.sleep(replication.HEARTBEAT / 4)
     while True:
+        if _peers is not None:
+            role = "leader" if _peers.is_leader() else "follower"
+            if role != _role:
+                print(f"[REPL] {WORKER_SELF} is now {role} (leader: {_peers.leader().name})")
+                _role = role
+                # 刚当选：不沿用旧探测结果，立即完整拉取一次
+                _last_probe = None
+            if role == "follower":
+                _replicate_once()
+                continue
         try:
-            # 用 JSONEachRow 格式，直接得 list[dict]
-            result = client.query(QUERY)
-            data = result.result_rows  # 已是最小化 dict 列表
+            pushed = _refresh_now.is_set()
+            _refresh_now.clear()
+            # 追踪起点：本轮探测发出的时间（配置变化最早在此被观察到）
+            origin = time.time()
+            probe = _query(PROBE_QUERY, _probe_latency)
+            _checked_at = int(time.time())
+            stale = _fetched_mono is None or time.monotonic() - _fetched_mono >= MAX_STALENESS
 
-            with _cache_lock:
-                _cached_data = {"data": data, "refreshed_at": int(time.time())}
+            if pushed or stale or probe != _last_probe:
+                # result_rows：system.columns 的 [(name, type)] 行
+                data = _query(QUERY, _query_latency)
+                queried_at = time.time()
+                previous = _bodies.version
+                bodies = publish(data, origin_at=origin)
+                if bodies.version != previous:
+                    _trace_applied(bodies, "publish", queried_at)
+                _last_probe = probe
+                _fetched_mono = time.monotonic()
+                _full_fetches += 1
+                reason = "push" if pushed else "stale" if stale else "probe changed"
+                print(f"[CK] cache updated, {len(data)} columns ({reason})")
 
-            print(f"[CK] cache updated, {len(data)} columns")
+            _refresh_ok += 1
 
         except Exception as e:
+            _refresh_failed += 1
             print(f"[CK] query failed: {e}")
 
-        time.sleep(INTERVAL)
+        _refresh_now.wait(INTERVAL)
+
+def _health():
+    bodies = _bodies
+    return {"name": WORKER_SELF, "role": _role, "version": bodies.version,
+            "delay_ms": None if _last_delay is None else round(_last_delay * 1000, 3)}
+
+
+def _replication_stats():
+    payload = {"mode": _role, "replicated": _replicated, "failed": _replication_failed,
+               "last_delay_ms": None if _last_delay is None else round(_last_delay * 1000, 3)}
+    if _peers is not None:
+        payload.update(_peers.stats())
+    return payload
+
+
+def _snapshot_stats():
+    return {
+        "path": WORKER_SNAPSHOT,
+        "restored_version": _restored_version,
+        "restored_age_s": None if _restored_age is None else round(_restored_age, 3),
+        "saved": _snapshot_saved,
+        "save_errors": _snapshot_save_errors,
+        "age_s": None if _snapshot_saved_at is None else round(time.time() - _snapshot_saved_at, 3),
+    }
+
+
+def _stats_payload():
+    bodies = _bodies
+    with _cache_lock:
+        not_modified, waiting = _not_modified, _long_polls_waiting
+    return {
+        "rows": bodies.rows,
+        "refreshed_at": bodies.refreshed_at,
+        "version": bodies.version,
+        "published_at": bodies.published_at,
+        "origin_at": bodies.origin_at,
+        "etag": bodies.json.etag,
+        "bytes": {"json": len(bodies.json.body), "gzip": len(bodies.gzip.body), "binary": len(bodies.binary.body),
+                  "binary_gzip": len(bodies.binary_gzip.body)},
+        "not_modified": not_modified,
+        "long_polls_waiting": waiting,
+        "refresh_ok": _refresh_ok,
+        "refresh_failed": _refresh_failed,
+        "full_fetches": _full_fetches,
+        "pushes": _pushes,
+        "checked_at": _checked_at,
+        "fetch_age_s": round(time.monotonic() - _fetched_mono, 3) if _fetched_mono else None,
+        "max_staleness_s": MAX_STALENESS,
+        "clickhouse": _pool.stats(),
+        "replication": _replication_stats(),
+        "snapshot": _snapshot_stats(),
+        "trace": _trace,
+        "latency": _metrics.export(),
+    }
+
+
+def _render_metrics(payload):
+    samples = [
+        ("worker_feature_rows", "gauge", "Rows in the cached feature set", {}, payload["rows"]),
+        ("worker_feature_version", "gauge", "Feature content version", {}, payload["version"]),
+        ("worker_not_modified_total", "counter", "/bot_features requests answered with 304", {},
+         payload["not_modified"]),
+        ("worker_long_polls_waiting", "gauge", "/bot_features long-poll requests currently held", {},
+         payload["long_polls_waiting"]),
+        ("worker_refresh_total", "counter", "refresh_cache iterations by result", {"result": "ok"},
+         payload["refresh_ok"]),
+        ("worker_refresh_total", "counter", "refresh_cache iterations by result", {"result": "failed"},
+         payload["refresh_failed"]),
+        ("worker_full_fetch_total", "counter", "Full system.columns fetches (probe changed, push or staleness)",
+         {}, payload["full_fetches"]),
+        ("worker_refresh_push_total", "counter", "POST /refresh requests", {}, payload["pushes"]),
+        ("worker_is_leader", "gauge", "1 while this worker is the elected ClickHouse fetcher", {},
+         int(payload["replication"]["mode"] in ("leader", "standalone"))),
+        ("worker_replication_total", "counter", "Versions replicated from the leader", {},
+         payload["replication"]["replicated"]),
+    ]
+    hosts = payload["clickhouse"]["hosts"]
+    for key, help in (("queries", "ClickHouse queries sent, hedges and failovers included"),
+                      ("errors", "ClickHouse queries that failed"),
+                      ("hedges", "Hedged duplicate queries sent"),
+                      ("hedge_wins", "Hedged queries that answered first"),
+                      ("failovers", "Queries retried on this host after another failed")):
+        for host, h in hosts.items():
+            samples.append((f"worker_clickhouse_{key}_total", "counter", help, {"host": host}, h[key]))
+    for host, h in hosts.items():
+        samples.append(("worker_clickhouse_host_ejected", "gauge", "1 while the host is ejected",
+                        {"host": host}, int(h["ejected"])))
+    return metrics.render_prometheus(payload["latency"], samples)
+
 
-# ... 其余代码不变（BotHandler, run_server 等）
 class BotHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出，keep-alive 连接上需关闭 Nagle
+    disable_nagle_algorithm = True
+
     def do_GET(self):
-        if self.path == "/bot_features":
-            with _cache_lock:
-                body = json.dumps(_cached_data, ensure_ascii=False).encode("utf-8")
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        self._label = url.path
+        try:
+            self._route(url)
+        finally:
+            hist = _request_latency.get(self._label, _request_latency["other"])
+            hist.record(time.perf_counter() - start)
+
+    def _route(self, url):
+        if url.path == "/bot_features":
+            return self._serve_features(urllib.parse.parse_qs(url.query))
+
+        if url.path == "/stats":
+            payload = _stats_payload()
+            payload["latency"] = metrics.summarize(payload["latency"])
+            body = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+            return self._send(body, "application/json; charset=utf-8")
+
+        if url.path == "/health":
+            body = json.dumps(_health()).encode("utf-8")
+            return self._send(body, "application/json; charset=utf-8")
+
+        if url.path == "/metrics":
+            body = _render_metrics(_stats_payload()).encode("utf-8")
+            return self._send(body, "text/plain; version=0.0.4; charset=utf-8")
+
+        if url.path == "/debug/profile":
+            return self._serve_profile(url.query)
 
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
-            return
+        if url.path == "/debug/threads":
+            body = json.dumps(profiler.threads(), ensure_ascii=False, indent=2).encode("utf-8")
+            return self._send(body, "application/json; charset=utf-8")
 
         self.send_response(404)
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        self._label = url.path if url.path == "/refresh" else "other"
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            if url.path != "/refresh":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._push()
+        finally:
+            _request_latency[self._label].record(time.perf_counter() - start)
+
+    def _push(self):
+        """Push mode: wake refresh_cache for an immediate full fetch (e.g. right after DDL or GRANT)."""
+        global _pushes
+        with _cache_lock:
+            _pushes += 1
+        _refresh_now.set()
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve_features(self, params):
+        """
+        Serve the pre-serialized representation: ?format=bin or Accept: application/x-bot-features
+        gets the binary form, anything else JSON; with Accept-Encoding: gzip, gzipped.
+        If-None-Match equal to a current ETag gets a 304; with ?wait=N the request is held
+        until the content changes or N seconds pass.
+        """
+        global _not_modified, _long_polls_waiting
+        try:
+            wait = min(float(params.get("wait", ["0"])[0]), LONG_POLL_MAX)
+        except ValueError:
+            wait = 0
+        inm = self.headers.get("If-None-Match")
+
+        bodies = _bodies
+        if inm is not None and inm in bodies.etags:
+            if wait > 0:
+                self._label = "/bot_features?wait"
+                with _cache_changed:
+                    _long_polls_waiting += 1
+                    try:
+                        _cache_changed.wait_for(lambda: inm not in _bodies.etags, timeout=wait)
+                    finally:
+                        _long_polls_waiting -= 1
+                bodies = _bodies
+            if inm in bodies.etags:
+                with _cache_lock:
+                    _not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", inm)
+                self.end_headers()
+                return
+
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if (params.get("format") == ["bin"]
+                or featurefile.CONTENT_TYPE in self.headers.get("Accept", "")):
+            rep = bodies.binary_gzip if gzipped else bodies.binary
+        elif gzipped:
+            rep = bodies.gzip
+        else:
+            rep = bodies.json
+        self._send(rep.body, rep.content_type, rep.etag, rep.encoding)
+
+    def _serve_profile(self, query):
+        """Sample every thread for ?seconds=N at ?hz=N from this request thread; collapsed stacks."""
+        try:
+            seconds, hz = profiler.parse_query(query)
+        except ValueError as e:
+            return self._send(f"bad profile parameters: {e}\n".encode("utf-8"), "text/plain; charset=utf-8",
+                              status=400)
+        result = profiler.profile(seconds, hz)
+        if result is None:
+            return self._send(b"a profile is already running\n", "text/plain; charset=utf-8", status=409)
+        text, samples = result
+        self._send(text.encode("utf-8"), "text/plain; charset=utf-8",
+                   headers=(("X-Profile-Samples", samples), ("X-Profile-Pid", os.getpid())))
+
+    def _send(self, body, content_type, etag=None, encoding=None, status=200, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept, Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for header, value in headers:
+            self.send_header(header, str(value))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, fmt, *args):
         print("%s - %s" % (self.client_address[0], fmt % args))
 
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # keep-alive 连接各占一个线程
+    daemon_threads = True
+    request_queue_size = 128
+
+
 def run_server():
-    server = socketserver.ThreadingTCPServer((HOST, PORT), BotHandler)
+    server = ThreadingHTTPServer((HOST, PORT), BotHandler)
     print(f"[BOT] listening on {HOST}:{PORT}")
     server.serve_forever()
 
 if __name__ == "__main__":
-    t = threading.Thread(target=refresh_cache, daemon=True)
+    restore_snapshot()
+    # 线程命名：/debug/threads 与 /debug/profile 按名字区分
+    t = threading.Thread(target=refresh_cache, daemon=True, name="refresh_cache")
     t.start()
+    if _peers is not None:
+        threading.Thread(target=_peers.heartbeat_loop, daemon=True, name="heartbeat").start()
     run_server()
\ No newline at end of file
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the clickhouse_connect client used by kv-workers/worker.py.
+
+get_client(host=...) returns a client whose query() answers the worker's
+QUERY and PROBE_QUERY (system.columns of http_requests_features) from a
+Cluster, without ClickHouse or docker:
+  - columns   : the [name, type] list of http_requests_features
+  - databases : the databases test_user can see the table in; granting r0
+                (the 2025-11-18 change) lists every column twice
+  - hosts     : per-host faults: latency + exponential jitter (seconds),
+                error_rate (probability a query fails) and down (connect
+                and every query fail), with "*" as the default for all hosts
+
+The state is kept in memory, or in a JSON file that is re-read whenever it
+changes, so a worker in another process and a scenario driver share one
+cluster:
+
+    python fakeclickhouse.py /tmp/ch.json grant r0
+    python fakeclickhouse.py /tmp/ch.json host clickhouse-node2 --latency 0.5 --error-rate 0.2
+    python fakeclickhouse.py /tmp/ch.json show
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+TABLE = "http_requests_features"
+
+DEFAULT_STATE = {
+    # clickhouse-cluster/README.md 中建表语句的列
+    "columns": [["event_date", "Date"], ["request_id", "UInt64"], ["feature_1", "String"], ["feature_2", "Float64"]],
+    "databases": ["default"],
+    "hosts": {"*": {"latency": 0.002, "jitter": 0.0, "error_rate": 0.0, "down": False}},
+}
+
+_TABLE_RE = re.compile(r"table\s*=\s*'([^']*)'")
+
+
+class OperationalError(Exception):
+    """Host unreachable (clickhouse_connect.driver.exceptions.OperationalError)."""
+
+
+class DatabaseError(Exception):
+    """Query rejected by the server (clickhouse_connect.driver.exceptions.DatabaseError)."""
+
+
+def _column_hash(name, type_):
+    # cityHash64(name, type) 的替身：只需稳定且 64 位
+    return int.from_bytes(hashlib.blake2b(f"{name}\0{type_}".encode(), digest_size=8).digest(), "little")
+
+
+class Cluster:
+    """Shared fake cluster state; path=None keeps it in this process only."""
+
+    def __init__(self, path=None, state=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = copy.deepcopy(state or DEFAULT_STATE)
+        self._stamp = None
+        self.queries = {}               # host -> 本进程内收到的查询数
+        if path and state is not None:
+            self._write()
+
+    # ---------------------------
+    # 状态
+    # ---------------------------
+    def state(self):
+        if self.path is None:
+            return self._state
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._state
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path, encoding="utf-8") as f:
+                    self._state = json.load(f)
+                self._stamp = stamp
+            return self._state
+
+    def _write(self):
+        if self.path is None:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def update(self, **changes):
+        """Replace top-level keys (columns, databases, hosts) and publish the new state."""
+        state = copy.deepcopy(self.state())
+        state.update(changes)
+        with self._lock:
+            self._state = state
+            self._write()
+
+    def grant(self, database="r0"):
+        databases = list(self.state()["databases"])
+        if database not in databases:
+            self.update(databases=databases + [database])
+
+    def revoke(self, database="r0"):
+        self.update(databases=[d for d in self.state()["databases"] if d != database])
+
+    def set_host(self, host="*", **faults):
+        """Set latency / jitter / error_rate / down for one host ("*": every host without its own entry)."""
+        hosts = copy.deepcopy(self.state()["hosts"])
+        hosts.setdefault(host, {}).update(faults)
+        self.update(hosts=hosts)
+
+    def faults(self, host):
+        hosts = self.state()["hosts"]
+        merged = dict(DEFAULT_STATE["hosts"]["*"])
+        merged.update(hosts.get("*", {}))
+        merged.update(hosts.get(host, {}))
+        return merged
+
+    def rows(self):
+        """What system.columns returns for the table: every column once per visible database."""
+        state = self.state()
+        return sorted((tuple(col) for _ in state["databases"] for col in state["columns"]), key=lambda r: r[0])
+
+    # ---------------------------
+    # 查询
+    # ---------------------------
+    def connect(self, host):
+        if self.faults(host)["down"]:
+            raise OperationalError(f"Error HTTPConnectionPool(host='{host}'): Connection refused")
+
+    def query(self, host, sql):
+        self.queries[host] = self.queries.get(host, 0) + 1
+        faults = self.faults(host)
+        delay = faults["latency"] + (random.expovariate(1 / faults["jitter"]) if faults["jitter"] else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if faults["down"]:
+            raise OperationalError(f"Error HTTPConnectionPool(host='{host}'): Connection refused")
+        if random.random() < faults["error_rate"]:
+            raise DatabaseError(f"Code: 210. DB::NetException: injected fault on {host}")
+
+        if "system.columns" not in sql:
+            raise DatabaseError("Code: 60. DB::Exception: only system.columns is emulated")
+        match = _TABLE_RE.search(sql)
+        rows = self.rows() if match and match.group(1) == TABLE else []
+        if "count()" in sql:
+            return [(len(rows), sum(_column_hash(*r) for r in rows) % (1 << 64))]
+        return rows
+
+
+class QueryResult:
+    def __init__(self, rows):
+        self.result_rows = rows
+        self.row_count = len(rows)
+
+
+class Client:
+    def __init__(self, cluster, host):
+        self.cluster = cluster
+        self.host = host
+
+    def query(self, sql):
+        return QueryResult(self.cluster.query(self.host, sql))
+
+    def close(self):
+        pass
+
+
+# 未指定 cluster 时使用的共享实例；FAKE_CLICKHOUSE_STATE 指向状态文件
+default = Cluster(os.getenv("FAKE_CLICKHOUSE_STATE") or None)
+
+
+def get_client(host="localhost", port=None, username=None, password=None, cluster=None, **kwargs):
+    """Same call shape as clickhouse_connect.get_client; fails like it when the host is down."""
+    cluster = cluster or default
+    cluster.connect(host)
+    return Client(cluster, host)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("state", help="cluster state file (created with the defaults if missing)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("show")
+    sub.add_parser("reset")
+    for name in ("grant", "revoke"):
+        sub.add_parser(name).add_argument("database", nargs="?", default="r0")
+    host = sub.add_parser("host")
+    host.add_argument("name", help='host name, "*" for every host')
+    host.add_argument("--latency", type=float)
+    host.add_argument("--jitter", type=float)
+    host.add_argument("--error-rate", type=float)
+    host.add_argument("--down", action="store_true", default=None)
+    host.add_argument("--up", dest="down", action="store_false")
+    args = ap.parse_args()
+
+    cluster = Cluster(args.state)
+    if args.command == "reset" or not os.path.exists(args.state):
+        cluster.update(**copy.deepcopy(DEFAULT_STATE))
+    if args.command == "grant":
+        cluster.grant(args.database)
+    elif args.command == "revoke":
+        cluster.revoke(args.database)
+    elif args.command == "host":
+        faults = {k: v for k, v in (("latency", args.latency), ("jitter", args.jitter),
+                                    ("error_rate", args.error_rate), ("down", args.down)) if v is not None}
+        cluster.set_host(args.name, **faults)
+    print(json.dumps(cluster.state(), indent=1))
+    print(f"system.columns: {len(cluster.rows())} rows")
+
+
+if __name__ == "__main__":
+    main()
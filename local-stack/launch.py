@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Launchers for the demo services on ephemeral ports, on one box without docker.
+
+  start_app()                 customer app (proxy-engines/app.py)
+  start_worker(cluster)       kv worker (kv-workers/worker.py) on a fakeclickhouse.Cluster
+                              (cluster="real": clickhouse_connect and worker.CLICKHOUSE_HOSTS)
+  start_proxy(engine, ...)    FL (fl.py) or FL2 (fl2.py) in front of the app, fed by the worker
+  start_stack()               all of the above: worker, app and the three proxy flavours of
+                              the outage, fl-off, fl-on (bot manager) and fl2
+
+Each returns a Service with .url, .port, .alive and .stop(). A service runs in
+this process on its own module instance (its own globals, so FL with the bot
+manager off and on can run side by side), or with isolate=True in a spawned
+child process, like its container. FL2 is isolated by default: importing it
+installs the thread excepthook that os._exit()s the process on the config
+panic. restart=True respawns a dead child on the same port after
+RESTART_BACKOFF, like `restart: unless-stopped`.
+
+    python launch.py                 # start the stack, print the URLs, Ctrl-C to stop
+    python launch.py --isolate       # every service in its own process
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+KV_WORKERS = os.path.join(ROOT, "kv-workers")
+PROXY_ENGINES = os.path.join(ROOT, "proxy-engines")
+# metrics / featurefile / persist 两个目录各有一份相同的副本，先找到哪份都一样
+for _path in (KV_WORKERS, PROXY_ENGINES, HERE):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import fakeclickhouse
+
+BIND = "127.0.0.1"
+START_TIMEOUT = 15.0       # 子进程启动并绑定端口的最长等待（秒）
+RESTART_BACKOFF = 1.0
+WORKER_INTERVAL = 1.0      # 本地 worker 的探测间隔（秒），生产为 10
+PROXY_INTERVAL = 1.0       # 本地代理拉取失败后的重试间隔（秒），生产为 15
+
+_import_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+# ================================
+# 独立模块实例
+# ================================
+@contextlib.contextmanager
+def _patched(mapping, updates):
+    saved = {k: mapping.get(k) for k in updates}
+    mapping.update(updates)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                mapping.pop(k, None)
+            else:
+                mapping[k] = v
+
+
+def _load(directory, name, env, modules=None):
+    """A fresh instance of directory/name.py, imported with env (module-level config) applied."""
+    spec = importlib.util.spec_from_file_location(f"{name}_{next(_ids)}", os.path.join(directory, name + ".py"))
+    mod = importlib.util.module_from_spec(spec)
+    with _import_lock, _patched(os.environ, {k: str(v) for k, v in env.items()}), \
+            _patched(sys.modules, modules or {}):
+        spec.loader.exec_module(mod)
+    return mod
+
+
+def _quiet(handler):
+    # 每请求一行的访问日志在压测时就是瓶颈
+    return type(handler.__name__, (handler,), {"log_message": lambda self, fmt, *args: None})
+
+
+def _clickhouse(cluster):
+    """The clickhouse_connect module the worker imports: the stand-in bound to cluster, or the real one."""
+    if cluster == "real":
+        import clickhouse_connect
+        return clickhouse_connect
+    if isinstance(cluster, str):
+        cluster = fakeclickhouse.Cluster(cluster)
+    stand_in = types.ModuleType("clickhouse_connect")
+    stand_in.get_client = lambda **kw: fakeclickhouse.get_client(cluster=cluster, **kw)
+    return stand_in
+
+
+def _thread(target, name):
+    t = threading.Thread(target=target, daemon=True, name=name)
+    t.start()
+    return t
+
+
+# ================================
+# 各服务：加载模块、绑定端口、启动后台线程，返回 (module, server)
+# ================================
+def _run_app(port=0, env=None, access_log=False):
+    mod = _load(PROXY_ENGINES, "app", env or {})
+    handler = mod.GreetingHandler if access_log else _quiet(mod.GreetingHandler)
+    return mod, mod.ThreadedHTTPServer((BIND, port), handler)
+
+
+def _run_worker(port=0, env=None, access_log=False, cluster=None, interval=WORKER_INTERVAL):
+    mod = _load(KV_WORKERS, "worker", env or {}, {"clickhouse_connect": _clickhouse(cluster)})
+    mod.INTERVAL = interval
+    handler = mod.BotHandler if access_log else _quiet(mod.BotHandler)
+    server = mod.ThreadingHTTPServer((BIND, port), handler)
+    mod.restore_snapshot()
+    _thread(mod.refresh_cache, "refresh_cache")
+    if mod._peers is not None:
+        _thread(mod._peers.heartbeat_loop, "heartbeat")
+    return mod, server
+
+
+def _run_proxy(port=0, env=None, access_log=False, engine="fl", interval=PROXY_INTERVAL):
+    mod = _load(PROXY_ENGINES, engine, env or {})
+    mod.INTERVAL = interval
+    handler = mod.ProxyHandler if access_log else _quiet(mod.ProxyHandler)
+    server = mod.ThreadingHTTPServer((BIND, port), handler)
+    snap = mod._features.restore()
+    if snap is not None:
+        print(f"[SNAPSHOT] {engine}: restored rows = {snap.row_count}")
+    _thread(mod.features_background_worker, "features_background_worker")
+    return mod, server
+
+
+_RUNNERS = {"app": _run_app, "worker": _run_worker, "proxy": _run_proxy}
+
+
+# ================================
+# Service：本进程线程 / 子进程
+# ================================
+class Service:
+    """A server running in this process; stop() closes the listener (background threads stay, as daemons)."""
+
+    isolated = False
+    restarts = 0
+
+    def __init__(self, name, kind, options):
+        self.name = name
+        self.module, self.server = _RUNNERS[kind](**options)
+        self.port = self.server.server_address[1]
+        self._thread = _thread(self.server.serve_forever, f"{name}_server")
+
+    @property
+    def url(self):
+        return f"http://{BIND}:{self.port}"
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _child_main(kind, options, conn):
+    _, server = _RUNNERS[kind](**options)
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+class ChildService:
+    """The same server in a spawned process; with restart, a dead child is respawned on the same port."""
+
+    isolated = True
+
+    def __init__(self, name, kind, options, restart=False):
+        self.name = name
+        self.kind = kind
+        self.options = dict(options)
+        self.restart = restart
+        self.restarts = 0
+        self._stopped = threading.Event()
+        self.process = None
+        self.port = self._spawn()
+        self.options["port"] = self.port
+        if restart:
+            _thread(self._supervise, f"{name}_supervisor")
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("spawn")
+        recv, send = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=_child_main, args=(self.kind, self.options, send),
+                                   name=self.name, daemon=True)
+        self.process.start()
+        send.close()
+        if not recv.poll(START_TIMEOUT):
+            self.process.kill()
+            raise RuntimeError(f"{self.name} did not start within {START_TIMEOUT:g}s")
+        port = recv.recv()
+        recv.close()
+        return port
+
+    def _supervise(self):
+        while not self._stopped.is_set():
+            self.process.join()
+            if self._stopped.wait(RESTART_BACKOFF):
+                return
+            print(f"[LAUNCH] {self.name} exited ({self.process.exitcode}), restarting on port {self.port}")
+            try:
+                self._spawn()
+            except (OSError, RuntimeError, EOFError) as e:
+                print(f"[LAUNCH] {self.name} restart failed: {e}")
+                continue
+            self.restarts += 1
+
+    url = Service.url
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        self._stopped.set()
+        self.process.terminate()
+        self.process.join(5)
+
+
+def _start(name, kind, options, isolate, restart):
+    if isolate:
+        if isinstance(options.get("cluster"), fakeclickhouse.Cluster):
+            if options["cluster"].path is None:
+                raise ValueError("an isolated worker needs a file-backed fakeclickhouse.Cluster")
+            options["cluster"] = options["cluster"].path
+        return ChildService(name, kind, options, restart)
+    return Service(name, kind, options)
+
+
+def start_app(port=0, env=None, isolate=False, restart=False, access_log=False):
+    return _start("app", "app", {"port": port, "env": env, "access_log": access_log}, isolate, restart)
+
+
+def start_worker(cluster=None, port=0, env=None, snapshot="", interval=WORKER_INTERVAL,
+                 isolate=False, restart=False, access_log=False, name="worker"):
+    """cluster: fakeclickhouse.Cluster (default: fakeclickhouse.default), a state file path, or "real"."""
+    env = dict({"WORKER_SNAPSHOT": snapshot}, **(env or {}))
+    options = {"port": port, "env": env, "access_log": access_log, "cluster": cluster or fakeclickhouse.default,
+               "interval": interval}
+    return _start(name, "worker", options, isolate, restart)
+
+
+def start_proxy(engine, features_url, backends, bot_manager=False, port=0, env=None, snapshot="",
+                interval=PROXY_INTERVAL, isolate=None, restart=False, access_log=False, name=None):
+    """FL / FL2 in front of backends ("host:port,..."), pulling features_url. FL2 is isolated unless told otherwise."""
+    env = dict({"FEATURES_URL": features_url, "PROXY_BACKENDS": backends, "FEATURES_SNAPSHOT": snapshot,
+                "IS_BOT_MANAGER_ON": "true" if bot_manager else "false"}, **(env or {}))
+    if isolate is None:
+        isolate = engine == "fl2"
+    options = {"port": port, "env": env, "access_log": access_log, "engine": engine, "interval": interval}
+    return _start(name or engine, "proxy", options, isolate, restart)
+
+
+# ================================
+# 整套环境
+# ================================
+PROXIES = (
+    # name, engine, bot manager
+    ("fl-off", "fl", False),
+    ("fl-on", "fl", True),
+    ("fl2", "fl2", True),
+)
+
+
+class Stack:
+    """worker + app + the PROXIES, sharing one fake cluster; every service keeps its snapshots in tmpdir."""
+
+    def __init__(self, cluster=None, isolate=False, restart=True, env=None):
+        self.tmpdir = tempfile.mkdtemp(prefix="local-stack-")
+        self.cluster = cluster or fakeclickhouse.Cluster(os.path.join(self.tmpdir, "clickhouse.json"),
+                                                         fakeclickhouse.DEFAULT_STATE)
+        self.services = {}
+        try:
+            self.app = self._add(start_app(isolate=isolate, restart=restart))
+            self.worker = self._add(start_worker(self.cluster, snapshot=self._file("worker.snapshot"),
+                                                 env=env, isolate=isolate, restart=restart))
+            self.proxies = {}
+            for name, engine, bot_manager in PROXIES:
+                self.proxies[name] = self._add(start_proxy(
+                    engine, f"{self.worker.url}/bot_features", f"{BIND}:{self.app.port}", bot_manager,
+                    snapshot=self._file(f"{name}.features"), env=env, isolate=isolate or None,
+                    restart=restart, name=name))
+        except Exception:
+            self.stop()
+            raise
+
+    def _file(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _add(self, service):
+        self.services[service.name] = service
+        return service
+
+    def wait_ready(self, timeout=10.0):
+        """Wait until every proxy serves a config from the worker; False on timeout."""
+        deadline = time.monotonic() + timeout
+        pending = dict(self.proxies)
+        while pending and time.monotonic() < deadline:
+            for name, proxy in list(pending.items()):
+                try:
+                    with urllib.request.urlopen(f"{proxy.url}/stats", timeout=1) as resp:
+                        if json.load(resp)["features"]["config_version"]:
+                            del pending[name]
+                except (OSError, ValueError, KeyError):
+                    pass
+            if pending:
+                time.sleep(0.1)
+        return not pending
+
+    def stop(self):
+        for service in reversed(list(self.services.values())):
+            try:
+                service.stop()
+            except Exception as e:
+                print(f"[LAUNCH] stopping {service.name}: {e}")
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def start_stack(cluster=None, isolate=False, restart=True, env=None):
+    return Stack(cluster, isolate, restart, env)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--isolate", action="store_true", help="run every service in its own process")
+    args = ap.parse_args()
+
+    stack = start_stack(isolate=args.isolate)
+    ready = stack.wait_ready()
+    for name, service in stack.services.items():
+        mode = "process" if service.isolated else "thread"
+        print(f"{name:<8}{service.url:<28}{mode}")
+    print(f"clickhouse stand-in: {stack.cluster.path}{'' if ready else ' (proxies not ready yet)'}")
+    print(f"  python {os.path.join(HERE, 'fakeclickhouse.py')} {stack.cluster.path} grant r0")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stack.stop()
+
+
+if __name__ == "__main__":
+    main()
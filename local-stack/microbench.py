@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Component microbenchmarks on one box, against services started by launch.py.
+
+  forward  : GET --path (default /) through each proxy of the stack (fl-off,
+             fl-on, fl2) to the app, with browser-like headers so the bot
+             manager lets it through; app.py's synthetic backend knobs in the
+             query pick the body size, latency, errors and framing
+  features : GET /bot_features from a worker on the ClickHouse stand-in, as
+             json, gzip and bin, for every --features size
+  stats    : GET /stats from each proxy and the worker
+  parse    : in this process, per payload of every --features size: json.loads
+             and featurefile.load of the worker's bodies, and
+             FeatureStore.candidate (validation + bot scorer), i.e. what a proxy
+             does with a new config; plus /stats rendering of an FL instance
+             and a worker
+
+HTTP cases are closed loop: --clients threads send requests back to back over
+keep-alive connections for --seconds. Every measurement runs --repeat times
+after a --warmup run; the report gives the median run (rate, p50, p99) and the
+min-max spread of the rate across runs. --json writes the rows together with
+the host details, to compare runs of the same box.
+
+Services run in their own processes (like their containers), so the client
+threads do not share a GIL with the server under test; --in-process keeps
+everything in this process (FL2 excepted, see launch.py).
+
+    python microbench.py --seconds 2 --repeat 3
+    python microbench.py --cases parse --features 4,1000,100000 --json parse.json
+    python microbench.py --cases forward --path '/?size=lognormal:16k,1&latency=exp:2'
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+# launch 先导入：它把 kv-workers/ 与 proxy-engines/ 加入 sys.path
+import launch
+import fakeclickhouse
+import featurefile
+import features
+
+CASES = ("forward", "features", "stats", "parse")
+
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate",
+    "Cookie": "session=local-stack",
+    "Referer": "https://customer-site/",
+}
+
+
+def rows_for(n):
+    return [[f"feature_{i:06d}", ("String", "Float64", "UInt64", "Date")[i % 4]] for i in range(n)]
+
+
+def _pick(latencies, q):
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+
+
+# ================================
+# 测量：HTTP 闭环 / 进程内逐次计时
+# ================================
+def _client(port, path, headers, deadline, out):
+    latencies = []
+    size = errors = 0
+    conn = None
+    while time.perf_counter() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection(launch.BIND, port, timeout=10)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            size = len(resp.read())
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if resp.status != 200:
+            errors += 1
+        if resp.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    out.append((latencies, size, errors))
+
+
+def http_load(port, path, headers, clients, seconds):
+    out = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_client, args=(port, path, headers, deadline, out)) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(x for lat, _, _ in out for x in lat)
+    return {
+        "rate": len(latencies) / elapsed,
+        "p50_ms": _pick(latencies, 0.50),
+        "p99_ms": _pick(latencies, 0.99),
+        "bytes": max(size for _, size, _ in out),
+        "errors": sum(errors for _, _, errors in out),
+    }
+
+
+def timed_calls(fn, seconds):
+    """Call fn() back to back for seconds; rate and per-call p50/p99."""
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        t0 = time.perf_counter()
+        fn()
+        t1 = time.perf_counter()
+        latencies.append(t1 - t0)
+        if t1 >= deadline:
+            break
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"rate": len(latencies) / elapsed, "p50_ms": _pick(latencies, 0.50), "p99_ms": _pick(latencies, 0.99),
+            "bytes": 0, "errors": 0}
+
+
+def measure(run, repeat, warmup):
+    """Median run of `repeat` (by rate), with the min-max spread of the rate."""
+    if warmup:
+        run(warmup)
+    runs = sorted((run(None) for _ in range(repeat)), key=lambda r: r["rate"])
+    result = dict(runs[len(runs) // 2])
+    result["rate_min"] = runs[0]["rate"]
+    result["rate_max"] = runs[-1]["rate"]
+    return result
+
+
+# ================================
+# 用例
+# ================================
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        return json.load(resp)
+
+
+def _wait_rows(worker, rows, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if _get_json(f"{worker.url}/stats")["rows"] == rows:
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"worker did not publish {rows} rows within {timeout:g}s")
+
+
+def case_forward(ctx, args):
+    for name, proxy in ctx.stack().proxies.items():
+        yield name, lambda s, p=proxy: http_load(p.port, args.path, BROWSER_HEADERS, args.clients, s or args.seconds)
+
+
+def case_stats(ctx, args):
+    stack = ctx.stack()
+    for name, service in list(stack.proxies.items()) + [("worker", stack.worker)]:
+        yield name, lambda s, p=service: http_load(p.port, "/stats", {}, args.clients, s or args.seconds)
+
+
+def case_features(ctx, args):
+    cluster, worker = ctx.worker()
+    variants = (("json", "/bot_features", {}),
+                ("gzip", "/bot_features", {"Accept-Encoding": "gzip"}),
+                ("bin", "/bot_features", {"Accept": featurefile.CONTENT_TYPE}))
+    for count in args.features:
+        cluster.update(columns=rows_for(count))
+        _wait_rows(worker, count)
+        for variant, path, headers in variants:
+            yield f"{variant} x{count}", lambda s, p=path, h=headers: http_load(
+                worker.port, p, h, args.clients, s or args.seconds)
+
+
+def case_parse(ctx, args):
+    for count in args.features:
+        rows = rows_for(count)
+        as_json = json.dumps({"data": rows, "refreshed_at": 1700000000, "version": 1}).encode()
+        as_bin = featurefile.encode(rows, 1, 1700000000)
+        store = features.FeatureStore(capacity=None)
+        yield f"json x{count}", lambda s, b=as_json: timed_calls(lambda: json.loads(b), s or args.seconds)
+        yield f"bin x{count}", lambda s, b=as_bin: timed_calls(lambda: featurefile.load(b), s or args.seconds)
+        yield f"snapshot x{count}", lambda s, st=store, r=rows: timed_calls(
+            lambda: st.candidate(r, 1700000000, 1), s or args.seconds)
+
+    fl, worker = ctx.in_process()
+    yield "render fl", lambda s: timed_calls(
+        lambda: json.dumps(fl._render_stats(fl._stats_payload())), s or args.seconds)
+    yield "render worker", lambda s: timed_calls(
+        lambda: json.dumps(worker._stats_payload()), s or args.seconds)
+
+
+class Context:
+    """Services shared by the cases, started on first use."""
+
+    def __init__(self, args):
+        self.args = args
+        self._stack = None
+        self._worker = None
+        self._in_process = None
+        self._stop = []
+
+    def stack(self):
+        if self._stack is None:
+            self._stack = launch.start_stack(isolate=not self.args.in_process, restart=False)
+            self._stop.append(self._stack.stop)
+            if not self._stack.wait_ready():
+                raise RuntimeError("proxies did not load a config from the worker")
+        return self._stack
+
+    def worker(self):
+        # 独立 worker：大特征集会让代理拒绝配置（FL2 直接崩溃），不能用整套环境里的 worker
+        if self._worker is None:
+            path = os.path.join(self._tmpdir(), "clickhouse.json")
+            cluster = fakeclickhouse.Cluster(path, fakeclickhouse.DEFAULT_STATE)
+            cluster.set_host("*", latency=0.0)
+            worker = launch.start_worker(cluster, isolate=not self.args.in_process, name="bench-worker")
+            self._stop.append(worker.stop)
+            self._worker = cluster, worker
+        return self._worker
+
+    def in_process(self):
+        if self._in_process is None:
+            cluster = fakeclickhouse.Cluster()
+            app = launch.start_app()
+            worker = launch.start_worker(cluster)
+            fl = launch.start_proxy("fl", f"{worker.url}/bot_features", f"{launch.BIND}:{app.port}", True)
+            self._stop += [app.stop, worker.stop, fl.stop]
+            _wait_rows(worker, len(cluster.rows()))
+            # 有流量的 /stats 才有直方图与路径统计可渲染
+            http_load(fl.port, "/", BROWSER_HEADERS, 2, 0.3)
+            self._in_process = fl.module, worker.module
+        return self._in_process
+
+    def _tmpdir(self):
+        path = tempfile.mkdtemp(prefix="microbench-")
+        self._stop.append(lambda: shutil.rmtree(path, ignore_errors=True))
+        return path
+
+    def close(self):
+        for stop in reversed(self._stop):
+            stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cases", default=",".join(CASES), help=f"comma separated, of {', '.join(CASES)}")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=2.0)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--warmup", type=float, default=0.5, help="seconds of warm-up before each measurement")
+    ap.add_argument("--features", default="4,1000", help="feature row counts, comma separated")
+    ap.add_argument("--path", default="/", help="forward case request path, e.g. /?size=64k&latency=exp:5")
+    ap.add_argument("--in-process", action="store_true", help="run the services in this process")
+    ap.add_argument("--json", help="write the results here")
+    args = ap.parse_args()
+    args.features = [int(c) for c in args.features.split(",")]
+    selected = [c for c in args.cases.split(",") if c]
+    for case in selected:
+        if case not in CASES:
+            ap.error(f"unknown case {case!r}")
+
+    ctx = Context(args)
+    started = time.time()
+    results = []
+    print(f"{'case':<10}{'target':<16}{'req/s':>11}{'spread':>18}{'p50 ms':>9}{'p99 ms':>9}{'bytes':>10}{'errors':>8}")
+    try:
+        for case in selected:
+            for target, run in globals()[f"case_{case}"](ctx, args):
+                r = measure(run, args.repeat, args.warmup)
+                results.append(dict(r, case=case, target=target))
+                spread = f"{r['rate_min']:,.0f}-{r['rate_max']:,.0f}"
+                print(f"{case:<10}{target:<16}{r['rate']:>11,.0f}{spread:>18}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}"
+                      f"{r['bytes']:>10,}{r['errors']:>8}", flush=True)
+    finally:
+        ctx.close()
+
+    if args.json:
+        host = {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()}
+        config = {k: getattr(args, k) for k in ("clients", "seconds", "repeat", "warmup", "features", "path", "in_process")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "config": config, "started": started, "results": results}, f, indent=1)
+        print(f"results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+asyncio event-loop engine for fl.py / fl2.py (PROXY_ENGINE=asyncio).
+
+One coroutine per client connection instead of one OS thread: the routes, the
+bot-manager decision (`_route`), the counters and the feature-refresh thread
+all come from the engine module that starts it, only the HTTP handling and the
+upstream keep-alive pool live here. Bodies are streamed in
+streaming.BUFFER_SIZE pieces in both directions, chunked end to end.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import time
+import urllib.parse
+
+import prefork
+import profiler
+import streaming
+
+MAX_HEAD_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 75       # 客户端空闲连接保持时间（秒）
+LISTEN_BACKLOG = 4096
+
+_REASONS = {200: "OK", 400: "Bad Request", 409: "Conflict", 431: "Request Header Fields Too Large", 502: "Bad Gateway"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _Message:
+    """Parsed request/response head: start line plus headers (lower-cased lookup)."""
+
+    __slots__ = ("start", "headers", "_index")
+
+    def __init__(self, start, headers):
+        self.start = start
+        self.headers = headers
+        self._index = {k.lower(): v for k, v in headers}
+
+    def get(self, name, default=None):
+        return self._index.get(name, default)
+
+    def __len__(self):
+        return len(self.headers)
+
+    @property
+    def chunked(self):
+        return "chunked" in self._index.get("transfer-encoding", "").lower()
+
+    @property
+    def content_length(self):
+        value = self._index.get("content-length")
+        if value is None:
+            return None
+        if not value.isdigit():
+            raise HTTPError(400, f"invalid Content-Length {value!r}")
+        return int(value)
+
+
+async def _read_head(reader):
+    """Read one message head; returns None on a clean EOF between messages."""
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise HTTPError(400, "truncated message head")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "message head too large")
+
+    lines = raw[:-4].decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HTTPError(400, f"malformed header line {line!r}")
+        headers.append((name.strip(), value.strip()))
+    return _Message(lines[0], headers)
+
+
+async def _iter_body(reader, msg):
+    """Async iterator over a message body in at most BUFFER_SIZE pieces."""
+    if msg.chunked:
+        while True:
+            line = await reader.readline()
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise HTTPError(400, f"invalid chunk size {line!r}")
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            async for piece in _iter_fixed(reader, size):
+                yield piece
+            await reader.readline()
+    else:
+        async for piece in _iter_fixed(reader, msg.content_length or 0):
+            yield piece
+
+
+async def _iter_fixed(reader, length):
+    remaining = length
+    while remaining:
+        piece = await reader.read(min(remaining, streaming.BUFFER_SIZE))
+        if not piece:
+            raise HTTPError(400, f"peer closed with {remaining} body bytes outstanding")
+        remaining -= len(piece)
+        yield piece
+
+
+# ================================
+# 上游 keep-alive 连接池（asyncio 版）
+# ================================
+class AsyncUpstreamPool:
+    def __init__(self, max_per_host=64, idle_timeout=30.0, timeout=10.0, wait_timeout=5.0):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self._idle = collections.defaultdict(collections.deque)   # key -> deque[(reader, writer, ts)]
+        self._slots = {}
+        self._busy = collections.Counter()                         # key -> 借出的连接数
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "wait_timeouts": 0,
+                       "stale": 0, "evicted": 0, "retries": 0}
+
+    async def acquire(self, host, port):
+        key = (host, port)
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        if slots.locked():
+            self._stats["waits"] += 1
+            try:
+                async with asyncio.timeout(self.wait_timeout):
+                    await slots.acquire()
+            except TimeoutError:
+                self._stats["wait_timeouts"] += 1
+                raise
+        else:
+            await slots.acquire()
+
+        idle = self._idle[key]
+        now = time.monotonic()
+        while idle and now - idle[0][2] > self.idle_timeout:
+            _, writer, _ = idle.popleft()
+            self._stats["evicted"] += 1
+            writer.close()
+        while idle:
+            reader, writer, _ = idle.pop()
+            # 空闲期间收到 FIN 时 reader 已处于 EOF
+            if not reader.at_eof() and not writer.is_closing():
+                self._stats["hits"] += 1
+                self._busy[key] += 1
+                return reader, writer, True
+            self._stats["stale"] += 1
+            writer.close()
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                reader, writer = await asyncio.open_connection(host, port, limit=MAX_HEAD_BYTES)
+        except BaseException:
+            slots.release()
+            raise
+        self._stats["misses"] += 1
+        self._busy[key] += 1
+        return reader, writer, False
+
+    def release(self, host, port, reader, writer, reusable):
+        key = (host, port)
+        if reusable and not writer.is_closing():
+            self._idle[key].append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+        self._busy[key] -= 1
+        self._slots[key].release()
+
+    def note_retry(self):
+        self._stats["retries"] += 1
+
+    def stats(self):
+        payload = dict(self._stats)
+        payload["hosts"] = {
+            f"{host}:{port}": {"open": self._busy[(host, port)] + len(idle), "idle": len(idle)}
+            for (host, port), idle in self._idle.items()
+        }
+        return payload
+
+
+# ================================
+# Proxy
+# ================================
+class AsyncProxy:
+    def __init__(self, engine):
+        self.engine = engine
+        self.pool = AsyncUpstreamPool(max_per_host=engine.UPSTREAM_POOL_SIZE,
+                                      idle_timeout=engine.UPSTREAM_IDLE_TIMEOUT, timeout=10)
+        self.connections = 0
+
+    async def serve(self, host, port, reuse_port=False):
+        server = await asyncio.start_server(self._client, host or None, port, reuse_port=reuse_port,
+                                            limit=MAX_HEAD_BYTES, backlog=LISTEN_BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+    # ---------------------------
+    # client connection
+    # ---------------------------
+    async def _client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout(KEEPALIVE_TIMEOUT):
+                        req = await _read_head(reader)
+                except TimeoutError:
+                    break
+                if req is None:
+                    break
+                if not await self._handle(req, reader, writer):
+                    break
+        except HTTPError as e:
+            self._simple(writer, e.status, f"{e}\n".encode(), keep_alive=False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _handle(self, req, reader, writer):
+        """Serve one request; returns whether the client connection stays open."""
+        try:
+            method, target, version = req.start.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, f"malformed request line {req.start!r}")
+        keep_alive = version == "HTTP/1.1" and req.get("connection", "").lower() != "close"
+
+        has_body = req.chunked or (req.content_length or 0) > 0
+        if has_body and req.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        start = time.perf_counter()
+        path = urllib.parse.urlsplit(target).path
+        try:
+            return await self._dispatch(method, target, version, path, has_body, req, reader, writer, keep_alive)
+        finally:
+            self.engine._observe_request(path, time.perf_counter() - start)
+
+    async def _dispatch(self, method, target, version, path, has_body, req, reader, writer, keep_alive):
+        action = "forward"
+        if method in ("GET", "POST"):
+            action = self.engine._route(method, path, req)
+
+        if action == "forward":
+            start = time.perf_counter()
+            try:
+                return await self._forward(method, target, version, req, reader, writer, keep_alive)
+            finally:
+                self.engine._upstream_latency.record(time.perf_counter() - start)
+
+        # 不转发的请求也要读完请求体，保持连接同步
+        if has_body:
+            async for _ in _iter_body(reader, req):
+                pass
+        if action in ("stats", "metrics"):
+            # 多 worker 时需要经 unix socket 汇总，放到线程池里避免阻塞事件循环
+            payload = await asyncio.get_running_loop().run_in_executor(None, prefork.collect, self._local_stats)
+            if action == "stats":
+                body = json.dumps(self.engine._render_stats(payload), ensure_ascii=False, indent=2).encode()
+                self._simple(writer, 200, body, keep_alive, "application/json; charset=utf-8")
+            else:
+                body = self.engine._render_metrics(payload).encode()
+                self._simple(writer, 200, body, keep_alive, "text/plain; version=0.0.4; charset=utf-8")
+        elif action == "profile":
+            await self._profile(target, writer, keep_alive)
+        elif action == "threads":
+            body = json.dumps(profiler.threads(), ensure_ascii=False, indent=2).encode()
+            self._simple(writer, 200, body, keep_alive, "application/json; charset=utf-8")
+        else:
+            self.engine._record_bot()
+            self._simple(writer, 200, self.engine.BOT_MESSAGE.encode("utf-8"), keep_alive)
+        await writer.drain()
+        return keep_alive
+
+    def _local_stats(self):
+        payload = self.engine._stats_payload()
+        payload["engine"] = "asyncio"
+        payload["upstream_pool"] = self.pool.stats()
+        payload["client_connections"] = self.connections
+        return payload
+
+    async def _profile(self, target, writer, keep_alive):
+        try:
+            seconds, hz = profiler.parse_query(urllib.parse.urlsplit(target).query)
+        except ValueError as e:
+            return self._simple(writer, 400, f"bad profile parameters: {e}\n".encode(), keep_alive)
+        # 采样在线程池里进行，事件循环照常处理请求，也就会出现在采样结果里
+        result = await asyncio.get_running_loop().run_in_executor(None, profiler.profile, seconds, hz)
+        if result is None:
+            return self._simple(writer, 409, b"a profile is already running\n", keep_alive)
+        text, samples = result
+        self._simple(writer, 200, text.encode(), keep_alive,
+                     headers=(("X-Profile-Samples", samples), ("X-Profile-Pid", os.getpid())))
+
+    def _simple(self, writer, status, body, keep_alive, content_type="text/plain; charset=utf-8", headers=()):
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n")
+        for header, value in headers:
+            head += f"{header}: {value}\r\n"
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+    # ---------------------------
+    # Backend forward
+    # ---------------------------
+    async def _forward(self, method, target, version, req, reader, writer, keep_alive):
+        balancer = self.engine._balancer
+        backend = balancer.pick()
+        host, port = backend.host, backend.port
+
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}:{port}"]
+        for k, v in req.headers:
+            if k.lower() not in streaming.HOP_BY_HOP and k.lower() not in ("host", "content-length"):
+                lines.append(f"{k}: {v}")
+
+        # 小请求体一次读入（可重放），大的 / chunked 则流式发送
+        body = None
+        length = req.content_length or 0
+        if req.chunked:
+            lines.append("Transfer-Encoding: chunked")
+        elif length:
+            lines.append(f"Content-Length: {length}")
+            if length <= streaming.BUFFER_SIZE:
+                body = await reader.readexactly(length)
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        streamed = req.chunked or (length and body is None)
+
+        balancer.begin(backend)
+        start = time.perf_counter()
+        while True:
+            try:
+                ureader, uwriter, reused = await self.pool.acquire(host, port)
+            except (OSError, TimeoutError) as e:
+                balancer.done(backend, time.perf_counter() - start, ok=False)
+                # 流式请求体尚未读取，连接已不同步，只能关闭
+                return await self._bad_gateway(writer, e, keep_alive and not streamed)
+            try:
+                uwriter.write(head)
+                if body:
+                    uwriter.write(body)
+                elif streamed:
+                    await self._send_body(reader, req, uwriter)
+                resp = await self._read_upstream_head(ureader)
+                break
+            except HTTPError:
+                # 客户端请求体格式错误，不计入后端健康
+                balancer.done(backend, time.perf_counter() - start, ok=True)
+                self.pool.release(host, port, ureader, uwriter, reusable=False)
+                raise
+            except (OSError, TimeoutError, asyncio.IncompleteReadError) as e:
+                self.pool.release(host, port, ureader, uwriter, reusable=False)
+                # 写入只进缓冲区，分不清后端是否已收到请求：只重放幂等方法
+                if (reused and not streamed and not isinstance(e, TimeoutError)
+                        and method in streaming.IDEMPOTENT_METHODS):
+                    self.pool.note_retry()
+                    continue
+                balancer.done(backend, time.perf_counter() - start, ok=False)
+                return await self._bad_gateway(writer, e, keep_alive and not streamed)
+        # "HTTP/1.x NNN ..."：状态码首位为 5 视为后端失败
+        balancer.done(backend, time.perf_counter() - start, ok=resp.start[9:10] != "5")
+
+        try:
+            upstream_reusable = await self._relay_response(method, version, resp, ureader, writer)
+        except (OSError, TimeoutError, HTTPError, asyncio.IncompleteReadError):
+            # 响应头可能已发出，只能同时断开上下游连接
+            self.pool.release(host, port, ureader, uwriter, reusable=False)
+            return False
+        self.pool.release(host, port, ureader, uwriter, reusable=upstream_reusable)
+        return keep_alive and upstream_reusable is not None
+
+    async def _read_upstream_head(self, ureader):
+        try:
+            async with asyncio.timeout(self.pool.timeout):
+                resp = await _read_head(ureader)
+        except HTTPError as e:
+            raise ConnectionResetError(f"malformed upstream response: {e}")
+        if resp is None:
+            raise ConnectionResetError("upstream closed the connection")
+        return resp
+
+    async def _send_body(self, reader, req, uwriter):
+        chunked = req.chunked
+        async for piece in _iter_body(reader, req):
+            if chunked:
+                uwriter.write(b"%x\r\n" % len(piece))
+                uwriter.write(piece)
+                uwriter.write(b"\r\n")
+            else:
+                uwriter.write(piece)
+            await uwriter.drain()
+        if chunked:
+            uwriter.write(b"0\r\n\r\n")
+        await uwriter.drain()
+
+    async def _relay_response(self, method, version, resp, ureader, writer):
+        """
+        Stream the upstream response to the client.
+        Returns whether the upstream connection can be reused, or None when the
+        client connection had to be closed to delimit the body.
+        """
+        try:
+            _, status, *rest = resp.start.split(" ", 2)
+            status = int(status)
+        except ValueError:
+            raise ConnectionResetError(f"malformed upstream status line {resp.start!r}")
+        reason = rest[0] if rest else ""
+
+        has_body = method != "HEAD" and status not in (204, 304) and status >= 200
+        try:
+            length = resp.content_length
+        except HTTPError as e:
+            raise ConnectionResetError(f"malformed upstream response: {e}")
+        upstream_close = resp.get("connection", "").lower() == "close"
+        client_chunked = has_body and length is None and version == "HTTP/1.1"
+
+        lines = [f"HTTP/1.1 {status} {reason}"]
+        for k, v in resp.headers:
+            if k.lower() not in streaming.HOP_BY_HOP and k.lower() != "content-length":
+                lines.append(f"{k}: {v}")
+        if length is not None:
+            lines.append(f"Content-Length: {length}")
+        elif client_chunked:
+            lines.append("Transfer-Encoding: chunked")
+        elif has_body:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+        if not has_body:
+            await writer.drain()
+            return not upstream_close
+
+        if resp.chunked or length is not None:
+            pieces = self._timed(_iter_body(ureader, resp))
+        else:
+            pieces = self._until_eof(ureader)
+            upstream_close = True
+
+        async for piece in pieces:
+            if client_chunked:
+                writer.write(b"%x\r\n" % len(piece))
+                writer.write(piece)
+                writer.write(b"\r\n")
+            else:
+                writer.write(piece)
+            await writer.drain()
+        if client_chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+        if length is None and not client_chunked:
+            return None
+        return not upstream_close
+
+    async def _timed(self, pieces):
+        """Each upstream body read bounded by the pool timeout: a stalled upstream must not hold its slot."""
+        while True:
+            try:
+                async with asyncio.timeout(self.pool.timeout):
+                    piece = await anext(pieces)
+            except StopAsyncIteration:
+                return
+            yield piece
+
+    async def _until_eof(self, ureader):
+        while True:
+            async with asyncio.timeout(self.pool.timeout):
+                piece = await ureader.read(streaming.BUFFER_SIZE)
+            if not piece:
+                return
+            yield piece
+
+    async def _bad_gateway(self, writer, exc, keep_alive):
+        self._simple(writer, 502, f"Bad gateway: {exc}\n".encode(), keep_alive)
+        await writer.drain()
+        return keep_alive
+
+
+def run(engine, host="", port=None, reuse_port=False):
+    """Serve the engine module's routes on an asyncio event loop (blocks)."""
+    proxy = AsyncProxy(engine)
+    prefork.serve_stats(proxy._local_stats)
+    asyncio.run(proxy.serve(host, engine.PROXY_PORT if port is None else port, reuse_port))
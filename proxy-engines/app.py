@@ -3,40 +3,255 @@
 """
 Simple HTTP service (using the standard library), listens on 8080,
 all paths return 200 and a friendly greeting.
+
+It doubles as a synthetic backend for proxy benchmarks. Each knob below is
+read from the query string (/?size=64k), else from an X-Synth-<Knob> header,
+else from the SYNTH_<KNOB> env default; a request that sets none gets the
+plain greeting, as before.
+
+  size     body bytes, a distribution (k/m suffixes)       ?size=lognormal:8k,1.5
+  latency  ms before the response head, a distribution     ?latency=bimodal:1,200,0.05
+  error    probability of answering with `status` instead  ?error=0.01
+  status   error status, or "reset" to drop the connection ?status=502
+  chunked  1: Transfer-Encoding: chunked                   ?chunked=1
+  chunk    bytes per write / per chunk (default 64k)       ?chunk=4k
+  pace     ms between writes, to stream the body slowly    ?pace=20
+  cache    Cache-Control value, "none" to omit it          ?cache=no-store
+  etag     1: ETag + Last-Modified, 304 on If-None-Match   ?etag=1
+
+Distributions: N (fixed), fixed:N, uniform:LO,HI, exp:MEAN,
+bimodal:FAST,SLOW,P (SLOW with probability P), lognormal:MEDIAN,SIGMA.
+The body is the greeting repeated to the sampled size, written from one
+prebuilt buffer, so the same size always gives the same bytes and ETag.
 """
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
+import functools
+import math
+import os
+import random
 import signal
+import socket
+import struct
 import sys
+import time
+import urllib.parse
 from socketserver import ThreadingMixIn
 
+import streaming
+
 HOST = "0.0.0.0"
 PORT = 443
 
 GREETING = "Helo, have a nice day!\n"
 
+# The greeting is static: let caching proxies keep it briefly (empty value disables the header)
+CACHE_CONTROL = os.getenv("CACHE_CONTROL", "public, max-age=5, stale-while-revalidate=30")
+
+# ================================
+# Synthetic backend knobs
+# ================================
+KNOBS = ("size", "latency", "error", "status", "chunked", "chunk", "pace", "cache", "etag")
+SYNTH_DEFAULTS = {k: os.getenv(f"SYNTH_{k.upper()}", "") for k in KNOBS}
+_HEADER_KNOBS = {f"x-synth-{k}": k for k in KNOBS}
+
+MAX_SIZE = int(os.getenv("SYNTH_MAX_SIZE", str(256 * 1024 * 1024)))
+MAX_LATENCY_MS = 60_000
+
+# Body source: the greeting repeated to at least one streaming buffer, sliced without copying
+_GREETING_BYTES = GREETING.encode("utf-8")
+_BLOCK = memoryview(_GREETING_BYTES * (streaming.BUFFER_SIZE // len(_GREETING_BYTES) + 1))
+_STARTED = time.time()
+
+_UNITS = {"k": 1024, "m": 1024 * 1024}
+
+
+def _amount(text, sizes):
+    text = text.strip().lower()
+    scale = 1
+    if sizes and text[-1:] in _UNITS:
+        text, scale = text[:-1], _UNITS[text[-1]]
+    value = float(text) * scale
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"{text!r} is not a non-negative number")
+    return value
+
+
+def _probability(text):
+    value = float(text)
+    if not 0 <= value <= 1:
+        raise ValueError(f"{text!r} is not a probability")
+    return value
+
+
+@functools.lru_cache(maxsize=256)
+def distribution(spec, sizes=False):
+    """Sampler for a size (bytes, sizes=True) or latency (ms) spec; ValueError when malformed."""
+    kind, sep, args = spec.partition(":")
+    if not sep:
+        kind, args = "fixed", spec
+    args = args.split(",")
+    if kind == "fixed" and len(args) == 1:
+        value = _amount(args[0], sizes)
+        return lambda: value
+    if kind == "uniform" and len(args) == 2:
+        lo, hi = sorted(_amount(a, sizes) for a in args)
+        return lambda: random.uniform(lo, hi)
+    if kind == "exp" and len(args) == 1:
+        mean = _amount(args[0], sizes)
+        return (lambda: random.expovariate(1 / mean)) if mean else (lambda: 0.0)
+    if kind == "bimodal" and len(args) == 3:
+        fast, slow, p = _amount(args[0], sizes), _amount(args[1], sizes), _probability(args[2])
+        return lambda: slow if random.random() < p else fast
+    if kind == "lognormal" and len(args) == 2:
+        median, sigma = _amount(args[0], sizes), _amount(args[1], False)
+        if not median:
+            raise ValueError("lognormal median must be > 0")
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma)
+    raise ValueError(f"unknown distribution {spec!r}")
+
+
+def _flag(value):
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 class GreetingHandler(BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
+    # Headers and body are two writes; with Nagle on, a pooled keep-alive
+    # client waits for a delayed ACK (~40 ms) before the body arrives.
+    disable_nagle_algorithm = True
 
     def do_GET(self):
-        self._send_greeting()
+        self._respond()
 
     def do_POST(self):
-        # Also handle POST (ignore request body), return the greeting uniformly
-        # If you need to read the request body:
-        # length = int(self.headers.get('Content-Length', 0)); body = self.rfile.read(length)
-        self._send_greeting()
+        # Also handle POST (ignore request body), return the greeting uniformly.
+        # The body is still drained so a keep-alive connection stays in sync.
+        if self._discard_body():
+            self._respond()
 
     def do_PUT(self):
-        self._send_greeting()
+        if self._discard_body():
+            self._respond()
 
     def do_DELETE(self):
-        self._send_greeting()
+        self._respond()
+
+    def _respond(self):
+        knobs, vary = self._knobs()
+        if not knobs:
+            return self._send_greeting()
+        try:
+            self._send_synthetic(knobs, vary)
+        except ValueError as e:
+            self._send_plain(400, f"bad synthetic backend parameter: {e}\n")
+
+    def _knobs(self):
+        """Knob values of this request (query, then X-Synth-* headers, then env) and the headers used."""
+        knobs = {k: v for k, v in SYNTH_DEFAULTS.items() if v}
+        vary = []
+        for name in self.headers.keys():
+            knob = _HEADER_KNOBS.get(name.lower())
+            if knob:
+                knobs[knob] = self.headers[name]
+                vary.append(name)
+        if "?" in self.path:
+            for key, value in urllib.parse.parse_qsl(self.path.partition("?")[2]):
+                if key in SYNTH_DEFAULTS:
+                    knobs[key] = value
+        return knobs, vary
+
+    def _discard_body(self):
+        """Drain the request body; on bad framing answer 400 and return False."""
+        # Content-Length or chunked, read in fixed-size pieces
+        try:
+            body, _ = streaming.request_body(self.rfile, self.headers)
+            streaming.discard(body)
+        except (ValueError, streaming.BodyError) as e:
+            # Position in the stream is unknown, so the connection cannot be reused
+            self.close_connection = True
+            self._send_plain(400, f"bad request body: {e}\n", ("Connection", "close"))
+            return False
+        return True
+
+    def _send_synthetic(self, knobs, vary):
+        # Everything is parsed before the delay, so a bad value is a quick 400
+        size = min(MAX_SIZE, int(distribution(knobs.get("size", str(len(_GREETING_BYTES))), True)()))
+        delay = min(MAX_LATENCY_MS, distribution(knobs.get("latency", "0"))()) / 1000
+        error = _probability(knobs.get("error", "0"))
+        status = knobs.get("status", "503")
+        if status != "reset" and not 400 <= int(status) <= 599:
+            raise ValueError(f"error status {status!r} is not 4xx/5xx")
+        chunked = _flag(knobs.get("chunked", "0"))
+        chunk = max(1, int(_amount(knobs.get("chunk", str(streaming.BUFFER_SIZE)), True)))
+        pace = _amount(knobs.get("pace", "0"), False) / 1000
+        cache_control = knobs.get("cache", CACHE_CONTROL)
+        etag = f'"g{size}"' if _flag(knobs.get("etag", "0")) else None
+
+        if delay:
+            time.sleep(delay)
+        if error and random.random() < error:
+            if status == "reset":
+                # RST instead of FIN: the proxy sees a connection error, not a response
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                self.close_connection = True
+                return
+            return self._send_plain(int(status), "synthetic error\n", ("Cache-Control", "no-store"))
+
+        not_modified = etag is not None and etag in self.headers.get("If-None-Match", "")
+        self.send_response(304 if not_modified else 200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        if cache_control and cache_control != "none":
+            self.send_header("Cache-Control", cache_control)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(_STARTED))
+        if vary:
+            self.send_header("Vary", ", ".join(vary))
+        if not_modified:
+            self.end_headers()
+            return
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(size))
+        self.end_headers()
+        self._write_body(size, chunk, pace, chunked)
+
+    def _write_body(self, size, chunk, pace, chunked):
+        block = len(_BLOCK)
+        sent = 0
+        while sent < size:
+            n = min(chunk, size - sent, block)
+            piece = _BLOCK[:n]
+            if chunked:
+                # One write per chunk: with Nagle off, separate writes would be separate packets
+                self.wfile.write(b"%x\r\n" % n + piece + b"\r\n")
+            else:
+                self.wfile.write(piece)
+            sent += n
+            if pace and sent < size:
+                self.wfile.flush()
+                time.sleep(pace)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _send_plain(self, status, text, *headers):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def _send_greeting(self):
         body = GREETING.encode("utf-8")
         self.send_response(200, "OK")
         self.send_header("Content-Type", "text/plain; charset=utf-8")
+        if CACHE_CONTROL:
+            self.send_header("Cache-Control", CACHE_CONTROL)
         self.send_header("Content-Length", str(len(body)))
         self.end_headers()
         self.wfile.write(body)
@@ -51,6 +266,7 @@ class GreetingHandler(BaseHTTPRequestHandler):
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """HTTPServer that supports concurrent request handling (one thread per request)"""
     daemon_threads = True
+    request_queue_size = 128       # 默认 5：突发的并发连接会触发 SYN 重传（约 1 s）
 
 def run_server(host=HOST, port=PORT):
     server = ThreadedHTTPServer((host, port), GreetingHandler)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Latency-aware backend selection for the proxy engines (PROXY_BACKENDS).
+
+pick() samples two available backends and takes the one with the lower cost,
+(in-flight + 1) * EWMA of response-head latency, divided by its slow-start
+weight. The EWMA of a backend that is not picked decays (half-life
+EWMA_HALF_LIFE), so a backend that was slow gets probed again. Backends that answer 5xx or fail (connect error, timeout)
+EJECT_AFTER times in a row are ejected passively, for EJECT_BASE seconds,
+doubling per repeated ejection up to EJECT_MAX. Once the ejection ends the
+backend's weight ramps from 0.1 to 1 over SLOW_START seconds, so it gets
+traffic back gradually. If every backend is ejected, the one whose ejection
+ends first is used anyway.
+"""
+
+import random
+import threading
+import time
+
+EWMA_ALPHA = 0.2
+EWMA_HALF_LIFE = 5.0
+EJECT_AFTER = 3
+EJECT_BASE = 5.0
+EJECT_MAX = 60.0
+SLOW_START = 10.0
+_MIN_WEIGHT = 0.1
+
+
+class Backend:
+    __slots__ = ("host", "port", "inflight", "ewma", "updated", "failures", "ejections",
+                 "ejected_until", "returned_at", "requests", "errors")
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.inflight = 0
+        self.ewma = 0.0                 # 秒；0 表示尚无样本
+        self.updated = 0.0              # 上次更新 ewma 的时间
+        self.failures = 0               # 连续失败次数
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.returned_at = 0.0          # 最近一次摘除结束的时间，用于慢启动
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def name(self):
+        return f"{self.host}:{self.port}"
+
+    def weight(self, now):
+        ramp = (now - self.returned_at) / SLOW_START
+        return 1.0 if ramp >= 1 else max(_MIN_WEIGHT, ramp)
+
+    def latency(self, now):
+        # 长时间未被选中的后端，其延迟估计逐渐衰减，以便重新探测
+        return self.ewma * 0.5 ** ((now - self.updated) / EWMA_HALF_LIFE)
+
+    def cost(self, now):
+        return (self.inflight + 1) * (self.latency(now) or 0.001) / self.weight(now)
+
+
+def parse(spec, default_port):
+    """'host[:port],host[:port]' -> [(host, port)]"""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":") if ":" in item else (item, "", "")
+        backends.append((host, int(port) if port else default_port))
+    return backends
+
+
+class Balancer:
+    def __init__(self, backends):
+        self.backends = [Backend(host, port) for host, port in backends]
+        self._lock = threading.Lock()
+
+    def pick(self):
+        backends = self.backends
+        if len(backends) == 1:
+            return backends[0]
+        now = time.monotonic()
+        available = [b for b in backends if b.ejected_until <= now]
+        if not available:
+            # 全部被摘除：选最先恢复的一个，避免直接拒绝请求
+            return min(backends, key=lambda b: b.ejected_until)
+        if len(available) == 1:
+            return available[0]
+        a, b = random.sample(available, 2)
+        return a if a.cost(now) <= b.cost(now) else b
+
+    def begin(self, backend):
+        with self._lock:
+            backend.inflight += 1
+            backend.requests += 1
+
+    def done(self, backend, seconds, ok):
+        """Account a finished upstream exchange: response-head latency and success (no 5xx / error)."""
+        now = time.monotonic()
+        with self._lock:
+            backend.inflight -= 1
+            ewma = backend.latency(now)
+            backend.ewma = seconds if not ewma else ewma + EWMA_ALPHA * (seconds - ewma)
+            backend.updated = now
+            if ok:
+                backend.failures = 0
+                if backend.ejections and now - backend.returned_at > EJECT_MAX:
+                    # 恢复后持续健康，摘除时长重新从 EJECT_BASE 计
+                    backend.ejections = 0
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= EJECT_AFTER and backend.ejected_until <= now and len(self.backends) > 1:
+                backend.ejections += 1
+                backend.failures = 0
+                backend.ejected_until = now + min(EJECT_MAX, EJECT_BASE * 2 ** (backend.ejections - 1))
+                # 摘除期结束即开始慢启动
+                backend.returned_at = backend.ejected_until
+                print(f"[LB] ejected {backend.name} until +{backend.ejected_until - now:.0f}s")
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            b.name: {
+                "inflight": b.inflight,
+                "requests": b.requests,
+                "errors": b.errors,
+                "ewma_ms": round(b.latency(now) * 1000, 3),
+                "ejected": b.ejected_until > now,
+                "ejections": b.ejections,
+                "weight": round(b.weight(now), 3),
+            }
+            for b in self.backends
+        }
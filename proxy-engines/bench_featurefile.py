@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /bot_features payload as JSON vs the binary feature file.
+
+For feature sets of several sizes it reports the payload size (plain and
+gzip) and the time per payload of:
+  - encode : json.dumps vs featurefile.encode (worker side, once per version)
+  - open   : featurefile.FeatureFile(buf), i.e. header, checksum and offset
+             table checked in place without copying the buffer
+  - rows   : json.loads vs featurefile.load, the full [name, type] list the
+             proxies build a snapshot from
+
+    python bench_featurefile.py --features 10,1000,100000
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+import featurefile
+
+
+def rows_for(n):
+    return [[f"feature_{i:06d}", ("String", "Float64", "UInt64", "Date")[i % 4]] for i in range(n)]
+
+
+def per_call(fn, min_seconds=0.2):
+    """Seconds per call of fn(), repeating until min_seconds have passed."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def fmt_us(seconds):
+    return f"{seconds * 1e6:,.1f}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--features", default="10,1000,100000", help="feature row counts, comma separated")
+    args = ap.parse_args()
+
+    print(f"{'features':>9}  {'format':<6}{'bytes':>12}{'gzip':>11}{'encode us':>12}{'open us':>11}{'rows us':>13}")
+    for count in (int(c) for c in args.features.split(",")):
+        rows = rows_for(count)
+        payload = {"data": rows, "refreshed_at": 1700000000, "version": 1}
+
+        as_json = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        enc = per_call(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        dec = per_call(lambda: json.loads(as_json))
+        print(f"{count:>9}  {'json':<6}{len(as_json):>12,}{len(gzip.compress(as_json)):>11,}"
+              f"{fmt_us(enc):>12}{'-':>11}{fmt_us(dec):>13}")
+
+        as_bin = featurefile.encode(rows, 1, 1700000000)
+        assert featurefile.load(as_bin)[0] == [tuple(row) for row in rows]
+        enc = per_call(lambda: featurefile.encode(rows, 1, 1700000000))
+        opened = per_call(lambda: featurefile.FeatureFile(as_bin))
+        dec = per_call(lambda: featurefile.load(as_bin))
+        print(f"{count:>9}  {'bin':<6}{len(as_bin):>12,}{len(gzip.compress(as_bin)):>11,}"
+              f"{fmt_us(enc):>12}{fmt_us(opened):>11}{fmt_us(dec):>13}")
+
+
+if __name__ == "__main__":
+    main()
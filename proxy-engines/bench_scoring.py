@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bot scores per second for the compiled evaluator.
+
+For feature sets of several sizes it scores a fixed corpus of synthetic
+requests (browser-like, script-like and bare) and reports:
+  - interpret : walk the raw (name, type) rows per request, resolving the
+                signal and weight every time (what scoring without the
+                compile step would cost); score must beat it for
+                the compile step on each refresh to be worth it
+  - score     : Scorer.score() on http.server's HTTPMessage headers (hot path)
+  - batch     : Scorer.score_batch() over the whole corpus (offline replay)
+plus the Python heap peak (tracemalloc) while score() runs over the corpus.
+
+    python bench_scoring.py --requests 20000 --features 4,16,64
+"""
+
+import argparse
+import email.parser
+import http.client
+import time
+import tracemalloc
+
+import scoring
+
+DEFAULT_ROWS = [("event_date", "Date"), ("request_id", "UInt64"),
+                ("feature_1", "String"), ("feature_2", "Float64")]
+
+_PROFILES = (
+    {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0", "Accept": "text/html",
+     "Accept-Language": "en-US", "Accept-Encoding": "gzip", "Cookie": "sid=1", "Referer": "/"},
+    {"User-Agent": "python-requests/2.31.0", "Accept": "*/*", "Accept-Encoding": "gzip, deflate"},
+    {"User-Agent": "curl/8.5.0", "Accept": "*/*"},
+    {},
+)
+_PATHS = ("/", "/a/b", "/static/app.js", "/a/b/c/d/e/f/g/h")
+
+
+def rows_for(n):
+    rows = list(DEFAULT_ROWS)
+    for i in range(len(rows), n):
+        rows.append((f"feature_{i}", ("String", "Float64", "UInt64", "Date")[i % 4]))
+    return rows[:n]
+
+
+def corpus(n):
+    methods, paths, messages, dicts = [], [], [], []
+    for i in range(n):
+        profile = _PROFILES[i % len(_PROFILES)]
+        raw = "".join(f"{k}: {v}\r\n" for k, v in profile.items()) + "Host: proxy\r\n\r\n"
+        messages.append(email.parser.Parser(_class=http.client.HTTPMessage).parsestr(raw))
+        dicts.append({k.lower(): v for k, v in profile.items()})
+        methods.append("POST" if i % 7 == 0 else "GET")
+        paths.append(_PATHS[i % len(_PATHS)])
+    return methods, paths, messages, dicts
+
+
+def interpret(rows, method, path, headers):
+    funcs = dict(scoring.SIGNALS)
+    total = score = 0.0
+    for name, ftype in rows:
+        weight = scoring.TYPE_WEIGHTS.get(ftype, 1.0)
+        total += weight
+        score += weight * funcs[scoring.SIGNALS[scoring.signal_for(name)][0]](method, path, headers)
+    return score / total if total else 0.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=20000)
+    ap.add_argument("--features", default="4,16,64", help="feature row counts, comma separated")
+    args = ap.parse_args()
+
+    methods, paths, messages, dicts = corpus(args.requests)
+    n = args.requests
+    print(f"{'features':>9}{'signals':>9}{'interpret/s':>14}{'score/s':>12}{'batch/s':>12}{'peak KB':>9}")
+
+    for count in (int(c) for c in args.features.split(",")):
+        rows = rows_for(count)
+        scorer = scoring.compile(rows)
+
+        start = time.perf_counter()
+        for i in range(n):
+            interpret(rows, methods[i], paths[i], messages[i])
+        interp_rate = n / (time.perf_counter() - start)
+
+        score = scorer.score
+        start = time.perf_counter()
+        for i in range(n):
+            score(methods[i], paths[i], messages[i])
+        score_rate = n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        scorer.score_batch(methods, paths, dicts)
+        batch_rate = n / (time.perf_counter() - start)
+
+        tracemalloc.start()
+        for i in range(n):
+            score(methods[i], paths[i], messages[i])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{count:>9}{len(scorer.indices):>9}{interp_rate:>14,.0f}{score_rate:>12,.0f}"
+              f"{batch_rate:>12,.0f}{peak / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
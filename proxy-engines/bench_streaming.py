@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Benchmark: streaming forward vs the old buffer-everything forward.
+
+Runs an in-process backend and two in-process proxies built on fl.ProxyHandler:
+  - stream : the current _forward (fixed buffers, chunked end to end)
+  - buffer : the previous _forward (rfile.read(length) / resp.read(), one
+             connection per request); its TTFB waits for the whole body
+             and its heap peak grows with the body size, which is what
+             the streaming rewrite removed
+
+For every body size it reports, per direction, time-to-first-byte, total time,
+throughput and the Python heap peak (tracemalloc) of one request.
+
+    python bench_streaming.py --sizes 1,8,32 --repeat 5
+"""
+
+import argparse
+import http.client
+import http.server
+import statistics
+import threading
+import time
+import tracemalloc
+
+import balancer
+import fl
+import streaming
+
+MB = 1024 * 1024
+_BLOCK = memoryview(b"x" * streaming.BUFFER_SIZE)
+
+
+# ================================
+# Backend: /blob?size=N[&chunked=1] 下载，/sink 上传
+# ================================
+class BlobHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        _, _, query = self.path.partition("?")
+        params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        size = int(params.get("size", "0"))
+        chunked = params.get("chunked") == "1"
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(size))
+        self.end_headers()
+
+        remaining = size
+        while remaining:
+            n = min(remaining, len(_BLOCK))
+            if chunked:
+                self.wfile.write(b"%x\r\n" % n)
+                self.wfile.write(_BLOCK[:n])
+                self.wfile.write(b"\r\n")
+            else:
+                self.wfile.write(_BLOCK[:n])
+            remaining -= n
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        body, _ = streaming.request_body(self.rfile, self.headers)
+        received = 0
+        if isinstance(body, bytes):
+            received = len(body)
+        elif body is not None:
+            for piece in body:
+                received += len(piece)
+        payload = str(received).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+# ================================
+# Baseline: 原来的整包缓冲转发
+# ================================
+class BufferingProxyHandler(fl.ProxyHandler):
+    def _forward(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length) if length > 0 else None
+
+        forward_headers = {k: v for k, v in self.headers.items()
+                           if k.lower() not in (
+                               "host", "connection", "keep-alive", "proxy-authenticate",
+                               "proxy-authorization", "te", "trailers", "transfer-encoding", "upgrade"
+                           )}
+        forward_headers["Host"] = f"{fl.BACKEND_HOST}:{fl.BACKEND_PORT}"
+
+        conn = http.client.HTTPConnection(fl.BACKEND_HOST, fl.BACKEND_PORT, timeout=10)
+        try:
+            conn.request(self.command, self.path, body=body, headers=forward_headers)
+            resp = conn.getresponse()
+            resp_body = resp.read()
+        except Exception as e:
+            self.send_error(502, f"Bad gateway: {e}")
+            return
+        finally:
+            conn.close()
+
+        self.send_response(resp.status, resp.reason)
+        for header, value in resp.getheaders():
+            if header.lower() in ("transfer-encoding", "connection", "keep-alive",
+                                  "proxy-authenticate", "proxy-authorization",
+                                  "te", "trailers", "upgrade", "content-length"):
+                continue
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(resp_body)))
+        self.end_headers()
+        self.wfile.write(resp_body)
+
+
+def _serve(handler):
+    server = fl.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _upload_body(size):
+    remaining = size
+    while remaining:
+        n = min(remaining, len(_BLOCK))
+        yield _BLOCK[:n]
+        remaining -= n
+
+
+# ================================
+# 单次请求测量
+# ================================
+def download(port, size, chunked):
+    buf = bytearray(streaming.BUFFER_SIZE)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    t0 = time.perf_counter()
+    conn.request("GET", f"/blob?size={size}&chunked={int(chunked)}")
+    resp = conn.getresponse()
+    n = resp.readinto(buf)
+    ttfb = time.perf_counter() - t0
+    received = n
+    while n:
+        n = resp.readinto(buf)
+        received += n
+    total = time.perf_counter() - t0
+    conn.close()
+    assert resp.status == 200 and received == size, (resp.status, received, size)
+    return ttfb, total
+
+
+def upload(port, size, chunked):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    headers = {} if chunked else {"Content-Length": str(size)}
+    t0 = time.perf_counter()
+    conn.request("POST", "/sink", body=_upload_body(size), headers=headers, encode_chunked=chunked)
+    resp = conn.getresponse()
+    echoed = int(resp.read())
+    total = time.perf_counter() - t0
+    conn.close()
+    assert resp.status == 200 and echoed == size, (resp.status, echoed, size)
+    return total, total
+
+
+def peak_memory(fn, *args):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1,8,32", help="body sizes in MB, comma separated")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    fl.ProxyHandler.log_message = lambda *a: None
+    backend = _serve(BlobHandler)
+    fl.BACKEND_HOST, fl.BACKEND_PORT = "127.0.0.1", backend.server_address[1]
+    # ProxyHandler 经 _balancer 转发（导入时按 PROXY_BACKENDS 建好），上面两项只给基线用
+    fl._balancer = balancer.Balancer([(fl.BACKEND_HOST, fl.BACKEND_PORT)])
+
+    proxies = {
+        "buffer": _serve(BufferingProxyHandler).server_address[1],
+        "stream": _serve(fl.ProxyHandler).server_address[1],
+    }
+    cases = [
+        ("download", download, False),
+        ("download-chunked", download, True),
+        ("upload", upload, False),
+        ("upload-chunked", upload, True),
+    ]
+
+    print(f"{'case':<18}{'size':>7}{'mode':>8}{'ttfb ms':>10}{'total ms':>10}{'MB/s':>9}{'peak MB':>9}")
+    for size_mb in (int(s) for s in args.sizes.split(",")):
+        size = size_mb * MB
+        for case, fn, chunked in cases:
+            for mode, port in proxies.items():
+                if mode == "buffer" and case == "upload-chunked":
+                    # 旧实现剥掉了 Transfer-Encoding，不支持 chunked 上传
+                    continue
+                fn(port, size, chunked)  # warm up
+                runs = [fn(port, size, chunked) for _ in range(args.repeat)]
+                ttfb = statistics.median(r[0] for r in runs)
+                total = statistics.median(r[1] for r in runs)
+                peak = peak_memory(fn, port, size, chunked)
+                print(f"{case:<18}{size_mb:>5}MB{mode:>8}{ttfb * 1000:>10.1f}{total * 1000:>10.1f}"
+                      f"{size_mb / total:>9.0f}{peak / MB:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+In-proxy HTTP response cache for the threading engine (PROXY_CACHE_BYTES > 0).
+
+- LRU bounded by a byte budget; objects above max_object are never stored.
+- Freshness from Cache-Control (s-maxage / max-age), else Expires - Date, else
+  default_ttl; no-store / no-cache / private, Set-Cookie and Vary: * are not stored.
+- Vary-aware keys: the Vary header names last seen for a target select which
+  request header values become part of the key.
+- Single-flight: concurrent misses for one key wait for the first request's
+  upstream fetch instead of sending their own. A waiter only takes the
+  result if its Vary (not yet known on a target's first miss) selects the
+  same request header values; otherwise it re-keys and fetches its own.
+- stale-while-revalidate: a stale entry inside its window is served at once
+  while one background request (conditional when the entry has a validator)
+  refreshes it.
+
+Only GET requests without a body, Authorization or request no-cache/no-store
+are looked up, and only responses with a Content-Length are stored.
+"""
+
+import collections
+import email.utils
+import threading
+import time
+
+import streaming
+
+CACHEABLE_STATUS = frozenset((200, 203, 204, 300, 301, 404, 410))
+
+
+class Entry:
+    __slots__ = ("status", "reason", "headers", "body", "stored", "initial_age", "ttl", "swr",
+                 "request_headers", "size", "vary")
+
+    def __init__(self, status, reason, headers, body, ttl, swr, initial_age, request_headers):
+        self.status = status
+        self.reason = reason
+        self.headers = headers              # [(name, value)]，不含逐跳头 / Content-Length / Age
+        self.body = body
+        self.stored = time.monotonic()
+        self.initial_age = initial_age
+        self.ttl = ttl
+        self.swr = swr
+        self.request_headers = request_headers   # 后台重新验证时复用
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+        self.vary = ((), ())                # (Vary 名称, 取值)：由 store() 设定
+
+    def matches(self, headers):
+        """Whether a request with these headers may be served this entry, judged by its Vary."""
+        names, values = self.vary
+        return tuple(headers.get(name) for name in names) == values
+
+    def age(self, now=None):
+        return (now or time.monotonic()) - self.stored + self.initial_age
+
+    def header(self, name):
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+
+class _Flight:
+    __slots__ = ("done", "entry")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+def _directives(value):
+    out = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            out[name.lower()] = arg.strip().strip('"')
+    return out
+
+
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_cacheable(method, headers):
+    if method != "GET" or headers.get("Authorization"):
+        return False
+    cc = _directives(headers.get("Cache-Control"))
+    return "no-store" not in cc and "no-cache" not in cc
+
+
+def vary_names(headers):
+    """Lower-cased Vary names of a response, or None for Vary: *."""
+    names = sorted({v.strip().lower() for v in (headers.get("Vary") or "").split(",") if v.strip()})
+    if "*" in names:
+        return None
+    return tuple(names)
+
+
+def freshness(status, headers, default_ttl=0):
+    """(ttl, stale_while_revalidate) in seconds for a response, or None if it must not be stored."""
+    if status not in CACHEABLE_STATUS or headers.get("Set-Cookie"):
+        return None
+    cc = _directives(headers.get("Cache-Control"))
+    if "no-store" in cc or "no-cache" in cc or "private" in cc:
+        return None
+    swr = _seconds(cc.get("stale-while-revalidate")) or 0
+
+    ttl = _seconds(cc.get("s-maxage"))
+    if ttl is None:
+        ttl = _seconds(cc.get("max-age"))
+    if ttl is None and headers.get("Expires"):
+        try:
+            expires = email.utils.parsedate_to_datetime(headers.get("Expires")).timestamp()
+            date = headers.get("Date")
+            now = email.utils.parsedate_to_datetime(date).timestamp() if date else time.time()
+            ttl = max(0, int(expires - now))
+        except (TypeError, ValueError):
+            ttl = 0
+    if ttl is None:
+        ttl = default_ttl
+    if ttl <= 0 and swr <= 0:
+        return None
+    return ttl, swr
+
+
+class Cache:
+    def __init__(self, budget, max_object, default_ttl=0):
+        self.budget = budget
+        self.max_object = min(max_object, budget)
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()   # key -> Entry，最近使用的在末尾
+        self._vary = {}                             # target -> Vary 名称
+        self._flights = {}                          # key -> _Flight
+        self._bytes = 0
+        self._stats = collections.Counter()
+
+    # ---------------------------
+    # 查找
+    # ---------------------------
+    def key(self, target, headers):
+        names = self._vary.get(target, ())
+        return target, tuple(headers.get(name) for name in names)
+
+    def lookup(self, key):
+        """(entry, "hit" | "stale") for a usable entry, (None, None) on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = entry.age(now)
+                if age < entry.ttl:
+                    state = "hit"
+                elif age < entry.ttl + entry.swr:
+                    state = "stale"
+                else:
+                    self._drop(key)
+                    entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self._stats["hits" if state == "hit" else "stale_hits"] += 1
+            self._stats["bytes_saved"] += len(entry.body)
+            return entry, state
+
+    def join(self, key):
+        """None if the caller leads the fetch for key (it must call finish()), else the flight to wait on."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = _Flight()
+                return None
+            return flight
+
+    def wait(self, flight, timeout, headers):
+        """
+        Entry produced by the leader, or None if it was not cacheable, timed out, or
+        its Vary (unknown when the flight was keyed) selects other header values than ours.
+        """
+        if not flight.done.wait(timeout) or flight.entry is None or not flight.entry.matches(headers):
+            return None
+        with self._lock:
+            self._stats["coalesced"] += 1
+            self._stats["bytes_saved"] += len(flight.entry.body)
+        return flight.entry
+
+    def finish(self, key, entry):
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight.entry = entry
+            flight.done.set()
+
+    # ---------------------------
+    # 写入
+    # ---------------------------
+    def storable(self, status, headers):
+        """Whether store() would keep this response, judged from its head alone."""
+        length = _seconds(headers.get("Content-Length"))
+        return (length is not None and length <= self.max_object
+                and vary_names(headers) is not None
+                and freshness(status, headers, self.default_ttl) is not None)
+
+    def store(self, key, status, reason, headers, body, request_headers):
+        """Store a response under key (re-keyed by its Vary); returns the Entry or None if not storable."""
+        fresh = freshness(status, headers, self.default_ttl)
+        names = vary_names(headers)
+        if fresh is None or names is None or len(body) > self.max_object:
+            with self._lock:
+                self._stats["uncacheable"] += 1
+            return None
+
+        kept = [(k, v) for k, v in headers.items()
+                if k.lower() not in streaming.HOP_BY_HOP and k.lower() not in ("content-length", "age")]
+        initial_age = _seconds(headers.get("Age")) or 0
+        entry = Entry(status, reason, kept, body, fresh[0], fresh[1], initial_age, request_headers)
+
+        target = key[0]
+        lowered = {k.lower(): v for k, v in request_headers.items()}
+        vkey = (target, tuple(lowered.get(name) for name in names))
+        entry.vary = names, vkey[1]
+        with self._lock:
+            self._vary[target] = names
+            self._drop(vkey)
+            self._entries[vkey] = entry
+            self._bytes += entry.size
+            while self._bytes > self.budget and self._entries:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self._stats["evictions"] += 1
+        return entry
+
+    def refresh(self, key, entry, headers):
+        """Apply a 304 from revalidation: new freshness, same body."""
+        fresh = freshness(entry.status, headers, self.default_ttl)
+        with self._lock:
+            if fresh is None:
+                self._drop(key)
+                return
+            entry.ttl, entry.swr = fresh
+            entry.initial_age = _seconds(headers.get("Age")) or 0
+            entry.stored = time.monotonic()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    # ---------------------------
+    # stale-while-revalidate
+    # ---------------------------
+    def revalidate(self, key, entry, fetch):
+        """Run fetch(key, entry) in the background unless a fetch for key is already running."""
+        if self.join(key) is not None:
+            return
+        with self._lock:
+            self._stats["revalidations"] += 1
+
+        def run():
+            new_entry = None
+            try:
+                new_entry = fetch(key, entry)
+            except Exception as e:
+                print(f"[CACHE] revalidation of {key[0]} failed: {e}")
+            finally:
+                self.finish(key, new_entry)
+
+        threading.Thread(target=run, daemon=True, name="cache_revalidate").start()
+
+    def stats(self):
+        with self._lock:
+            payload = dict(self._stats)
+            payload["entries"] = len(self._entries)
+            payload["bytes"] = self._bytes
+        payload["budget"] = self.budget
+        for key in ("hits", "stale_hits", "misses", "coalesced", "revalidations", "evictions",
+                    "uncacheable", "bytes_saved"):
+            payload.setdefault(key, 0)
+        return payload
+
+
+def hit_ratio(stats):
+    """Share of cacheable lookups answered without an own upstream fetch."""
+    served = stats.get("hits", 0) + stats.get("stale_hits", 0) + stats.get("coalesced", 0)
+    lookups = stats.get("hits", 0) + stats.get("stale_hits", 0) + stats.get("misses", 0)
+    return round(served / lookups, 4) if lookups else 0.0
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Lock-free request accounting for the proxy engines.
+
+Every thread increments its own shard without taking a lock; shards are only
+merged when /stats is read. Shards of finished threads (ThreadingMixIn starts
+one per connection) are folded into a retired shard so the shard list stays
+bounded by the number of live threads.
+
+Path tracking uses space-saving top-k (Metwally et al.): each shard keeps at
+most k keys, so memory stays flat under path-scanning traffic.
+"""
+
+import collections
+import threading
+
+# 活跃 shard 超过该数量时，注册新 shard 前先回收已结束线程的 shard
+_FOLD_THRESHOLD = 256
+
+
+class _Sharded:
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()      # 仅用于注册 shard 与合并，不在热路径上
+        self._shards = []                  # [(thread, shard)]
+        self._retired = self._new_shard()
+
+    def _new_shard(self):
+        raise NotImplementedError
+
+    def _fold(self, retired, shard):
+        raise NotImplementedError
+
+    def _register(self):
+        shard = self._local.shard = self._new_shard()
+        with self._lock:
+            if len(self._shards) >= _FOLD_THRESHOLD:
+                self._fold_dead()
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_dead(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # 线程已结束，shard 不会再被写入
+                self._fold(self._retired, shard)
+        self._shards = live
+
+    def _all_shards(self):
+        with self._lock:
+            self._fold_dead()
+            return [self._retired] + [shard for _, shard in self._shards]
+
+
+class ShardedCounter(_Sharded):
+    """Named counters; add() is a thread-local dict update."""
+
+    def _new_shard(self):
+        return {}
+
+    def _fold(self, retired, shard):
+        for key, value in dict(shard).items():
+            retired[key] = retired.get(key, 0) + value
+
+    def add(self, key, n=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._register()
+        shard[key] = shard.get(key, 0) + n
+
+    def snapshot(self):
+        merged = collections.Counter()
+        for shard in self._all_shards():
+            merged.update(dict(shard))
+        return merged
+
+
+class SpaceSaving:
+    """Space-saving top-k summary: at most k keys, a key's count overestimates by at most its error."""
+
+    __slots__ = ("k", "counts", "errors", "_floor", "_candidates")
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        self._floor = 0
+        self._candidates = []      # 计数可能等于 _floor 的 key
+
+    def add(self, key, n=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+            return
+        if len(counts) < self.k:
+            counts[key] = n
+            return
+        # 替换计数最小的 key，新 key 继承其计数作为误差上界
+        victim = self._pop_min()
+        floor = counts.pop(victim)
+        self.errors.pop(victim, None)
+        counts[key] = floor + n
+        self.errors[key] = floor
+
+    def _pop_min(self):
+        # 满载后最小计数只增不减：候选列表耗尽时才 O(k) 重算，均摊 O(1)
+        counts = self.counts
+        candidates = self._candidates
+        while candidates:
+            key = candidates.pop()
+            if counts.get(key) == self._floor:
+                return key
+        self._floor = floor = min(counts.values())
+        candidates.extend(key for key, value in counts.items() if value == floor)
+        return candidates.pop()
+
+
+class ShardedTopK(_Sharded):
+    """Per-thread SpaceSaving summaries merged into one top-k list on read."""
+
+    def __init__(self, k):
+        self.k = k
+        super().__init__()
+
+    def _new_shard(self):
+        return SpaceSaving(self.k)
+
+    def _fold(self, retired, shard):
+        for key, value in dict(shard.counts).items():
+            retired.add(key, value)
+
+    def add(self, key):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._register()
+        shard.add(key)
+
+    def top(self):
+        """Return [(key, count, error)] for the k heaviest keys, largest first."""
+        counts = collections.Counter()
+        errors = collections.Counter()
+        for shard in self._all_shards():
+            counts.update(dict(shard.counts))
+            errors.update(dict(shard.errors))
+        return [(key, count, errors[key]) for key, count in counts.most_common(self.k)]
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Versioned, immutable feature-config snapshots for the proxy engines.
+
+The background fetcher validates every payload (schema, duplicate names,
+capacity) and builds a complete Snapshot, bot scorer included, before it is
+published. Publishing replaces one attribute, so request threads read
+`store.current` once per request without a lock and always see a consistent
+config. Payloads identical to the active one (rows and worker config version)
+are not republished, so `version` and `swap_age_s` track actual config
+changes. A new config version with unchanged rows keeps the compiled scorer
+and only takes the new trace fields.
+
+Whether an invalid payload is published (reproducing the outage) or rejected
+in favour of the last-known-good snapshot is the engine's choice.
+
+Every snapshot carries the worker's config version and the trace timestamps
+of its payload: origin_at (the worker's ClickHouse query) and published_at
+(the worker's first publish). publish() adds swapped_at, so stats()["trace"]
+gives the propagation time from ClickHouse to this proxy serving the config.
+
+With a snapshot path, every valid published config is also written to disk
+atomically as a binary feature file, and restore() maps it back at startup, so a restarted engine
+serves its last-known-good config before the first fetch succeeds.
+
+FeatureSource fetches the payload with If-None-Match and, once the worker has
+returned an ETag, long-polls it (?wait=N): the worker holds the request until
+the payload changes, so a new version arrives within milliseconds and an
+unchanged config costs one empty 304 per wait period. By default it asks for
+the binary feature file, which is parsed in place instead of through JSON.
+Either form is requested gzipped.
+"""
+
+import collections
+import gzip
+import http.client
+import json
+import time
+import urllib.parse
+
+import featurefile
+import persist
+import scoring
+
+Snapshot = collections.namedtuple(
+    "Snapshot",
+    "version rows names row_count refreshed_at scorer errors swapped_at swapped_mono "
+    "config_version origin_at published_at",
+)
+
+
+def _row_ok(row):
+    return (isinstance(row, (list, tuple)) and len(row) == 2
+            and isinstance(row[0], str) and row[0] and isinstance(row[1], str))
+
+
+def validate(rows, capacity=None, min_rows=0):
+    """Return a list of problems with a /bot_features `data` list (empty when valid)."""
+    if not isinstance(rows, list):
+        return [f"schema: data is {type(rows).__name__}, expected list"]
+
+    errors = []
+    seen = set()
+    for i, row in enumerate(rows):
+        if not _row_ok(row):
+            errors.append(f"schema: row {i} is {row!r}, expected [name, type]")
+            continue
+        if row[0] in seen:
+            errors.append(f"duplicate feature name: {row[0]}")
+        seen.add(row[0])
+    if capacity is not None and len(rows) > capacity:
+        errors.append(f"too many features: {len(rows)} > capacity {capacity}")
+    if len(rows) < min_rows:
+        errors.append(f"too few features: {len(rows)} < {min_rows}")
+    return errors
+
+
+class FeatureStore:
+    """Holds the active Snapshot. Only the fetcher thread calls candidate/publish/reject."""
+
+    def __init__(self, capacity=None, min_rows=0, slots=None, path=None):
+        self.capacity = capacity
+        self.min_rows = min_rows
+        # slots: 名称列表固定长度（FL2 预分配模拟），不足部分补 None
+        self.slots = slots
+        self.path = path
+        self.rejected = 0
+        self.last_rejected_errors = []
+        self.last_rejected_version = None
+        self.saved = 0
+        self.save_errors = 0
+        self.saved_at = None
+        self.restored_age = None
+        self.current = self._build((), "N/A", [])._replace(version=0)
+
+    def _build(self, rows, refreshed_at, errors, config_version=None, origin_at=None, published_at=None):
+        names = [row[0] for row in rows]
+        if self.slots is not None:
+            names = (names + [None] * self.slots)[:max(self.slots, len(names))]
+        return Snapshot(
+            version=None,
+            rows=rows,
+            names=tuple(names),
+            row_count=len(rows),
+            refreshed_at=refreshed_at,
+            scorer=scoring.compile(rows, refreshed_at),
+            errors=tuple(errors),
+            swapped_at=None,
+            swapped_mono=None,
+            config_version=config_version,
+            origin_at=origin_at,
+            published_at=published_at,
+        )
+
+    def candidate(self, data, refreshed_at, config_version=None, origin_at=None, published_at=None):
+        """
+        Validate a payload and build its Snapshot; None if it matches the active config.
+        config_version, origin_at and published_at are the payload's trace fields.
+        """
+        errors = validate(data, self.capacity, self.min_rows)
+        if not isinstance(data, list):
+            data = []
+        rows = tuple(tuple(row) for row in data if _row_ok(row))
+        current = self.current
+        if rows == current.rows and tuple(errors) == current.errors:
+            if config_version == current.config_version:
+                return None
+            # 行不变、版本变了（如从本地快照恢复后 worker 已发布新版本）：沿用编译好的评分器，只换追踪字段
+            return current._replace(refreshed_at=refreshed_at, config_version=config_version,
+                                    origin_at=origin_at, published_at=published_at)
+        return self._build(rows, refreshed_at, errors, config_version, origin_at, published_at)
+
+    def publish(self, snap):
+        snap = snap._replace(version=self.current.version + 1,
+                             swapped_at=time.time(), swapped_mono=time.monotonic())
+        # 单次引用赋值，读者要么看到旧快照，要么看到新快照
+        self.current = snap
+        if self.path and not snap.errors:
+            self._save(snap)
+        return snap
+
+    # ---------------------------
+    # 本地快照：只保存校验通过的配置（last-known-good）
+    # ---------------------------
+    def _save(self, snap):
+        refreshed_at = snap.refreshed_at if isinstance(snap.refreshed_at, int) else 0
+        try:
+            persist.write_atomic(self.path, featurefile.encode(snap.rows, snap.config_version or 0, refreshed_at,
+                                                               snap.published_at, snap.origin_at))
+        except OSError as e:
+            self.save_errors += 1
+            print(f"[SNAPSHOT] write {self.path} failed: {e}")
+            return
+        self.saved += 1
+        self.saved_at = time.time()
+
+    def restore(self):
+        """Publish the persisted last-known-good config; returns the Snapshot or None."""
+        if not self.path:
+            return None
+        # 损坏、截断或旧格式（JSON）的文件都按没有快照处理，不能让启动失败
+        try:
+            loaded, age = persist.read_mapped(self.path, featurefile.load)
+        except (OSError, ValueError, BufferError) as e:
+            print(f"[SNAPSHOT] ignoring {self.path}: {e}")
+            return None
+        if loaded is None:
+            return None
+        rows, header = loaded
+        snap = self.candidate(rows, header.refreshed_at or "N/A", header.version or None,
+                              header.origin_at, header.published_at)
+        if snap is None or snap.errors:
+            return None
+        path, self.path = self.path, None       # 刚读出的内容无需再写回
+        try:
+            snap = self.publish(snap)
+        finally:
+            self.path = path
+        self.restored_age = age
+        self.saved_at = time.time() - age
+        return snap
+
+    def reject(self, snap):
+        self.rejected += 1
+        self.last_rejected_errors = list(snap.errors)
+        self.last_rejected_version = snap.config_version
+
+    def trace(self, snap=None):
+        """Trace point for the active (or given) snapshot: when it was applied, and how long after its origin."""
+        snap = snap or self.current
+        applied = snap.swapped_at
+
+        def since(ts):
+            return round((applied - ts) * 1000, 3) if applied and ts else None
+
+        return {
+            "config_version": snap.config_version,
+            "origin_at": snap.origin_at,
+            "published_at": snap.published_at,
+            "applied_at": applied,
+            "propagation_ms": since(snap.origin_at),
+            "from_publish_ms": since(snap.published_at),
+        }
+
+    def stats(self):
+        snap = self.current
+        return {
+            "version": snap.version,
+            "config_version": snap.config_version,
+            "row_count": snap.row_count,
+            "refreshed_at": snap.refreshed_at,
+            "valid": not snap.errors,
+            "errors": list(snap.errors),
+            "swap_age_s": round(time.monotonic() - snap.swapped_mono, 3) if snap.swapped_mono else None,
+            "rejected": self.rejected,
+            "last_rejected_errors": self.last_rejected_errors,
+            "last_rejected_version": self.last_rejected_version,
+            "trace": self.trace(snap),
+            "snapshot": {
+                "path": self.path,
+                "restored_age_s": None if self.restored_age is None else round(self.restored_age, 3),
+                "saved": self.saved,
+                "save_errors": self.save_errors,
+                "age_s": None if self.saved_at is None else round(time.time() - self.saved_at, 3),
+            },
+        }
+
+
+# ================================
+# 拉取：条件请求 + 长轮询
+# ================================
+class FetchError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f"HTTP {status} {reason}")
+        self.status = status
+        self.reason = reason
+
+
+class FeatureSource:
+    """Conditional /bot_features client; fetch() returns the parsed payload, or None on 304."""
+
+    def __init__(self, url, long_poll=0, timeout=8, binary=True):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        self.long_poll = long_poll
+        self.timeout = timeout
+        self.binary = binary
+        self.etag = None
+        self.fetched = 0
+        self.not_modified = 0
+        self.read_seconds = 0.0          # 最近一次 200 响应的读取与解析耗时
+        self._conn = None
+
+    @property
+    def waiting(self):
+        """True when fetch() long-polls, so the caller need not sleep between fetches."""
+        return bool(self.long_poll and self.etag)
+
+    def fetch(self):
+        path = self.path
+        headers = {"Accept": featurefile.CONTENT_TYPE} if self.binary else {}
+        headers["Accept-Encoding"] = "gzip"
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+            if self.long_poll:
+                path += ("&" if "?" in path else "?") + f"wait={self.long_poll:g}"
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout + self.long_poll)
+        try:
+            self._conn.request("GET", path, headers=headers)
+            resp = self._conn.getresponse()
+            start = time.perf_counter()
+            raw = resp.read()
+        except Exception:
+            self.close()
+            raise
+
+        if resp.status == 304:
+            self.not_modified += 1
+            return None
+        if resp.status != 200:
+            raise FetchError(resp.status, resp.reason)
+        if resp.getheader("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        if (resp.getheader("Content-Type") or "").startswith(featurefile.CONTENT_TYPE):
+            rows, header = featurefile.load(raw)
+            data = {"data": rows, "refreshed_at": header.refreshed_at, "version": header.version,
+                    "published_at": header.published_at, "origin_at": header.origin_at}
+        else:
+            data = json.loads(raw)
+        self.read_seconds = time.perf_counter() - start
+        self.etag = resp.getheader("ETag")
+        self.fetched += 1
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self):
+        return {"fetched": self.fetched, "not_modified": self.not_modified, "long_poll": self.waiting,
+                "format": "bin" if self.binary else "json"}
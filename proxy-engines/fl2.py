@@ -2,16 +2,25 @@
 import socketserver
 import threading
 import json
-from collections import defaultdict
 import time
 import os
 import sys
 import traceback
 
 import http.server
-import http.client
 import urllib.parse
 
+import aio_engine
+import balancer
+import cache
+from counters import ShardedCounter, ShardedTopK
+import features
+import metrics
+import prefork
+import profiler
+import streaming
+from upstream import UpstreamPool
+
 # --- Ensure uncaught thread exceptions crash the whole process ---
 def _thread_excepthook(args):
     # args has: exc_type, exc_value, exc_traceback, thread
@@ -28,96 +37,301 @@ threading.excepthook = _thread_excepthook
 # ================================
 BACKEND_HOST = "customer-site"
 BACKEND_PORT = 443
+# 多个后端副本：host[:port] 逗号分隔，默认只有 BACKEND_HOST:BACKEND_PORT
+PROXY_BACKENDS = os.getenv("PROXY_BACKENDS", f"{BACKEND_HOST}:{BACKEND_PORT}")
 PROXY_PORT = 50001
 INTERVAL = 15   # 特征接口拉取间隔（秒）
 
-FEATURES_URL = "http://worker-asia:8081/bot_features"
+FEATURES_URL = os.getenv("FEATURES_URL", "http://worker-asia:8081/bot_features")
+# 长轮询等待时间（秒）：worker 在特征变化前挂起请求，变化后立即返回；
+# 0 → 每 INTERVAL 秒做一次条件请求（未变化时返回 304）
+FEATURES_LONG_POLL = float(os.getenv("FEATURES_LONG_POLL", "30"))
+# /bot_features 载荷格式：bin → 二进制特征文件（原地解析）；json → 原 JSON
+FEATURES_FORMAT = os.getenv("FEATURES_FORMAT", "bin").lower()
+
+# 上游 keep-alive 连接池（每个 host 的连接数上限 / 空闲回收时间）
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "64"))
+UPSTREAM_IDLE_TIMEOUT = float(os.getenv("UPSTREAM_IDLE_TIMEOUT", "30"))
+
+# /stats 中按路径统计时保留的热门路径数
+STATS_TOP_PATHS = int(os.getenv("STATS_TOP_PATHS", "64"))
+
+# 服务模型：threading（每连接一个线程）或 asyncio（单线程事件循环）
+PROXY_ENGINE = os.getenv("PROXY_ENGINE", "threading").lower()
+
+# worker 进程数：1 为单进程；>1 时预 fork 多个 worker 通过 SO_REUSEPORT 共享端口；0 表示每个 CPU 一个
+PROXY_WORKERS = int(os.getenv("PROXY_WORKERS", "1")) or os.cpu_count()
+PROXY_RUN_DIR = os.getenv("PROXY_RUN_DIR", f"/tmp/proxy-fl2-{PROXY_PORT}")
+
+# 响应缓存（仅 threading 引擎）：字节预算，0 表示关闭；单个对象上限；响应未给出缓存头时的默认 TTL（秒）
+PROXY_CACHE_BYTES = int(os.getenv("PROXY_CACHE_BYTES", "0"))
+PROXY_CACHE_MAX_OBJECT = int(os.getenv("PROXY_CACHE_MAX_OBJECT", str(1024 * 1024)))
+PROXY_CACHE_DEFAULT_TTL = int(os.getenv("PROXY_CACHE_DEFAULT_TTL", "0"))
+PROXY_CACHE_COALESCE_TIMEOUT = 10   # 等待同 key 首个请求回源的最长时间
+
+# bot 评分阈值：特征配置有效时，评分 >= 阈值的 "/" 请求按 bot 处理（评分范围 [0, 1]）
+BOT_SCORE_THRESHOLD = float(os.getenv("BOT_SCORE_THRESHOLD", "0.5"))
+
+# 特征配置校验失败时：apply → 照常处理（超出预分配容量即 panic，复现故障）；keep → 保留上一份有效配置
+FEATURES_ON_INVALID = os.getenv("FEATURES_ON_INVALID", "apply").lower()
+
+# 最近一份有效特征配置的本地快照：每次生效时原子写入，启动时 mmap 读回；空字符串关闭
+FEATURES_SNAPSHOT = os.getenv("FEATURES_SNAPSHOT", f"/tmp/proxy-fl2-{PROXY_PORT}.features")
 
 # ================================
 # 缓存 & 统计
 # ================================
-_ck_cache_lock = threading.Lock()
-_ck_last_row_count = 0
-_ck_last_update_ts = 0
-
-_stats_lock = threading.Lock()
-_stats = {
-    "total": 0,
-    "by_method": defaultdict(int),
-    "by_path": defaultdict(int),
-}
+_upstream = UpstreamPool(max_per_host=UPSTREAM_POOL_SIZE,
+                         idle_timeout=UPSTREAM_IDLE_TIMEOUT, timeout=10)
 
-# bot 请求计数
-_bot_lock = threading.Lock()
-_bot_count = 0
+# 后端选择：两两随机比较 (in-flight + 1) * EWMA 延迟；5xx / 超时被动摘除，恢复后慢启动
+_balancer = balancer.Balancer(balancer.parse(PROXY_BACKENDS, BACKEND_PORT))
+
+_cache = (cache.Cache(PROXY_CACHE_BYTES, PROXY_CACHE_MAX_OBJECT, PROXY_CACHE_DEFAULT_TTL)
+          if PROXY_CACHE_BYTES > 0 else None)
+
+# 请求计数：每个线程写自己的分片，读 /stats 时才合并（热路径无锁）；
+# 路径只保留 top-K（space-saving），随机 URL 扫描不会让内存增长
+_counters = ShardedCounter()            # key: 请求方法 / "bot" / "bot_scored"
+_top_paths = ShardedTopK(STATS_TOP_PATHS)
+
+# 延迟直方图（/stats 给出 p50/p99/p999，/metrics 为 Prometheus 文本格式）
+_metrics = metrics.Registry()
+_request_latency = {
+    route: _metrics.histogram("proxy_request_seconds", "End-to-end request latency by route", route=route)
+    for route in ("/", "/stats", "/metrics", "/debug/profile", "other")
+}
+_upstream_latency = _metrics.histogram("proxy_upstream_seconds", "Upstream forward time, request sent to body relayed")
+_bot_check_latency = _metrics.histogram("proxy_bot_check_seconds", "Bot-manager decision time for /")
+_feature_fetch_latency = _metrics.histogram("proxy_feature_fetch_seconds", "Feature payload download, parse and snapshot build time")
+_propagation_latency = _metrics.histogram("proxy_config_propagation_seconds",
+                                          "Seconds from the worker's ClickHouse query to this proxy applying the config")
 
 # ================================
 # Rust append_with_names 模拟：启动时预分配固定 4 个 slot
 # ================================
-_feature_lock = threading.Lock()
 _prealloc_size = 4
-_feature_names = [None] * _prealloc_size   # 固定长度 4
+
+# 特征配置快照：后台线程校验后整体替换，请求线程只读 _features.current（无锁）；
+# 快照中的 names 固定为 _prealloc_size 个 slot
+_features = features.FeatureStore(capacity=_prealloc_size, slots=_prealloc_size,
+                                  path=FEATURES_SNAPSHOT or None)
+_source = features.FeatureSource(FEATURES_URL, long_poll=FEATURES_LONG_POLL,
+                                 binary=FEATURES_FORMAT == "bin")
 
 
 # ================================
 # 特征接口后台轮询（含 Rust unwrap 行为模拟）
 # ================================
-def features_background_worker():
-    global _ck_last_row_count, _ck_last_update_ts, _feature_names, _prealloc_size
+def _applied(snap):
+    """Trace point: a config version is now served here; returns the log suffix."""
+    trace = _features.trace(snap)
+    if trace["propagation_ms"] is None:
+        return f"config={snap.config_version}"
+    _propagation_latency.record(trace["propagation_ms"] / 1000)
+    return f"config={snap.config_version}, {trace['propagation_ms']:.1f}ms after origin"
 
-    parsed = urllib.parse.urlparse(FEATURES_URL)
-    conn_host = parsed.hostname
-    conn_port = parsed.port or 80
-    path = parsed.path + ("?" + parsed.query if parsed.query else "")
 
+def features_background_worker():
     while True:
-        conn = http.client.HTTPConnection(conn_host, conn_port, timeout=8)
-        conn.request("GET", path)
-        resp = conn.getresponse()
-
-        if resp.status == 200:
-            raw = resp.read()
-            data = json.loads(raw)
-            rows = len(data.get("data", []))
-            refreshed_at = data.get("refreshed_at", "N/A")
-
-            incoming = data.get("data", [])
-            names = [row[0] for row in incoming]
-
-            # ======================================================
-            # Rust append_with_names 行为模拟 —— 使用固定预分配空间
-            # ======================================================
-
-            seen = set()
-            new_list = [None] * _prealloc_size
-
-            for i, name in enumerate(names):
-
-                # 重名 => no unwrap error
-                if name in seen:
-                    print(f"Duplicate feature name detected: {name}")
+        # 长轮询时请求会挂起到特征变化或超时（304）；连接失败等异常照旧使线程崩溃
+        try:
+            data = _source.fetch()
+        except features.FetchError as e:
+            print(f"[FEATURES] {e}")
+            time.sleep(INTERVAL)
+            continue
 
-                seen.add(name)
+        if data is not None:
+            refreshed_at = data.get("refreshed_at", "N/A")
 
-                if i > _prealloc_size - 1:
+            # 校验与快照构建都在本线程完成，请求线程只看到替换后的结果
+            start = time.perf_counter()
+            snap = _features.candidate(data.get("data", []), refreshed_at, data.get("version"),
+                                       data.get("origin_at"), data.get("published_at"))
+            _feature_fetch_latency.record(_source.read_seconds + time.perf_counter() - start)
+
+            if snap is None:
+                pass
+            elif snap.errors and FEATURES_ON_INVALID == "keep":
+                _features.reject(snap)
+                print(f"[FEATURES] Rejected refreshed_at={refreshed_at}, "
+                      f"keeping version {_features.current.version}: {'; '.join(snap.errors)}")
+            else:
+                # ======================================================
+                # Rust append_with_names 行为模拟 —— 使用固定预分配空间
+                # ======================================================
+                for error in snap.errors:
+                    # 重名 => no unwrap error
+                    if error.startswith("duplicate"):
+                        print(f"Duplicate feature name detected: {error.split(': ', 1)[1]}")
+
+                if snap.row_count > _prealloc_size:
                     raise RuntimeError("thread fl2_worker_thread panicked: called Result::unwrap() on an Err value")
 
-            # 有效更新
-            with _feature_lock:
-                _feature_names = new_list
-
-            with _ck_cache_lock:
-                _ck_last_row_count = rows
-                _ck_last_update_ts = time.time()
+                snap = _features.publish(snap)
+                print(f"[FEATURES] Updated names={list(snap.names)}, refreshed_at={refreshed_at}, "
+                      f"version={snap.version}, {_applied(snap)}")
 
-            print(f"[FEATURES] Updated names={_feature_names}, refreshed_at={refreshed_at}")
+        if not _source.waiting:
+            time.sleep(INTERVAL)
 
-        else:
-            print(f"[FEATURES] HTTP {resp.status} {resp.reason}")
 
-        conn.close()
+# ================================
+# 统计 & 路由（threading / asyncio 引擎共用）
+# ================================
+BOT_MESSAGE = "Hello bot, have a nice day!\n"
+
+
+def _record(method, path):
+    _counters.add(method)
+    _top_paths.add(path)
+
+
+def _record_bot():
+    _counters.add("bot")
+
+
+def _stats_payload():
+    counts = _counters.snapshot()
+    bot = counts.pop("bot", 0)
+    scored = counts.pop("bot_scored", 0)
+    total = sum(counts.values())
+    top = _top_paths.top()
+    payload = {
+        "total": total,
+        "by_method": dict(counts),
+        "by_path": {path: count for path, count, _ in top},
+        # top-K 计数的最大高估值
+        "by_path_max_error": max((error for _, _, error in top), default=0),
+        "bot_requests": bot,
+        # 其中由特征评分判定为 bot 的请求数
+        "bot_scored_requests": scored,
+        "human_requests": total - bot,
+    }
+
+    payload["upstream_pool"] = _upstream.stats()
+    payload["backends"] = _balancer.stats()
+    if _cache is not None:
+        payload["cache"] = _cache.stats()
+    payload["latency"] = _metrics.export()
+    payload["features"] = _features.stats()
+    payload["features"]["source"] = _source.stats()
+    return payload
+
+
+def _observe_request(path, seconds):
+    # 路由标签固定，避免按原始路径产生无限多的序列
+    _request_latency.get(path, _request_latency["other"]).record(seconds)
+
+
+def _render_stats(payload):
+    """/stats JSON from a (possibly worker-merged) payload."""
+    payload["latency"] = metrics.summarize(payload["latency"])
+    if "cache" in payload:
+        payload["cache"]["hit_ratio"] = cache.hit_ratio(payload["cache"])
+    # 各 worker 拉取同一份特征，评分器取本进程的
+    payload["scorer"] = dict(_features.current.scorer.describe(), threshold=BOT_SCORE_THRESHOLD)
+    return payload
+
+
+def _render_metrics(payload):
+    """Prometheus text from a (possibly worker-merged) payload."""
+    samples = [("proxy_requests_total", "counter", "Requests routed, by method", {"method": m}, n)
+               for m, n in sorted(payload["by_method"].items())]
+    samples.append(("proxy_bot_requests_total", "counter", "Requests answered by the bot check", {},
+                    payload["bot_requests"]))
+    samples.append(("proxy_bot_scored_requests_total", "counter", "Requests classified as bot by the feature scorer", {},
+                    payload["bot_scored_requests"]))
+    for key, value in sorted(payload.get("cache", {}).items()):
+        if key not in ("entries", "bytes", "budget"):
+            samples.append((f"proxy_cache_{key}_total", "counter", f"Response cache {key.replace('_', ' ')}", {}, value))
+    feats = payload["features"]
+    samples.append(("proxy_feature_config_version", "gauge", "Active feature config snapshot version", {},
+                    feats["version"]))
+    if feats["config_version"] is not None:
+        samples.append(("proxy_feature_config_source_version", "gauge", "Worker config version of the active snapshot",
+                        {}, feats["config_version"]))
+    samples.append(("proxy_feature_config_rejected_total", "counter", "Feature payloads rejected by validation", {},
+                    feats["rejected"]))
+    if feats["swap_age_s"] is not None:
+        samples.append(("proxy_feature_config_swap_age_seconds", "gauge", "Seconds since the active snapshot was swapped in",
+                        {}, feats["swap_age_s"]))
+    if feats["snapshot"]["age_s"] is not None:
+        samples.append(("proxy_feature_snapshot_age_seconds", "gauge", "Seconds since the last-known-good snapshot was written",
+                        {}, feats["snapshot"]["age_s"]))
+    for key in ("hits", "misses", "waits", "retries"):
+        samples.append((f"proxy_upstream_pool_{key}_total", "counter", f"Upstream pool {key}", {},
+                        payload["upstream_pool"][key]))
+    return metrics.render_prometheus(payload["latency"], samples)
+
+
+def _route(method, path, headers):
+    """
+    Decide how a GET/POST is served: "stats", "metrics", "profile", "threads", "bot" or "forward".
+    Forwarded requests are counted here, bot replies when they are served.
+    `headers` needs .get(lowercase_name) and len() (HTTPMessage or the asyncio head).
+    """
+    if path == "/":
+        start = time.perf_counter()
+        snap = _features.current
+        forward = method != "POST" and 2 < len(snap.names) < 6
+        # 配置有效时再按特征评分判断
+        if forward and snap.scorer.score(method, path, headers) >= BOT_SCORE_THRESHOLD:
+            forward = False
+            _counters.add("bot_scored")
+        _bot_check_latency.record(time.perf_counter() - start)
+
+        if forward:
+            _record(method, path)
+            return "forward"
+        return "bot"
+
+    if path == "/stats":
+        return "stats"
+    if path == "/metrics":
+        return "metrics"
+    if path == "/debug/profile":
+        return "profile"
+    if path == "/debug/threads":
+        return "threads"
+
+    _record(method, path)
+    return "forward"
+
+
+def _cache_revalidate(key, entry):
+    """Background refresh of a stale cache entry, conditional when it has a validator."""
+    headers = dict(entry.request_headers)
+    if entry.header("etag"):
+        headers["If-None-Match"] = entry.header("etag")
+    if entry.header("last-modified"):
+        headers["If-Modified-Since"] = entry.header("last-modified")
+
+    backend = _balancer.pick()
+    headers["Host"] = backend.name
+    _balancer.begin(backend)
+    start = time.perf_counter()
+    try:
+        conn, resp = _upstream.request(backend.host, backend.port, "GET", key[0], body=None, headers=headers)
+    except Exception:
+        _balancer.done(backend, time.perf_counter() - start, ok=False)
+        raise
+    _balancer.done(backend, time.perf_counter() - start, ok=resp.status < 500)
+    if resp.status != 304 and not _cache.storable(resp.status, resp.headers):
+        _upstream.discard(conn)
+        return None
+    try:
+        data = resp.read()
+    except Exception:
+        _upstream.discard(conn)
+        raise
+    _upstream.release(conn)
 
-        time.sleep(INTERVAL)
+    if resp.status == 304:
+        _cache.refresh(key, entry, resp.headers)
+        return entry
+    return _cache.store(key, resp.status, resp.reason, resp.headers, data, entry.request_headers)
 
 
 # ================================
@@ -125,6 +339,8 @@ def features_background_worker():
 # ================================
 class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     daemon_threads = True
+    allow_reuse_port = PROXY_WORKERS > 1
+    request_queue_size = 128       # 默认 5：突发的并发连接会触发 SYN 重传（约 1 s）
 
 
 # ================================
@@ -132,29 +348,11 @@ class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
 # ================================
 class ProxyHandler(http.server.BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
-
-    def _record(self, method, path):
-        with _stats_lock:
-            _stats["total"] += 1
-            _stats["by_method"][method] += 1
-            _stats["by_path"][path] += 1
-
-    def _record_bot(self):
-        global _bot_count
-        with _bot_lock:
-            _bot_count += 1
+    # 响应头与响应体分两次写出，keep-alive 连接上需关闭 Nagle，否则会遇到 40ms 延迟确认
+    disable_nagle_algorithm = True
 
     def _serve_stats(self):
-        with _stats_lock:
-            payload = {
-                "total": _stats["total"],
-                "by_method": dict(_stats["by_method"]),
-                "by_path": dict(_stats["by_path"]),
-            }
-        with _bot_lock:
-            payload["bot_requests"] = _bot_count
-            payload["human_requests"] = _stats["total"] - _bot_count
-
+        payload = _render_stats(prefork.collect(_stats_payload))
         body = json.dumps(payload, ensure_ascii=False, indent=2).encode()
         self.send_response(200)
         self.send_header("Content-Type", "application/json; charset=utf-8")
@@ -162,13 +360,45 @@ class ProxyHandler(http.server.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(body)
 
+    def _serve_metrics(self):
+        body = _render_metrics(prefork.collect(_stats_payload)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_simple(self, status, body, content_type="text/plain; charset=utf-8", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for header, value in headers:
+            self.send_header(header, str(value))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_profile(self):
+        # 在本请求线程里采样，空闲时没有任何开销
+        try:
+            seconds, hz = profiler.parse_query(urllib.parse.urlsplit(self.path).query)
+        except ValueError as e:
+            return self._send_simple(400, f"bad profile parameters: {e}\n".encode())
+        result = profiler.profile(seconds, hz)
+        if result is None:
+            return self._send_simple(409, b"a profile is already running\n")
+        text, samples = result
+        self._send_simple(200, text.encode(), headers=(("X-Profile-Samples", samples), ("X-Profile-Pid", os.getpid())))
+
+    def _serve_threads(self):
+        body = json.dumps(profiler.threads(), ensure_ascii=False, indent=2).encode()
+        self._send_simple(200, body, "application/json; charset=utf-8")
+
     # ===============================
     # AI bot 判断逻辑（可自行修改）
     # ===============================
     def _serve_ai_check(self):
-        msg = "Hello bot, have a nice day!\n"
-        self._record_bot()      
-        body = msg.encode("utf-8")
+        _record_bot()
+        body = BOT_MESSAGE.encode("utf-8")
         self.send_response(200)
         self.send_header("Content-Type", "text/plain; charset=utf-8")
         self.send_header("Content-Length", str(len(body)))
@@ -177,73 +407,183 @@ class ProxyHandler(http.server.BaseHTTPRequestHandler):
 
     # --------------------------- backend forward
     def _forward(self):
-        length = int(self.headers.get("Content-Length", "0"))
-        body = self.rfile.read(length) if length > 0 else None
+        start = time.perf_counter()
+        try:
+            self._forward_upstream()
+        finally:
+            _upstream_latency.record(time.perf_counter() - start)
+
+    def _forward_upstream(self):
+        try:
+            body, length = streaming.request_body(self.rfile, self.headers)
+        except (ValueError, streaming.BodyError) as e:
+            self.close_connection = True
+            self.send_error(400, f"Bad request body: {e}")
+            return
 
         forward_headers = {k: v for k, v in self.headers.items()
-                           if k.lower() not in (
-                               "host", "connection", "keep-alive", "proxy-authenticate",
-                               "proxy-authorization", "te", "trailers",
-                               "transfer-encoding", "upgrade"
-                           )}
-        forward_headers["Host"] = f"{BACKEND_HOST}:{BACKEND_PORT}"
-
-        conn = http.client.HTTPConnection(BACKEND_HOST, BACKEND_PORT, timeout=10)
+                           if k.lower() not in streaming.HOP_BY_HOP
+                           and k.lower() not in ("host", "content-length")}
+        if length:
+            forward_headers["Content-Length"] = str(length)
+        # length 为 None（chunked 上传）时由 http.client 重新按 chunked 编码
+
+        if _cache is not None and body is None and cache.request_cacheable(self.command, self.headers):
+            key = self._serve_cached(_cache.key(self.path, self.headers))
+            if key is None:
+                return
+            # 未命中且无人在回源：由本请求回源并填充缓存，结束后唤醒等待者
+            entry = None
+            try:
+                entry = self._fill_cache(key, forward_headers)
+            finally:
+                _cache.finish(key, entry)
+            return
+
+        sent = self._request_upstream(body, forward_headers)
+        if sent is not None:
+            self._relay(*sent)
+
+    def _request_upstream(self, body, forward_headers):
+        """(conn, resp) from the upstream pool, or None after an error reply."""
+        backend = _balancer.pick()
+        forward_headers["Host"] = backend.name
+        _balancer.begin(backend)
+        start = time.perf_counter()
         try:
-            conn.request(self.command, self.path, body=body, headers=forward_headers)
-            resp = conn.getresponse()
-            resp_body = resp.read()
+            conn, resp = _upstream.request(backend.host, backend.port, self.command, self.path,
+                                           body=body, headers=forward_headers)
+        except streaming.BodyError as e:
+            # 客户端请求体的问题，不计入后端健康
+            _balancer.done(backend, time.perf_counter() - start, ok=True)
+            self.close_connection = True
+            self.send_error(400, f"Bad request body: {e}")
+            return None
         except Exception as e:
+            _balancer.done(backend, time.perf_counter() - start, ok=False)
+            if not isinstance(body, (bytes, type(None))):
+                # 请求体可能只读了一部分，客户端连接已不同步
+                self.close_connection = True
             self.send_error(502, f"Bad gateway: {e}")
-            return
-        finally:
-            conn.close()
+            return None
+        _balancer.done(backend, time.perf_counter() - start, ok=resp.status < 500)
+        return conn, resp
+
+    def _relay(self, conn, resp):
+        # 上游给出长度则原样透传，否则对 HTTP/1.1 客户端改用 chunked 流式返回
+        resp_length = resp.getheader("Content-Length")
+        has_body = self.command != "HEAD" and resp.status not in (204, 304) and resp.status >= 200
+        chunked = resp_length is None and has_body and self.request_version != "HTTP/1.0"
 
         self.send_response(resp.status, resp.reason)
         for header, value in resp.getheaders():
-            if header.lower() in ("transfer-encoding", "connection", "keep-alive",
-                                  "proxy-authenticate", "proxy-authorization",
-                                  "te", "trailers", "upgrade", "content-length"):
+            if header.lower() in streaming.HOP_BY_HOP or header.lower() == "content-length":
                 continue
             self.send_header(header, value)
-        self.send_header("Content-Length", str(len(resp_body)))
+        if resp_length is not None:
+            self.send_header("Content-Length", resp_length)
+        elif chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        elif has_body:
+            # HTTP/1.0 客户端且长度未知：以关闭连接作为结束标志
+            self.send_header("Connection", "close")
+            self.close_connection = True
         self.end_headers()
-        self.wfile.write(resp_body)
-
-    # --------------------------- routes
-    def do_GET(self):
-        parsed = urllib.parse.urlsplit(self.path)
-
-        if parsed.path == "/":
-            rows = len(_feature_names)
-            if 2 < rows < 6:
-                self._record("POST", parsed.path)
-                return self._forward()
-            else:
-                return self._serve_ai_check()
 
-        if parsed.path == "/stats":
-            return self._serve_stats()
-
-        self._record("GET", parsed.path)
-        self._forward()
-
-    def do_POST(self):
-        parsed = urllib.parse.urlsplit(self.path)
+        try:
+            streaming.copy_response(resp, self.wfile, chunked)
+        except Exception:
+            # 响应头已发出，只能同时断开上下游连接
+            _upstream.discard(conn)
+            self.close_connection = True
+            return
+        _upstream.release(conn)
+
+    # ---------------------------
+    # Response cache
+    # ---------------------------
+    def _serve_cached(self, key):
+        """
+        Answer from the cache (fresh, stale-while-revalidate, or another request's fetch).
+        None if answered; otherwise the key this request must fetch itself and then pass
+        to _cache.finish().
+        """
+        entry, state = _cache.lookup(key)
+        while entry is None:
+            flight = _cache.join(key)
+            if flight is None:
+                return key
+            entry = _cache.wait(flight, PROXY_CACHE_COALESCE_TIMEOUT, self.headers)
+            if entry is not None:
+                state = "coalesced"
+                break
+            # 首个请求的响应不可缓存、超时，或其 Vary 选中的请求头与本请求不同：
+            # 按已学到的 Vary 重新计算键，键变了就重新查找，否则轮到本请求回源
+            rekeyed = _cache.key(self.path, self.headers)
+            if rekeyed != key:
+                key = rekeyed
+                entry, state = _cache.lookup(key)
+        if state == "stale":
+            _cache.revalidate(key, entry, _cache_revalidate)
+
+        self._write_entry(entry, state)
+        return None
+
+    def _fill_cache(self, key, forward_headers):
+        sent = self._request_upstream(None, forward_headers)
+        if sent is None:
+            return None
+        conn, resp = sent
+        if not _cache.storable(resp.status, resp.headers):
+            self._relay(conn, resp)
+            return None
+        try:
+            data = resp.read()
+        except Exception as e:
+            _upstream.discard(conn)
+            self.send_error(502, f"Bad gateway: {e}")
+            return None
+        _upstream.release(conn)
 
-        if parsed.path == "/":
-            return self._serve_ai_check()
+        entry = _cache.store(key, resp.status, resp.reason, resp.headers, data, forward_headers)
+        self._write_entry(entry, "miss")
+        return entry
 
-        if parsed.path == "/stats":
-            return self._serve_stats()
+    def _write_entry(self, entry, state):
+        self.send_response(entry.status, entry.reason)
+        for header, value in entry.headers:
+            self.send_header(header, value)
+        self.send_header("Age", str(int(entry.age())))
+        self.send_header("X-Cache", state.upper())
+        self.send_header("Content-Length", str(len(entry.body)))
+        self.end_headers()
+        self.wfile.write(entry.body)
 
-        self._record("POST", parsed.path)
-        self._forward()
+    # --------------------------- routes
+    def _dispatch(self):
+        start = time.perf_counter()
+        path = urllib.parse.urlsplit(self.path).path
+        action = _route(self.command, path, self.headers) if self.command in ("GET", "POST") else "forward"
+        if action == "stats":
+            self._serve_stats()
+        elif action == "metrics":
+            self._serve_metrics()
+        elif action == "profile":
+            self._serve_profile()
+        elif action == "threads":
+            self._serve_threads()
+        elif action == "bot":
+            self._serve_ai_check()
+        else:
+            self._forward()
+        _observe_request(path, time.perf_counter() - start)
 
-    do_HEAD   = _forward
-    do_PUT    = _forward
-    do_DELETE = _forward
-    do_PATCH  = _forward
+    do_GET    = _dispatch
+    do_POST   = _dispatch
+    do_HEAD   = _dispatch
+    do_PUT    = _dispatch
+    do_DELETE = _dispatch
+    do_PATCH  = _dispatch
 
     def log_message(self, fmt, *args):
         print(f"{self.client_address[0]} - - [{self.log_date_time_string()}] {fmt % args}")
@@ -252,18 +592,39 @@ class ProxyHandler(http.server.BaseHTTPRequestHandler):
 # ================================
 # Start Server
 # ================================
-def run_server():
+def _serve():
+    """Run the feature refresh thread and the selected engine in this process (or worker)."""
     t = threading.Thread(target=features_background_worker, daemon=True, name="features_background_worker")
     t.start()
 
+    if PROXY_ENGINE == "asyncio":
+        aio_engine.run(sys.modules[__name__], reuse_port=PROXY_WORKERS > 1)
+        return
+
+    prefork.serve_stats(_stats_payload)
     server = ThreadingHTTPServer(("", PROXY_PORT), ProxyHandler)
-    print(f"Proxy FL2 listening on 0.0.0.0:{PROXY_PORT}")
-    print(f"Background features worker active, pulling {FEATURES_URL} every {INTERVAL}s...")
     try:
         server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def run_server():
+    print(f"Proxy FL2 ({PROXY_ENGINE}, {PROXY_WORKERS} worker(s)) listening on 0.0.0.0:{PROXY_PORT}")
+    if _cache is not None and PROXY_ENGINE != "threading":
+        print("[CACHE] PROXY_CACHE_BYTES only applies to the threading engine")
+    snap = _features.restore()
+    if snap is not None:
+        print(f"[SNAPSHOT] restored rows = {snap.row_count} (refreshed_at={snap.refreshed_at}), "
+              f"{_features.restored_age:.0f}s old")
+    print(f"Background features worker active, pulling {FEATURES_URL} every {INTERVAL}s...")
+    if PROXY_WORKERS > 1:
+        prefork.run(PROXY_WORKERS, _serve, PROXY_RUN_DIR)
+        return
+    try:
+        _serve()
     except KeyboardInterrupt:
         print("Shutting down proxy...")
-        server.shutdown()
 
 
 if __name__ == "__main__":
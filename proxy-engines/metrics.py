@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Log-bucketed latency histograms with /stats summaries and Prometheus text output.
+
+HDR-style layout: values are recorded in microseconds into SUB_BUCKETS linear
+sub-buckets per power of two (~3% relative error) up to MAX_SECONDS. Each thread
+records into its own bucket array, so record() is a thread-local lookup and a
+list increment; arrays are merged when exported.
+
+export() returns a JSON-able payload whose numbers can simply be summed across
+processes (pre-fork workers); summarize() and render_prometheus() work on that
+payload. The same file is used by proxy-engines/, kv-workers/ and customer-visits/.
+"""
+
+import threading
+
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_SECONDS = 120
+_MAX_US = MAX_SECONDS * 1_000_000
+_MAX_SHIFT = max(0, _MAX_US.bit_length() - SUB_BITS - 1)
+_NUM_BUCKETS = (_MAX_SHIFT + 2) * SUB_BUCKETS
+
+# Prometheus 导出的 le 边界（秒）
+PROM_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 活跃分片超过该数量时，注册新分片前先回收已结束线程的分片
+_FOLD_THRESHOLD = 256
+
+
+def bucket_index(us):
+    if us >= _MAX_US:
+        us = _MAX_US
+    shift = us.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return us
+    return shift * SUB_BUCKETS + (us >> shift)
+
+
+def bucket_bounds(idx):
+    """[low, high) of a bucket in microseconds."""
+    if idx < 2 * SUB_BUCKETS:
+        return idx, idx + 1
+    shift = idx // SUB_BUCKETS - 1
+    low = (idx - shift * SUB_BUCKETS) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []                          # [(thread, shard)]
+        self._retired = [0] * (_NUM_BUCKETS + 2)
+
+    def record(self, seconds):
+        # 分片布局：[各桶计数..., sum_us, max_us]
+        us = int(seconds * 1_000_000)
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._register()
+        shard[bucket_index(us)] += 1
+        shard[-2] += us
+        if us > shard[-1]:
+            shard[-1] = us
+
+    def _register(self):
+        shard = self._local.shard = [0] * (_NUM_BUCKETS + 2)
+        with self._lock:
+            if len(self._shards) >= _FOLD_THRESHOLD:
+                self._fold_dead()
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_dead(self):
+        live = []
+        retired = self._retired
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for i in range(_NUM_BUCKETS + 1):
+                retired[i] += shard[i]
+            retired[-1] = max(retired[-1], shard[-1])
+        self._shards = live
+
+    def export(self):
+        with self._lock:
+            self._fold_dead()
+            shards = [self._retired] + [shard for _, shard in self._shards]
+        buckets = {}
+        sum_us = max_us = 0
+        for shard in shards:
+            for i in range(_NUM_BUCKETS):
+                n = shard[i]
+                if n:
+                    buckets[str(i)] = buckets.get(str(i), 0) + n
+            sum_us += shard[-2]
+            max_us = max(max_us, shard[-1])
+        return {
+            "name": self.name,
+            "help": self.help,
+            "labels": dict(self.labels),
+            "buckets": buckets,
+            "count": sum(buckets.values()),
+            "sum_us": sum_us,
+            "max_us": max_us,
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def histogram(self, name, help, **labels):
+        key = series_name(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(name, help, labels)
+        return hist
+
+    def export(self):
+        with self._lock:
+            histograms = list(self._histograms.items())
+        return {key: hist.export() for key, hist in histograms}
+
+
+def series_name(name, labels):
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+# ================================
+# 汇总 / 导出（基于 export() 的结果，可先跨进程合并）
+# ================================
+def percentile(buckets, count, q):
+    """Value (microseconds, bucket midpoint) at quantile q of an exported bucket dict."""
+    if not count:
+        return 0
+    rank = q * count
+    seen = 0
+    for idx in sorted(buckets, key=int):
+        seen += buckets[idx]
+        if seen >= rank:
+            low, high = bucket_bounds(int(idx))
+            return (low + high) / 2
+    return 0
+
+
+def summarize(exported):
+    """Turn exported histograms into {series: {count, mean_ms, p50_ms, p99_ms, p999_ms, max_ms}}."""
+    summary = {}
+    for key, h in exported.items():
+        count = h["count"]
+        max_us = h["max_us"]
+        # 桶中点可能超过实际最大值，按最大值截断
+        summary[key] = {
+            "count": count,
+            "mean_ms": round(h["sum_us"] / count / 1000, 3) if count else 0,
+            "p50_ms": round(min(percentile(h["buckets"], count, 0.50), max_us) / 1000, 3),
+            "p99_ms": round(min(percentile(h["buckets"], count, 0.99), max_us) / 1000, 3),
+            "p999_ms": round(min(percentile(h["buckets"], count, 0.999), max_us) / 1000, 3),
+            "max_ms": round(max_us / 1000, 3),
+        }
+    return summary
+
+
+def render_prometheus(exported, samples=()):
+    """
+    Prometheus text format (0.0.4) for exported histograms plus plain samples,
+    given as (name, type, help, labels, value) tuples.
+    """
+    lines = []
+    seen = set()
+    for name, kind, help, labels, value in samples:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{series_name(name, labels)} {value}")
+
+    for h in sorted(exported.values(), key=lambda h: h["name"]):
+        name = h["name"]
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {h['help']}")
+            lines.append(f"# TYPE {name} histogram")
+        # 按桶上界累加到各 le 边界
+        uppers = sorted((bucket_bounds(int(idx))[1], n) for idx, n in h["buckets"].items())
+        cumulative = 0
+        i = 0
+        for bound in PROM_BOUNDS:
+            limit = bound * 1_000_000
+            while i < len(uppers) and uppers[i][0] <= limit:
+                cumulative += uppers[i][1]
+                i += 1
+            lines.append(f"{series_name(name + '_bucket', dict(h['labels'], le=str(bound)))} {cumulative}")
+        lines.append(f"{series_name(name + '_bucket', dict(h['labels'], le='+Inf'))} {h['count']}")
+        lines.append(f"{series_name(name + '_sum', h['labels'])} {h['sum_us'] / 1_000_000}")
+        lines.append(f"{series_name(name + '_count', h['labels'])} {h['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Pre-fork worker mode for fl.py / fl2.py (PROXY_WORKERS=N).
+
+A supervisor process forks N workers; each worker binds PROXY_PORT itself with
+SO_REUSEPORT, so the kernel spreads incoming connections across them, and runs
+its own feature refresh thread. Dead workers (e.g. the FL2 config panic, which
+os._exit()s the process) are respawned, so a panic costs one worker instead of
+the whole container.
+
+Every worker also answers on a unix control socket in the run directory with
+its local /stats payload; `collect()` merges the payloads of all live workers.
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+RESPAWN_BACKOFF = 1.0     # 启动后 1 秒内退出的 worker，延迟重启，避免崩溃风暴
+CONTROL_TIMEOUT = 1.0
+
+# 数值字段默认求和；以下字段是状态量，合并时取最大值（版本取最新，快照年龄取最旧，传播耗时取最慢的 worker）
+GAUGES = frozenset({"max_us", "version", "row_count", "refreshed_at", "swap_age_s", "ewma_ms", "weight",
+                    "age_s", "restored_age_s", "config_version", "last_rejected_version", "origin_at",
+                    "published_at", "applied_at", "propagation_ms", "from_publish_ms"})
+
+worker_id = None          # 单进程模式下为 None
+_run_dir = None
+_local_stats = None
+
+
+# ================================
+# Supervisor
+# ================================
+def run(workers, start_worker, run_dir):
+    """Fork `workers` processes running start_worker(); respawn them until SIGTERM/SIGINT."""
+    global _run_dir
+    _run_dir = run_dir
+    os.makedirs(run_dir, exist_ok=True)
+    for name in os.listdir(run_dir):
+        if name.startswith("worker-") and name.endswith(".sock"):
+            os.unlink(os.path.join(run_dir, name))
+
+    children = {}      # pid -> worker id
+    started = {}       # worker id -> 启动时间
+    stopping = False
+
+    def spawn(idx):
+        pid = os.fork()
+        if pid == 0:
+            _worker_main(idx, start_worker)
+        children[pid] = idx
+        started[idx] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for idx in range(workers):
+        spawn(idx)
+    print(f"[PREFORK] supervisor {os.getpid()} started {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        idx = children.pop(pid, None)
+        if idx is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        print(f"[PREFORK] worker {idx} (pid {pid}) exited with {code}, respawning")
+        if time.monotonic() - started[idx] < RESPAWN_BACKOFF:
+            time.sleep(RESPAWN_BACKOFF)
+        if not stopping:
+            spawn(idx)
+    print("[PREFORK] supervisor stopped")
+
+
+def _worker_main(idx, start_worker):
+    global worker_id
+    worker_id = idx
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        start_worker()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+# ================================
+# Worker stats
+# ================================
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(json.dumps(_worker_payload(), ensure_ascii=False).encode())
+
+
+def _sock_path(idx):
+    return os.path.join(_run_dir, f"worker-{idx}.sock")
+
+
+def _worker_payload():
+    payload = _local_stats()
+    payload["pid"] = os.getpid()
+    return payload
+
+
+def serve_stats(local_stats):
+    """In a worker: answer sibling /stats requests with local_stats() on the control socket."""
+    global _local_stats
+    _local_stats = local_stats
+    if worker_id is None:
+        return
+    path = _sock_path(worker_id)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = _ControlServer(path, _ControlHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="prefork_control").start()
+
+
+def _fetch(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONTROL_TIMEOUT)
+        sock.connect(path)
+        chunks = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    return json.loads(b"".join(chunks))
+
+
+def collect(local_stats):
+    """local_stats() in single-process mode; the merged payload of all live workers otherwise."""
+    if worker_id is None:
+        return local_stats()
+
+    merged = {}
+    workers = {}
+    for name in sorted(os.listdir(_run_dir)):
+        if not (name.startswith("worker-") and name.endswith(".sock")):
+            continue
+        idx = int(name[len("worker-"):-len(".sock")])
+        try:
+            payload = _worker_payload() if idx == worker_id else _fetch(os.path.join(_run_dir, name))
+        except (OSError, ValueError):
+            # worker 正在重启，跳过
+            continue
+        workers[str(idx)] = {"pid": payload.pop("pid"), "total": payload.get("total", 0)}
+        merge(merged, payload)
+    merged["workers"] = workers
+    return merged
+
+
+def merge(into, payload):
+    """Add payload into `into`: numbers are summed (GAUGES keep the max), dicts merged recursively."""
+    for key, value in payload.items():
+        if isinstance(value, dict):
+            merge(into.setdefault(key, {}), value)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            into.setdefault(key, value)
+        elif key in GAUGES:
+            current = into.get(key)
+            into[key] = max(current, value) if isinstance(current, (int, float)) else value
+        else:
+            into[key] = into.get(key, 0) + value
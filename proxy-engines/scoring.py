@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Feature-driven bot scoring for the proxy engines.
+
+Every time features_background_worker pulls the feature rows, compile() turns
+them into a Scorer: each (name, type) row is bound to one request signal
+(SIGNAL_BINDINGS, otherwise a stable hash of the name) and weighted by its
+column type. Rows bound to the same signal are folded together, so the compiled
+evaluator is a flat array of signal indices and normalised weights; scoring a
+request walks that array without building any per-request structure.
+
+The score is the weighted mean of fired signals, in [0, 1]. Headers are read
+through `.get(lowercase_name)` and `len()`, which works for http.server's
+HTTPMessage, the asyncio engine's parsed head and plain lower-cased dicts.
+
+Offline replay of a request log (JSON lines with method/path/headers):
+
+    python scoring.py --features features.json --log requests.jsonl
+"""
+
+import argparse
+import json
+import zlib
+from array import array
+from itertools import repeat
+from operator import add, mul
+
+# ================================
+# 请求信号：每个函数返回 [0, 1]
+# ================================
+_TOOL_TOKENS = ("curl", "wget", "python", "go-http", "java/", "okhttp", "scrapy", "bot", "spider", "crawl")
+
+
+def _ua_missing(method, path, headers):
+    return 0.0 if headers.get("user-agent") else 1.0
+
+
+def _ua_tool(method, path, headers):
+    ua = headers.get("user-agent")
+    if not ua:
+        return 0.0
+    ua = ua.lower()
+    for token in _TOOL_TOKENS:
+        if token in ua:
+            return 1.0
+    return 0.0
+
+
+def _accept_missing(method, path, headers):
+    return 0.0 if headers.get("accept") else 1.0
+
+
+def _accept_language_missing(method, path, headers):
+    return 0.0 if headers.get("accept-language") else 1.0
+
+
+def _accept_encoding_missing(method, path, headers):
+    return 0.0 if headers.get("accept-encoding") else 1.0
+
+
+def _cookie_missing(method, path, headers):
+    return 0.0 if headers.get("cookie") else 1.0
+
+
+def _referer_missing(method, path, headers):
+    return 0.0 if headers.get("referer") else 1.0
+
+
+def _few_headers(method, path, headers):
+    return 1.0 if len(headers) < 4 else 0.0
+
+
+def _path_depth(method, path, headers):
+    depth = path.count("/")
+    return 1.0 if depth >= 8 else depth / 8
+
+
+def _is_post(method, path, headers):
+    return 1.0 if method == "POST" else 0.0
+
+
+SIGNALS = (
+    ("ua_missing", _ua_missing),
+    ("ua_tool", _ua_tool),
+    ("accept_missing", _accept_missing),
+    ("accept_language_missing", _accept_language_missing),
+    ("accept_encoding_missing", _accept_encoding_missing),
+    ("cookie_missing", _cookie_missing),
+    ("referer_missing", _referer_missing),
+    ("few_headers", _few_headers),
+    ("path_depth", _path_depth),
+    ("is_post", _is_post),
+)
+_SIGNAL_INDEX = {name: i for i, (name, _) in enumerate(SIGNALS)}
+
+# http_requests_features 的列与请求信号的绑定；其余列名按 crc32 稳定散列到某个信号
+SIGNAL_BINDINGS = {
+    "event_date": "path_depth",
+    "request_id": "ua_missing",
+    "feature_1": "ua_tool",
+    "feature_2": "accept_missing",
+}
+
+# 按 ClickHouse 列类型给权重
+TYPE_WEIGHTS = {"Date": 0.5, "DateTime": 0.5, "String": 1.0}
+_DEFAULT_TYPE_WEIGHT = 1.0
+
+
+def signal_for(name):
+    bound = SIGNAL_BINDINGS.get(name)
+    if bound is not None:
+        return _SIGNAL_INDEX[bound]
+    return zlib.crc32(name.encode("utf-8")) % len(SIGNALS)
+
+
+class Scorer:
+    """Compiled evaluator: parallel arrays of signal indices and normalised weights."""
+
+    __slots__ = ("version", "features", "indices", "weights", "_terms")
+
+    def __init__(self, rows, version=None):
+        per_signal = array("d", bytes(8 * len(SIGNALS)))
+        for row in rows:
+            name = row[0]
+            ftype = row[1] if len(row) > 1 else ""
+            per_signal[signal_for(name)] += TYPE_WEIGHTS.get(ftype, _DEFAULT_TYPE_WEIGHT)
+
+        total = sum(per_signal)
+        self.version = version
+        self.features = len(rows)
+        self.indices = array("B", (i for i, w in enumerate(per_signal) if w))
+        self.weights = array("d", (per_signal[i] / total for i in self.indices))
+        # 预先绑定 (信号函数, 权重)，评分时只做遍历与累加
+        self._terms = tuple((SIGNALS[i][1], w) for i, w in zip(self.indices, self.weights))
+
+    def score(self, method, path, headers):
+        score = 0.0
+        for signal, weight in self._terms:
+            score += weight * signal(method, path, headers)
+        return score
+
+    def score_batch(self, methods, paths, headers):
+        """
+        Score many requests column-at-a-time (one signal over all requests per pass).
+        Takes three parallel sequences, returns array('d') of scores.
+        """
+        scores = array("d", bytes(8 * len(methods)))
+        for signal, weight in self._terms:
+            column = map(mul, repeat(weight), map(signal, methods, paths, headers))
+            scores = array("d", map(add, scores, column))
+        return scores
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "features": self.features,
+            "signals": {SIGNALS[i][0]: round(w, 4) for i, w in zip(self.indices, self.weights)},
+        }
+
+
+def compile(rows, version=None):
+    """Compile feature rows [(name, type), ...] into a Scorer."""
+    return Scorer(rows, version)
+
+
+EMPTY = Scorer(())
+
+
+# ================================
+# 离线回放
+# ================================
+def load_log(path):
+    """Read a JSON-lines request log into parallel (methods, paths, headers) lists."""
+    methods, paths, headers = [], [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            methods.append(rec.get("method", "GET"))
+            paths.append(rec.get("path", "/"))
+            headers.append({k.lower(): v for k, v in rec.get("headers", {}).items()})
+    return methods, paths, headers
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a request log through the bot scorer.")
+    ap.add_argument("--features", required=True, help="/bot_features JSON response saved to a file")
+    ap.add_argument("--log", required=True, help="JSON lines: {method, path, headers}")
+    ap.add_argument("--threshold", type=float, default=0.5)
+    args = ap.parse_args()
+
+    with open(args.features, encoding="utf-8") as f:
+        data = json.load(f)
+    scorer = compile(data.get("data", []), data.get("refreshed_at"))
+    methods, paths, headers = load_log(args.log)
+    scores = scorer.score_batch(methods, paths, headers)
+
+    bots = sum(1 for s in scores if s >= args.threshold)
+    print(json.dumps(scorer.describe(), indent=2))
+    print(f"requests={len(scores)} bots={bots} ({bots / max(len(scores), 1):.2%}) threshold={args.threshold}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Fixed-buffer body streaming helpers for the proxy engines.
+
+Request bodies are read from the client in BUFFER_SIZE pieces (Content-Length or
+chunked) and handed to http.client as an iterator; upstream responses are copied
+back through one preallocated buffer, re-chunked when the length is unknown.
+Memory per request therefore stays at about one buffer whatever the body size.
+"""
+
+import threading
+
+BUFFER_SIZE = 64 * 1024
+
+_local = threading.local()
+
+# 逐跳（hop-by-hop）头，不转发
+HOP_BY_HOP = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade",
+))
+
+# 后端可能已处理过请求后才断开：只有幂等方法才能在已发出的连接上重放
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE", "OPTIONS"))
+
+
+class BodyError(Exception):
+    """Malformed request body framing (bad chunk size, truncated body, ...)."""
+
+
+def is_chunked(headers):
+    te = headers.get("Transfer-Encoding", "")
+    return "chunked" in te.lower()
+
+
+def request_body(rfile, headers):
+    """
+    Return (body, content_length) for http.client.
+
+    body is None when there is no body, otherwise an iterator of byte pieces.
+    content_length is None for chunked uploads (http.client then re-chunks).
+    """
+    if is_chunked(headers):
+        return iter_chunked(rfile), None
+    length = int(headers.get("Content-Length", "0"))
+    if length <= 0:
+        return None, 0
+    if length <= BUFFER_SIZE:
+        # 小请求体直接读入，保持可重放（连接池重试）
+        return _read_exact(rfile, length), length
+    return iter_fixed(rfile, length), length
+
+
+def iter_fixed(rfile, length):
+    remaining = length
+    while remaining:
+        piece = rfile.read(min(remaining, BUFFER_SIZE))
+        if not piece:
+            raise BodyError(f"client closed with {remaining} body bytes outstanding")
+        remaining -= len(piece)
+        yield piece
+
+
+def iter_chunked(rfile):
+    while True:
+        line = rfile.readline(1024)
+        if not line.endswith(b"\n"):
+            raise BodyError("truncated chunk size line")
+        try:
+            size = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise BodyError(f"invalid chunk size {line!r}")
+        if size == 0:
+            # 跳过 trailer，直到空行
+            while True:
+                trailer = rfile.readline(8192)
+                if trailer in (b"\r\n", b"\n", b""):
+                    return
+        yield from iter_fixed(rfile, size)
+        if rfile.readline(3) not in (b"\r\n", b"\n"):
+            raise BodyError("missing CRLF after chunk")
+
+
+def discard(body):
+    """Drain a body iterator so the client connection stays in sync."""
+    if body is not None and not isinstance(body, bytes):
+        for _ in body:
+            pass
+
+
+def copy_response(resp, wfile, chunked, buf=None):
+    """
+    Copy an http.client response body to wfile through one reusable buffer.
+    Returns the number of body bytes written.
+    """
+    if buf is None:
+        buf = _thread_buffer()
+    view = memoryview(buf)
+    total = 0
+    while True:
+        n = resp.readinto(buf)
+        if not n:
+            break
+        if chunked:
+            wfile.write(b"%x\r\n" % n)
+            wfile.write(view[:n])
+            wfile.write(b"\r\n")
+        else:
+            wfile.write(view[:n])
+        total += n
+    if chunked:
+        wfile.write(b"0\r\n\r\n")
+    return total
+
+
+def _thread_buffer():
+    # 每个处理线程复用一块缓冲区，转发路径上不再按请求分配
+    buf = getattr(_local, "buf", None)
+    if buf is None:
+        buf = _local.buf = bytearray(BUFFER_SIZE)
+    return buf
+
+
+def _read_exact(rfile, length):
+    data = rfile.read(length)
+    if len(data) != length:
+        raise BodyError(f"client sent {len(data)} of {length} body bytes")
+    return data
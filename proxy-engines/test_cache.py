@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Response cache single-flight through fl.ProxyHandler: concurrent cold misses
+share one upstream fetch only when the response's Vary selects the same
+request header values for them.
+
+    python -m unittest test_cache         # or: python -m pytest test_cache.py
+"""
+
+import http.client
+import http.server
+import threading
+import time
+import unittest
+
+import balancer
+import cache
+import fl
+
+UPSTREAM_DELAY = 0.3
+
+
+class VaryingHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fetches = 0
+
+    def do_GET(self):
+        type(self).fetches += 1
+        # 慢一点，保证第二个请求在首个请求回源期间到达
+        time.sleep(UPSTREAM_DELAY)
+        body = f"encoding={self.headers.get('Accept-Encoding')}".encode()
+        self.send_response(200)
+        self.send_header("Cache-Control", "public, max-age=60")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(handler):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class VaryCoalescingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fl.ProxyHandler.log_message = lambda *a: None
+        cls.backend = _serve(VaryingHandler)
+        cls.proxy = _serve(fl.ProxyHandler)
+        fl._balancer = balancer.Balancer([("127.0.0.1", cls.backend.server_address[1])])
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.proxy, cls.backend):
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        fl._cache = cache.Cache(1024 * 1024, 64 * 1024)
+        VaryingHandler.fetches = 0
+
+    def _get(self, encoding, out):
+        conn = http.client.HTTPConnection("127.0.0.1", self.proxy.server_address[1], timeout=10)
+        try:
+            conn.request("GET", "/page", headers={"Accept-Encoding": encoding})
+            resp = conn.getresponse()
+            out[encoding if encoding not in out else encoding + "#2"] = (
+                resp.read().decode(), resp.getheader("X-Cache"))
+        finally:
+            conn.close()
+
+    def _concurrent(self, *encodings):
+        out = {}
+        threads = []
+        for encoding in encodings:
+            t = threading.Thread(target=self._get, args=(encoding, out))
+            t.start()
+            threads.append(t)
+            time.sleep(UPSTREAM_DELAY / 4)
+        for t in threads:
+            t.join()
+        return out
+
+    def test_cold_requests_differing_in_vary_header_are_not_mixed(self):
+        out = self._concurrent("gzip", "identity")
+        self.assertEqual(out["gzip"][0], "encoding=gzip")
+        self.assertEqual(out["identity"][0], "encoding=identity")
+        self.assertEqual(VaryingHandler.fetches, 2)
+        # 两个变体随后都能命中
+        again = self._concurrent("gzip", "identity")
+        self.assertEqual({v[1] for v in again.values()}, {"HIT"})
+        self.assertEqual(VaryingHandler.fetches, 2)
+
+    def test_cold_requests_with_same_vary_header_coalesce(self):
+        out = self._concurrent("gzip", "gzip")
+        self.assertEqual(out["gzip"][0], "encoding=gzip")
+        self.assertEqual(out["gzip#2"], ("encoding=gzip", "COALESCED"))
+        self.assertEqual(VaryingHandler.fetches, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Restoring the on-disk feature snapshot must never stop a proxy from starting:
+a corrupt, truncated or pre-binary (JSON) file is ignored like a missing one.
+After a restore, the worker's newer config version is applied even when its
+rows match the snapshot, so propagation tracing sees it.
+
+    python -m unittest test_snapshot      # or: python -m pytest test_snapshot.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import featurefile
+import features
+import persist
+
+ROWS = [("event_date", "Date"), ("request_id", "UInt64"), ("feature_1", "String"), ("feature_2", "Float64")]
+
+
+class RestoreSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="snapshot-test-")
+        self.path = os.path.join(self.dir, "features")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _write(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def _restore(self):
+        return features.FeatureStore(path=self.path).restore()
+
+    def test_valid_file(self):
+        self._write(featurefile.encode(ROWS, 7, 1700000000))
+        snap = self._restore()
+        self.assertIsNotNone(snap)
+        self.assertEqual(snap.config_version, 7)
+        self.assertEqual(list(map(tuple, snap.rows)), ROWS)
+
+    def test_garbage_file(self):
+        self._write(os.urandom(4096))
+        self.assertIsNone(self._restore())
+
+    def test_legacy_json_snapshot(self):
+        # user-016 写的 JSON 快照，路径不变
+        self._write(json.dumps({"data": [list(r) for r in ROWS], "refreshed_at": 1700000000}).encode("utf-8"))
+        self.assertIsNone(self._restore())
+
+    def test_corrupt_files(self):
+        good = featurefile.encode(ROWS, 7, 1700000000)
+        bad_crc = bytearray(good)
+        bad_crc[-2] ^= 0xFF
+        for name, data in (("truncated", good[:-5]), ("short header", good[:10]),
+                           ("bad magic", b"XXXX" + good[4:]), ("bad crc", bytes(bad_crc))):
+            with self.subTest(name):
+                self._write(data)
+                self.assertIsNone(self._restore())
+
+    def test_fetch_after_restore_applies_newer_version_with_same_rows(self):
+        self._write(featurefile.encode(ROWS, 1, 1700000000))
+        store = features.FeatureStore(path=self.path)
+        restored = store.restore()
+        self.assertEqual(restored.config_version, 1)
+
+        # worker 已发布 v3，行与快照相同
+        snap = store.candidate([list(r) for r in ROWS], 1700000100, 3, 1700000090.0, 1700000095.0)
+        self.assertIsNotNone(snap)
+        self.assertIs(snap.scorer, restored.scorer)
+        store.publish(snap)
+        self.assertEqual(store.current.config_version, 3)
+        self.assertEqual(store.trace()["config_version"], 3)
+        self.assertEqual(store.current.origin_at, 1700000090.0)
+        # 同一版本再来一次：不重复发布
+        self.assertIsNone(store.candidate([list(r) for r in ROWS], 1700000100, 3, 1700000090.0, 1700000095.0))
+
+    def test_mapping_is_released_on_format_error(self):
+        # 解析失败时 mmap 必须能关闭：抛 FormatError 而不是 BufferError
+        self._write(b"XXXX" + bytes(64))
+        with self.assertRaises(featurefile.FormatError):
+            persist.read_mapped(self.path, featurefile.load)
+
+
+if __name__ == "__main__":
+    unittest.main()
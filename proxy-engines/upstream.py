@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Keep-alive upstream connection pool shared by the proxy engines (fl.py / fl2.py).
+
+Connections are kept per (host, port) with a hard size limit. Idle sockets are
+evicted after `idle_timeout` seconds and health-checked before reuse; a request
+that fails on a reused (stale) socket is retried on another one when that is
+safe: the request never left, or its method is idempotent.
+"""
+
+import collections
+import http.client
+import select
+import threading
+import time
+
+import streaming
+
+# 复用的连接在发送请求时若出现以下错误，说明后端已关闭该 keep-alive 连接
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within `wait_timeout`."""
+
+
+class _HostPool:
+    def __init__(self, lock):
+        self.idle = collections.deque()   # (conn, last_used)，右端为最近归还
+        self.open = 0                     # 已建立（空闲 + 借出）的连接数
+        self.cond = threading.Condition(lock)
+
+
+class UpstreamPool:
+    def __init__(self, max_per_host=64, idle_timeout=30.0, timeout=10.0, wait_timeout=5.0):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._stats = {
+            "hits": 0,        # 复用空闲连接
+            "misses": 0,      # 新建连接
+            "waits": 0,       # 连接数达到上限，需要等待归还
+            "wait_timeouts": 0,
+            "stale": 0,       # 健康检查失败而丢弃的空闲连接
+            "evicted": 0,     # 空闲超时而关闭的连接
+            "retries": 0,     # 复用连接失效后的透明重试
+        }
+
+    # ---------------------------
+    # acquire / release
+    # ---------------------------
+    def acquire(self, host, port):
+        """Return (conn, reused). Blocks up to `wait_timeout` when the host is at capacity."""
+        key = (host, port)
+        deadline = None
+        with self._lock:
+            hp = self._hosts.get(key)
+            if hp is None:
+                hp = self._hosts[key] = _HostPool(self._lock)
+
+            while True:
+                self._evict_idle(hp, time.monotonic())
+                while hp.idle:
+                    conn, _ = hp.idle.pop()
+                    if _is_alive(conn):
+                        self._stats["hits"] += 1
+                        return conn, True
+                    hp.open -= 1
+                    self._stats["stale"] += 1
+                    conn.close()
+
+                if hp.open < self.max_per_host:
+                    hp.open += 1
+                    self._stats["misses"] += 1
+                    break
+
+                if deadline is None:
+                    self._stats["waits"] += 1
+                    deadline = time.monotonic() + self.wait_timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["wait_timeouts"] += 1
+                    raise PoolTimeout(f"no upstream connection to {host}:{port} within {self.wait_timeout}s")
+                hp.cond.wait(remaining)
+
+        # 在锁外建立连接，避免阻塞其它线程
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def release(self, conn):
+        """Return a connection whose response has been fully read."""
+        with self._lock:
+            hp = self._hosts[(conn.host, conn.port)]
+            if conn.sock is None:
+                # http.client 已因 Connection: close 关闭了 socket
+                hp.open -= 1
+            else:
+                hp.idle.append((conn, time.monotonic()))
+            hp.cond.notify()
+
+    def discard(self, conn):
+        """Close a connection that must not be reused (error, partial read, ...)."""
+        conn.close()
+        with self._lock:
+            hp = self._hosts[(conn.host, conn.port)]
+            hp.open -= 1
+            hp.cond.notify()
+
+    def _evict_idle(self, hp, now):
+        # 左端最旧；依次关闭超过 idle_timeout 的连接
+        while hp.idle and now - hp.idle[0][1] > self.idle_timeout:
+            conn, _ = hp.idle.popleft()
+            hp.open -= 1
+            self._stats["evicted"] += 1
+            conn.close()
+
+    # ---------------------------
+    # request helper
+    # ---------------------------
+    def request(self, host, port, method, url, body=None, headers=None):
+        """
+        Send a request on a pooled connection and return (conn, resp).
+        The caller must read the response and then `release(conn)` or `discard(conn)`.
+        Only replayable bodies (None / bytes) are retried after a stale socket,
+        and once the request was sent, only for idempotent methods.
+        """
+        replayable = body is None or isinstance(body, (bytes, bytearray))
+        idempotent = method in streaming.IDEMPOTENT_METHODS
+        while True:
+            conn, reused = self.acquire(host, port)
+            sent = False
+            try:
+                conn.request(method, url, body=body, headers=headers or {})
+                sent = True
+                return conn, conn.getresponse()
+            except _STALE_ERRORS:
+                self.discard(conn)
+                if not (reused and replayable and (idempotent or not sent)):
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+            except BaseException:
+                self.discard(conn)
+                raise
+
+    # ---------------------------
+    # stats
+    # ---------------------------
+    def stats(self):
+        with self._lock:
+            payload = dict(self._stats)
+            payload["hosts"] = {
+                f"{host}:{port}": {"open": hp.open, "idle": len(hp.idle)}
+                for (host, port), hp in self._hosts.items()
+            }
+        return payload
+
+
+def _is_alive(conn):
+    """An idle keep-alive socket must not be readable: readable means EOF or unsolicited bytes."""
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable